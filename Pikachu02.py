@@ -1,74 +1,1020 @@
-from pyrogram import Client, filters, enums
-from pyrogram.types import Message, ChatPermissions, ChatPrivileges
-import asyncio
 import time
+BOOT_TIME = time.perf_counter()  # taken before the other imports so the startup report includes them
+
+from pyrogram import Client, ContinuePropagation, StopPropagation, filters, enums, idle
+from pyrogram.handlers import ChatMemberUpdatedHandler, MessageHandler
+from pyrogram.types import Message, ChatMemberUpdated, ChatPermissions, ChatPrivileges, User
+from pyrogram.errors import FloodWait
+import asyncio
+import contextlib
+import difflib
+import functools
+import heapq
+import inspect
+import io
+import itertools
+import multiprocessing
+import pickle
+import queue
+import random
+from array import array
 import re
+import json
+import os
+import sqlite3
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict, deque
 from datetime import datetime, timedelta
-from googletrans import Translator
 
 # --- CONFIG ---
 API_ID = 22397733
 API_HASH = "__"
 BOT_TOKEN = "__"
+DB_PATH = "group_bot.db"
+STORE_FLUSH_INTERVAL = 2.0     # seconds between write-behind flushes
+SETTINGS_CACHE_MAX_CHATS = 5000
+FLOOD_WAIT_RETRIES = 3         # FloodWait retries before an API call gives up
+PURGE_CHUNK = 100              # message IDs per delete_messages call (Telegram's limit)
+PURGE_CONCURRENCY = 4          # delete calls in flight per purge
+RECENT_MESSAGES_PER_CHAT = 500 # recent messages indexed per chat for /purge N, /purgeuser and duplicate checks
+RECENT_MESSAGES_MAX_CHATS = 2000
+PURGE_PROGRESS_INTERVAL = 2.0  # seconds between status message edits
+OUTBOUND_WORKERS = 8           # concurrent outbound API calls
+OUTBOUND_GLOBAL_RATE = 30.0    # sends/edits per second across all chats (split evenly between shards)
+OUTBOUND_GLOBAL_BURST = 30
+OUTBOUND_CHAT_RATE = 20 / 60   # sends/edits per second in one chat
+OUTBOUND_CHAT_BURST = 10
+OUTBOUND_MAX_CHATS = 10000     # per-chat buckets kept before the least recently used is dropped
+WELCOME_WINDOW = 3.0           # seconds of joins collected into one welcome message
+RAID_JOIN_RATE = 5.0           # joins per second that switch a chat into raid mode (0 = off)
+RAID_DETECT_WINDOW = 10.0      # seconds of joins the rate is measured over
+RAID_MODE_DURATION = 300       # seconds raid mode lasts after the last burst
+JOIN_LOG_SIZE = 1000           # recent joins remembered per chat
+TRANSLATE_WORKERS = 4          # threads running blocking translation calls
+TRANSLATE_CACHE_SIZE = 2048    # (text, language) results kept
+TRANSLATE_DEFAULT_LANG = "en"
+FLOOD_LIMIT = 8                # messages allowed per FLOOD_WINDOW before a flood mute (0 = off)
+FLOOD_WINDOW = 5.0             # seconds
+FLOOD_MUTE_MINUTES = 10
+FLOOD_MAX_LIMIT = 16           # largest per-chat limit; also the ring size per tracked user
+FLOOD_MAX_TRACKED = 50000      # (chat, user) pairs tracked before the least recently active is dropped
+FLOOD_IDLE_TTL = 60.0          # seconds of silence after which a pair is dropped
+DUPLICATE_LIMIT = 3            # identical messages from one user allowed per DUPLICATE_WINDOW (0 = off)
+DUPLICATE_WINDOW = 60          # seconds
+BULK_CONCURRENCY = 5           # ban/restrict calls in flight for one /massban-style command
+SCHEDULER_BATCH = 500          # due jobs fired per scheduler wake-up
+SCHEDULER_CONCURRENCY = 8      # scheduled unmute/unban calls in flight
+WARN_EXPIRY = 30 * 86400       # default seconds each warning counts before it lapses (0 = never)
+WARN_TIERS = "3 mute 1d"       # default escalation: '<warnings> <mute|kick|ban> [duration]', comma-separated
+LINK_MODE = "off"              # default /antilink mode for chats that have not set one: off, on or strict
+LINK_MUTE_MINUTES = 60
+LINK_REPEAT_LIMIT = 3          # the same link message from this many senders within LINK_REPEAT_WINDOW is spam
+LINK_REPEAT_WINDOW = 300       # seconds
+SNAPSHOT_INTERVAL = 600        # seconds between cache snapshots (also saved on shutdown)
+SNAPSHOT_MAX_USERS = 20000     # most recently seen users kept in the peer cache snapshot
+WARM_CHATS = 100               # most active chats whose settings and admin rosters are pre-loaded at startup
+WARM_CONCURRENCY = 4           # roster loads in flight while pre-warming
+NOTES_PAGE_SIZE = 50           # note names per /notes page
+NOTE_BODY_CACHE = 512          # note bodies kept in memory; the rest are read from the store on demand
+NOTE_FUZZY_SCAN = 2000         # above this many notes, suggestions only compare names with the same first letter
+EXECUTOR_CONCURRENCY = 16       # chats whose updates are being handled at once
+EXECUTOR_CHAT_QUEUE = 100      # updates waiting per chat before fun commands, then other commands, are shed
+EXECUTOR_MAX_CHATS = 10000     # chat lanes (and their queue statistics) kept before idle ones are dropped
+EXECUTOR_METRICS_CHATS = 20    # chats with the longest queue wait exported as metrics
+AUDIT_DIR = "audit"             # append-only moderation log segments
+AUDIT_SEGMENT_RECORDS = 65536  # records per segment before it is sealed and compacted
+AUDIT_FLUSH_INTERVAL = 1.0     # seconds between audit log writes
+AUDIT_COMPACT_INTERVAL = 300   # seconds between compaction passes
+AUDIT_RETENTION = 0            # seconds audit records are kept, by whole segment (0 = forever)
+AUDIT_BLOCK_CACHE = 256        # decoded blocks of compacted segments kept for /modlog
+AUDIT_QUERY_MAX = 50           # most actions one /modlog lists
+MEDIA_MAX_BYTES = 10 * 2**20   # largest file a media command downloads (Telegram's chat photo limit)
+MEDIA_CONCURRENCY = 2          # media downloads and re-uploads in flight
+SHARDS = 1                     # worker processes chats are partitioned across (1 = handle everything in-process)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464            # Prometheus text endpoint (0 = off)
+METRICS_API_SAMPLE_RATE = 0.1  # fraction of API calls whose latency is timed; calls are always counted
 
 # --- INIT ---
 app = Client("group_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
 # --- DATA STORAGE ---
-warnings = {}
 notes = {}
 filters_dict = {}
 blacklist_words = ["spam", "badword"]
 rules_text = "📜 Group Rules:\n1. Be respectful\n2. No spam\n3. Follow admin instructions"
 welcome_message = "👋 Welcome {mention} to {title}!"
-ADMINS_CACHE = {}
+blacklists = {}
+blacklist_modes = {}
+custom_blacklists = set()
+
+MUTED_PERMISSIONS = ChatPermissions(
+    can_send_messages=False,
+    can_send_media_messages=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False
+)
+UNMUTED_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True
+)
+
+# --- PERSISTENCE ---
+
+GLOBAL_CHAT = 0  # settings row for defaults shared by every chat
+SHARD = None     # (index, count) inside a shard worker process; None when this process handles every chat
+
+def owns(chat_id: int) -> bool:
+    """Whether this process handles chat_id. Shard workers own chat_id % count == index."""
+    return SHARD is None or chat_id == GLOBAL_CHAT or chat_id % SHARD[1] == SHARD[0]
+
+LAZY_SETTINGS = (
+    "rules", "welcome", "welcome_window", "raid_rate", "raid_action", "flood_limit", "flood_window", "flood_mute",
+    "link_mode", "link_action", "link_allow", "link_deny", "warn_tiers", "warn_expiry"
+)  # per-chat keys loaded on demand by SettingsCache
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records how far we got.
+MIGRATIONS = [
+    """
+    CREATE TABLE warnings (chat_id INTEGER, user_id INTEGER, count INTEGER, PRIMARY KEY (chat_id, user_id));
+    CREATE TABLE notes (chat_id INTEGER, name TEXT, text TEXT, PRIMARY KEY (chat_id, name));
+    CREATE TABLE settings (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY (chat_id, key));
+    CREATE TABLE blacklist (chat_id INTEGER, term TEXT, PRIMARY KEY (chat_id, term));
+    CREATE TABLE filters (chat_id INTEGER, trigger TEXT, reply TEXT, PRIMARY KEY (chat_id, trigger));
+    """,
+    """
+    CREATE TABLE jobs (id INTEGER PRIMARY KEY, due REAL, kind TEXT, chat_id INTEGER, target INTEGER);
+    """,
+    """
+    CREATE TABLE snapshots (name TEXT PRIMARY KEY, saved_at REAL, data TEXT);
+    """,
+    # Note names become case-insensitive. Where names differ only by case, the one already in lower
+    # case (else the oldest) keeps the name and the others get their rowid as a suffix, e.g. rules_12.
+    """
+    UPDATE notes SET name = py_lower(name) || '_' || rowid WHERE EXISTS (
+        SELECT 1 FROM notes AS other
+        WHERE other.chat_id = notes.chat_id AND py_lower(other.name) = py_lower(notes.name)
+        AND other.rowid != notes.rowid
+        AND (other.name = py_lower(other.name) OR (notes.name != py_lower(notes.name) AND other.rowid < notes.rowid))
+    );
+    UPDATE notes SET name = py_lower(name);
+    """,
+    # One row per warning; the old counts become that many warnings given now, with the default lifetime.
+    """
+    CREATE TABLE warns (
+        chat_id INTEGER, user_id INTEGER, warned_at REAL, expires_at REAL, actor INTEGER, reason TEXT,
+        PRIMARY KEY (chat_id, user_id, warned_at)
+    );
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < (SELECT MAX(count) FROM warnings))
+    INSERT INTO warns SELECT chat_id, user_id, CAST(strftime('%s', 'now') AS REAL) + i / 1000.0, NULL, 0, NULL
+    FROM warnings JOIN n ON i <= count;
+    DROP TABLE warnings;
+    DELETE FROM jobs WHERE kind = 'expire_warnings';
+    """,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+STORE_TABLES = {
+    # table -> primary key columns
+    "warns": ("chat_id", "user_id", "warned_at"),
+    "notes": ("chat_id", "name"),
+    "settings": ("chat_id", "key"),
+    "blacklist": ("chat_id", "term"),
+    "filters": ("chat_id", "trigger"),
+    "jobs": ("id",),
+    "snapshots": ("name",),
+}
+
+class Store:
+    """SQLite (WAL) state store with write-behind batching.
+
+    The module dicts are the read cache and are filled once by load(). Handlers
+    record changes with put()/delete(); they are coalesced per row and written in
+    one transaction every flush_interval seconds and on close(), on a worker
+    thread so the event loop never waits on disk.
+    """
+
+    def __init__(self, path=DB_PATH, flush_interval=STORE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._pending = {}  # (table, key) -> row, or None to delete
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    def put(self, table: str, *row):
+        self._pending[(table, row[:len(STORE_TABLES[table])])] = row
+
+    def delete(self, table: str, *key):
+        self._pending[(table, key)] = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.create_function("py_lower", 1, str.lower, deterministic=True)  # Unicode-aware, unlike SQLite's lower()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number in range(version, SCHEMA_VERSION):
+            conn.execute("BEGIN")
+            for statement in MIGRATIONS[number].split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+            conn.execute("COMMIT")
+        return conn, version
+
+    def _read(self, table: str):
+        if table == "settings":
+            # Per-chat rules/welcome are fetched lazily; only the global defaults load up front.
+            keys = ", ".join("?" * len(LAZY_SETTINGS))
+            return self._conn.execute(
+                f"SELECT * FROM settings WHERE chat_id = ? OR key NOT IN ({keys})", (GLOBAL_CHAT, *LAZY_SETTINGS)
+            ).fetchall()
+        if table == "notes":
+            # Only names are kept in memory; NoteIndex fetches bodies when they are asked for.
+            return self._conn.execute("SELECT chat_id, name FROM notes").fetchall()
+        if table == "warns":
+            # Legacy warnings without an expiry take their chat's /warnexpiry, which isn't loaded yet.
+            return self._conn.execute(
+                "SELECT warns.*, settings.value FROM warns LEFT JOIN settings"
+                " ON settings.chat_id = warns.chat_id AND settings.key = 'warn_expiry'"
+            ).fetchall()
+        return self._conn.execute(f"SELECT * FROM {table}").fetchall()
+
+    async def fetch_settings(self, chat_id: int) -> dict:
+        """Read one chat's settings rows, including writes that are not flushed yet."""
+        values = {}
+        if self._conn is not None:
+            rows = await asyncio.to_thread(
+                lambda: self._conn.execute("SELECT key, value FROM settings WHERE chat_id = ?", (chat_id,)).fetchall()
+            )
+            values.update(rows)
+        for (table, key), row in list(self._pending.items()):
+            if table == "settings" and key[0] == chat_id:
+                if row is None:
+                    values.pop(key[1], None)
+                else:
+                    values[key[1]] = row[2]
+        return values
+
+    async def fetch_note(self, chat_id: int, name: str):
+        """Read one note body, including writes that are not flushed yet; None if there is no such note."""
+        key = ("notes", (chat_id, name))
+        if key in self._pending:
+            row = self._pending[key]
+            return row[2] if row else None
+        if self._conn is None:
+            return None
+        row = await asyncio.to_thread(
+            lambda: self._conn.execute("SELECT text FROM notes WHERE chat_id = ? AND name = ?", (chat_id, name)).fetchone()
+        )
+        return row[0] if row else None
+
+    def _write(self, batch: dict):
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            for (table, key), row in batch.items():
+                if row is None:
+                    where = " AND ".join(f"{column} = ?" for column in STORE_TABLES[table])
+                    conn.execute(f"DELETE FROM {table} WHERE {where}", key)
+                else:
+                    conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(row))})", row)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def open(self):
+        """Open the database, migrate it and load its contents into the module dicts."""
+        await self._open_migrated()
+        await self.load()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def migrate(self):
+        """Create or upgrade the schema and close again, loading nothing (the sharded front process)."""
+        await self._open_migrated()
+        await asyncio.to_thread(self._conn.close)
+        self._conn = None
+
+    async def _open_migrated(self):
+        self._conn, version = await asyncio.to_thread(self._connect)
+        if version == 0:
+            # First run against this file: carry over whatever is in the in-memory dicts.
+            self.import_state({}, notes, {GLOBAL_CHAT: {"rules": rules_text, "welcome": welcome_message}})
+            await self.flush()
+
+    def import_state(self, warnings_by_chat: dict, notes_by_chat: dict, settings_by_chat: dict):
+        """Queue rows for the legacy {chat_id: {key: value}} dict layout."""
+        now = time.time()
+        for chat_id, counts in warnings_by_chat.items():
+            for user_id, count in counts.items():
+                for i in range(count):
+                    self.put("warns", chat_id, user_id, now + i / 1000, None, 0, None)
+        for chat_id, chat_notes in notes_by_chat.items():
+            for name, text in chat_notes.items():
+                self.put("notes", chat_id, name, text)
+        for chat_id, chat_settings in settings_by_chat.items():
+            for key, value in chat_settings.items():
+                self.put("settings", chat_id, key, value)
+
+    async def load(self):
+        global rules_text, welcome_message
+        tables = await asyncio.to_thread(lambda: {table: self._read(table) for table in STORE_TABLES})
+        if SHARD is not None:
+            # A shard worker only keeps its own chats; jobs and snapshots are filtered by their owners.
+            for table in ("warns", "notes", "settings", "blacklist", "filters"):
+                tables[table] = [row for row in tables[table] if owns(row[0])]
+        warn_book.restore(tables["warns"])
+        for chat_id, name in tables["notes"]:
+            note_index.add(chat_id, name)
+        for chat_id, key, value in tables["settings"]:
+            if chat_id == GLOBAL_CHAT and key == "rules":
+                rules_text = value
+            elif chat_id == GLOBAL_CHAT and key == "welcome":
+                welcome_message = value
+            elif key == "blacklist_mode":
+                blacklist_modes[chat_id] = value
+            elif key == "blacklist_custom":
+                custom_blacklists.add(chat_id)
+        for chat_id in custom_blacklists:
+            blacklists[chat_id] = BlacklistMatcher()
+        for chat_id, term in tables["blacklist"]:
+            if chat_id in blacklists:
+                blacklists[chat_id].add(term)
+        for chat_id, trigger, reply in tables["filters"]:
+            try:
+                filters_dict.setdefault(chat_id, ChatFilters()).add(trigger, reply)
+            except re.error:
+                pass
+        scheduler.restore(tables["jobs"])
+        warm_start.restore(tables["snapshots"])
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending or self._conn is None:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                # Keep the rows for the next attempt unless newer writes replaced them.
+                self._pending = {**batch, **self._pending}
+                print(f"❌ State flush failed: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+store = Store()
+
+# --- OUTBOUND QUEUE ---
+
+PRIORITY_MODERATION, PRIORITY_NORMAL, PRIORITY_FUN = 0, 1, 2
+PRIORITY_NAMES = {PRIORITY_MODERATION: "moderation", PRIORITY_NORMAL: "normal", PRIORITY_FUN: "fun"}
+MODERATION_COMMANDS = {
+    "ban", "unban", "tban", "kick", "mute", "unmute", "tmute", "warn", "unwarn", "purge", "purgeuser",
+    "pin", "unpin", "promote", "demote", "massban", "masskick", "massmute", "masswarn",
+}
+FUN_COMMANDS = {"slap", "roll", "coin", "say"}
+
+def command_priority(message: Message) -> int:
+    """Outbound lane for replies to a message, based on the command it carries."""
+    command = message.command[0] if getattr(message, "command", None) else None
+    if command in MODERATION_COMMANDS:
+        return PRIORITY_MODERATION
+    if command in FUN_COMMANDS:
+        return PRIORITY_FUN
+    return PRIORITY_NORMAL
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Empty the bucket so nothing goes out for `seconds` (used after a FloodWait)."""
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class OutboundJob:
+    __slots__ = ("chat_id", "call", "future", "priority", "queued_at", "chat_limited", "attempts")
+
+    def __init__(self, chat_id, call, future, priority, chat_limited):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.chat_limited = chat_limited
+        self.attempts = 0
+
+class OutboundDispatcher:
+    """Single queue for outbound replies, edits and deletes.
+
+    Jobs are served by priority lane, then in submission order. Each send is
+    charged against a global and a per-chat token bucket; a job whose chat has
+    no tokens is parked until it does, so one busy chat never holds a worker.
+    A chat has at most one rate-limited job in flight; later ones are held back
+    until it is done, so replies arrive in the order they were submitted even
+    when nobody awaits them. FloodWait errors pause the chat and requeue the job
+    after the server delay.
+    """
+
+    def __init__(self, workers=OUTBOUND_WORKERS, global_rate=None, global_burst=None):
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self._global = TokenBucket(
+            OUTBOUND_GLOBAL_RATE if global_rate is None else global_rate,
+            OUTBOUND_GLOBAL_BURST if global_burst is None else global_burst
+        )
+        self._chats = OrderedDict()
+        self._sending = {}  # chat_id -> jobs held back behind the one in flight
+        self._unfinished = 0
+        self._idle = None
+        self.depth = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.sent = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.wait_total = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self.wait_max = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self.flood_waits = 0
+        self.failures = 0
+
+    def _start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, chat_id, call, priority=PRIORITY_NORMAL, chat_limited=True) -> asyncio.Future:
+        """Queue `call` (a zero-argument coroutine factory) and return a future for its result."""
+        if self._queue is None:
+            self._start()
+        job = OutboundJob(chat_id, call, asyncio.get_running_loop().create_future(), priority, chat_limited)
+        self._unfinished += 1
+        self._idle.clear()
+        self.depth[priority] += 1
+        self._enqueue(job)
+        return job.future
+
+    def _enqueue(self, job: OutboundJob):
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+            if len(self._chats) > OUTBOUND_MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _park(self, job: OutboundJob, delay: float):
+        asyncio.get_running_loop().call_later(delay, self._enqueue, job)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            now = time.monotonic()
+            if job.chat_limited:
+                held = self._sending.get(job.chat_id)
+                if held is not None:
+                    held.append(job)
+                    continue
+                bucket = self._chat_bucket(job.chat_id)
+                delay = bucket.delay(now)
+                if delay > 0:
+                    self._park(job, delay)
+                    continue
+            while (delay := self._global.delay(time.monotonic())) > 0:
+                await asyncio.sleep(delay)
+            self._global.take()
+            if job.chat_limited:
+                bucket.take()
+                self._sending[job.chat_id] = []
+            self.depth[job.priority] -= 1
+            try:
+                await self._run(job)
+            finally:
+                if job.chat_limited:
+                    for waiting in self._sending.pop(job.chat_id, ()):
+                        self._enqueue(waiting)
+
+    async def _run(self, job: OutboundJob):
+        try:
+            result = await job.call()
+        except FloodWait as e:
+            self.flood_waits += 1
+            job.attempts += 1
+            if job.attempts <= FLOOD_WAIT_RETRIES:
+                if job.chat_limited:
+                    self._chat_bucket(job.chat_id).pause(e.value)
+                self.depth[job.priority] += 1
+                self._park(job, e.value)
+                return
+            self._finish(job, error=e)
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+
+    def _finish(self, job: OutboundJob, result=None, error=None):
+        waited = time.monotonic() - job.queued_at
+        self.sent[job.priority] += 1
+        self.wait_total[job.priority] += waited
+        self.wait_max[job.priority] = max(self.wait_max[job.priority], waited)
+        if error is not None:
+            self.failures += 1
+        if not job.future.done():
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._idle.set()
+
+    def stats(self) -> dict:
+        lanes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            sent = self.sent[priority]
+            lanes[name] = {
+                "depth": self.depth[priority],
+                "sent": sent,
+                "avg_wait": self.wait_total[priority] / sent if sent else 0.0,
+                "max_wait": self.wait_max[priority],
+            }
+        return {"lanes": lanes, "flood_waits": self.flood_waits, "failures": self.failures, "chats": len(self._chats)}
+
+    async def close(self, timeout=10.0):
+        """Give queued jobs up to `timeout` seconds to go out, then stop the workers."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        self._queue = None
+
+outbound = OutboundDispatcher()
+
+def _replied(future: asyncio.Future, chat_id: int):
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        print(f"❌ Reply in {chat_id} failed: {future.exception()!r}")
+    elif future.result():
+        recent_messages.add(future.result())
+
+async def reply(message: Message, text: str, priority=None, wait=False, **kwargs):
+    """Reply to a message through the outbound queue.
+
+    The reply is only queued unless `wait` is set: a handler waiting on the
+    per-chat rate limit would hold up every later update in its chat's lane,
+    moderation included. Pass wait=True when the sent message is needed.
+    """
+    if priority is None:
+        priority = command_priority(message)
+    future = outbound.submit(message.chat.id, lambda: message.reply(text, **kwargs), priority)
+    future.add_done_callback(functools.partial(_replied, chat_id=message.chat.id))
+    if wait:
+        return await future
+    return None
+
+async def edit(message: Message, text: str, priority=PRIORITY_NORMAL, **kwargs) -> Message:
+    """Edit one of the bot's messages through the outbound queue."""
+    return await outbound.submit(message.chat.id, lambda: message.edit(text, **kwargs), priority)
+
+async def delete(message: Message, priority=PRIORITY_MODERATION):
+    """Delete a message through the outbound queue; deletes only count against the global rate."""
+    return await outbound.submit(message.chat.id, lambda: message.delete(), priority, chat_limited=False)
 
 # --- HELPER FUNCTIONS ---
 
+ADMIN_STATUSES = (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER)
+ADMIN_CACHE_TTL = 300          # seconds before a chat's admin roster is reloaded
+ADMIN_CACHE_MAX_CHATS = 2000   # rosters kept before the least recently used is dropped
+
+class AdminCache:
+    """Per-chat admin rosters, loaded in one call and kept with a TTL and an LRU bound."""
+
+    def __init__(self, ttl=ADMIN_CACHE_TTL, max_chats=ADMIN_CACHE_MAX_CHATS):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._rosters = OrderedDict()  # chat_id -> (expires_at, {user_id: (is_bot, mention)})
+        self._locks = {}  # chat_id -> [lock, callers holding or waiting on it]
+
+    def _fresh(self, chat_id):
+        entry = self._rosters.get(chat_id)
+        if entry and entry[0] > time.monotonic():
+            self._rosters.move_to_end(chat_id)
+            return entry[1]
+        return None
+
+    async def get(self, client, chat_id: int) -> dict:
+        """Return {user_id: (is_bot, mention)} for every admin and the owner of a chat."""
+        roster = self._fresh(chat_id)
+        if roster is not None:
+            return roster
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # Another handler may have loaded the roster while we waited.
+                roster = self._fresh(chat_id)
+                if roster is not None:
+                    return roster
+                roster = {}
+                async for member in client.get_chat_members(chat_id, filter=enums.ChatMembersFilter.ADMINISTRATORS):
+                    if member.status in ADMIN_STATUSES:
+                        roster[member.user.id] = (member.user.is_bot, member.user.mention)
+                self.put(chat_id, roster)
+                return roster
+        finally:
+            # Only the last caller drops the lock, so nobody waiting on it is left on a stale one.
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat_id]
+
+    def put(self, chat_id: int, roster: dict, ttl=None):
+        self._rosters[chat_id] = (time.monotonic() + (self.ttl if ttl is None else ttl), roster)
+        self._rosters.move_to_end(chat_id)
+        while len(self._rosters) > self.max_chats:
+            self._rosters.popitem(last=False)
+
+    def invalidate(self, chat_id: int):
+        self._rosters.pop(chat_id, None)
+
+    def dump(self) -> list:
+        """[[chat_id, seconds left, [[user_id, is_bot, mention], ...]], ...], least recently used first."""
+        now = time.monotonic()
+        return [
+            [chat_id, expires_at - now, [[user_id, *member] for user_id, member in members.items()]]
+            for chat_id, (expires_at, members) in self._rosters.items()
+        ]
+
+    def restore(self, entries: list, elapsed: float):
+        """Reload dump() output taken `elapsed` seconds ago, skipping rosters that have expired since."""
+        for chat_id, remaining, members in entries:
+            if remaining - elapsed > 0:
+                roster = {user_id: (is_bot, mention) for user_id, is_bot, mention in members}
+                self.put(chat_id, roster, ttl=remaining - elapsed)
+
+admin_cache = AdminCache()
+
+PEER_CACHE_TTL = 3600          # seconds a user seen in an update is trusted before get_users is asked again
+PEER_CACHE_MAX_USERS = 100000  # users kept before the least recently seen is dropped
+
+class PeerCache:
+    """Users seen in incoming updates, by ID and by username, with a TTL and an LRU bound.
+
+    Lets resolve_user skip get_users for anyone the bot has seen recently. A
+    username that moves to a new owner, or is dropped by its old one, stops
+    resolving to the old user as soon as either is seen again.
+    """
+
+    def __init__(self, ttl=PEER_CACHE_TTL, max_users=PEER_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> (seen_at, user)
+        self._usernames = {}         # lowercase username -> user_id
+
+    def put(self, user):
+        entry = self._users.get(user.id)
+        if entry and entry[1].username and entry[1].username != user.username:
+            old = entry[1].username.lower()
+            if self._usernames.get(old) == user.id:
+                del self._usernames[old]
+        self._users[user.id] = (time.monotonic(), user)
+        self._users.move_to_end(user.id)
+        if user.username:
+            self._usernames[user.username.lower()] = user.id
+        while len(self._users) > self.max_users:
+            _, (_, dropped) = self._users.popitem(last=False)
+            if dropped.username and self._usernames.get(dropped.username.lower()) == dropped.id:
+                del self._usernames[dropped.username.lower()]
+
+    def get(self, user_id: int):
+        entry = self._users.get(user_id)
+        if entry and entry[0] + self.ttl > time.monotonic():
+            return entry[1]
+        return None
+
+    def get_by_username(self, username: str):
+        user_id = self._usernames.get(username.lower())
+        user = self.get(user_id) if user_id is not None else None
+        # The mapping may be stale if the user changed names and was re-cached elsewhere.
+        if user and user.username and user.username.lower() == username.lower():
+            return user
+        return None
+
+    def __len__(self):
+        return len(self._users)
+
+    def dump(self, limit: int) -> list:
+        """[[user_id, age, username, first_name, last_name, is_bot], ...] for the `limit` most recent users."""
+        now = time.monotonic()
+        recent = itertools.islice(reversed(self._users.values()), limit)
+        entries = [
+            [user.id, now - seen_at, user.username, user.first_name, user.last_name, user.is_bot]
+            for seen_at, user in recent
+        ]
+        entries.reverse()
+        return entries
+
+    def restore(self, entries: list, elapsed: float):
+        """Reload dump() output taken `elapsed` seconds ago, skipping users whose TTL has run out."""
+        now = time.monotonic()
+        for user_id, age, username, first_name, last_name, is_bot in entries:
+            age += elapsed
+            if age < self.ttl:
+                self.put(User(id=user_id, username=username, first_name=first_name, last_name=last_name, is_bot=is_bot))
+                self._users[user_id] = (now - age, self._users[user_id][1])
+
+peer_cache = PeerCache()
+
+class ChatMessageRing:
+    """The last `capacity` messages of one chat as parallel arrays, oldest overwritten first."""
+
+    __slots__ = ("ids", "users", "times", "hashes", "head")
+
+    def __init__(self):
+        self.ids = array("i")     # message ID, 0 once forgotten
+        self.users = array("q")   # sender ID, 0 for anonymous senders
+        self.times = array("I")   # unix seconds
+        self.hashes = array("q")  # content hash, 0 for messages without text or media
+        self.head = 0             # next slot to overwrite once the ring is full
+
+    def newest_first(self):
+        """Yield slot indexes from the newest message to the oldest."""
+        size = len(self.ids)
+        for offset in range(1, size + 1):
+            yield (self.head - offset) % size
+
+    def copies(self, content: int) -> int:
+        """Upper bound on the entries with this content hash, from one byte search.
+
+        array.count would box every element; searching the raw bytes stays in C.
+        A match straddling two entries can overcount, which callers only use to
+        skip the exact scan.
+        """
+        return self.hashes.tobytes().count(array("q", (content,)).tobytes())
+
+class MessageIndex:
+    """Per-chat ring buffers of recent (message_id, user_id, timestamp, content hash).
+
+    Filled from every incoming message and from the bot's own replies, so purges
+    and the duplicate check never page history through the API. Each chat keeps
+    at most `per_chat` entries (24 bytes each) and the least recently active chats
+    are dropped beyond `max_chats`.
+    """
+
+    def __init__(self, per_chat=RECENT_MESSAGES_PER_CHAT, max_chats=RECENT_MESSAGES_MAX_CHATS):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> ChatMessageRing
+
+    @staticmethod
+    def content_hash(message: Message) -> int:
+        text = message.text or message.caption
+        media = getattr(message, message.media.value, None) if message.media else None
+        unique_id = getattr(media, "file_unique_id", None)
+        if not text and not unique_id:
+            return 0
+        return hash((" ".join(normalise_text(text).split()) if text else None, unique_id)) or 1
+
+    def add(self, message: Message) -> int:
+        """Index a message and return its content hash."""
+        content = self.content_hash(message)
+        user_id = message.from_user.id if message.from_user else 0
+        ring = self._chats.get(message.chat.id)
+        if ring is None:
+            ring = self._chats[message.chat.id] = ChatMessageRing()
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(message.chat.id)
+        now = int(time.time())
+        if len(ring.ids) < self.per_chat:
+            ring.ids.append(message.id)
+            ring.users.append(user_id)
+            ring.times.append(now)
+            ring.hashes.append(content)
+        else:
+            slot = ring.head
+            ring.ids[slot] = message.id
+            ring.users[slot] = user_id
+            ring.times[slot] = now
+            ring.hashes[slot] = content
+            ring.head = (slot + 1) % self.per_chat
+        return content
+
+    def recent(self, chat_id: int, limit: int, user_id=None, before_id=None) -> list:
+        """IDs of up to `limit` indexed messages, newest first, optionally from one user or before an ID."""
+        ring = self._chats.get(chat_id)
+        found = []
+        if ring is None:
+            return found
+        ids, users = ring.ids, ring.users
+        for slot in ring.newest_first():
+            message_id = ids[slot]
+            if not message_id or (before_id is not None and message_id >= before_id):
+                continue
+            if user_id is not None and users[slot] != user_id:
+                continue
+            found.append(message_id)
+            if len(found) == limit:
+                break
+        return found
+
+    def duplicates(self, chat_id: int, user_id: int, content: int, window: float, minimum=1) -> list:
+        """IDs of this user's messages with the same content hash in the last `window` seconds, newest first.
+
+        Returns [] straight away when fewer than `minimum` copies are indexed at all,
+        which ChatMessageRing.copies settles in C for nearly every message.
+        """
+        ring = self._chats.get(chat_id)
+        if ring is None or not content or ring.copies(content) < minimum:
+            return []
+        since = time.time() - window
+        found = []
+        for slot in ring.newest_first():
+            if ring.times[slot] < since:
+                break
+            if ring.hashes[slot] == content and ring.users[slot] == user_id and ring.ids[slot]:
+                found.append(ring.ids[slot])
+        return found
+
+    def senders(self, chat_id: int, content: int, window: float, minimum=1) -> set:
+        """Distinct senders of messages with this content hash in the last `window` seconds.
+
+        Like duplicates(), returns an empty set when fewer than `minimum` copies are indexed.
+        """
+        ring = self._chats.get(chat_id)
+        if ring is None or not content or ring.copies(content) < minimum:
+            return set()
+        since = time.time() - window
+        found = set()
+        for slot in ring.newest_first():
+            if ring.times[slot] < since:
+                break
+            if ring.hashes[slot] == content and ring.ids[slot]:
+                found.add(ring.users[slot])
+        return found
+
+    def forget(self, chat_id: int, message_ids):
+        """Mark deleted messages so later purges and duplicate checks skip them."""
+        ring = self._chats.get(chat_id)
+        if ring is None:
+            return
+        gone = set(message_ids)
+        ids = ring.ids
+        for slot in range(len(ids)):
+            if ids[slot] in gone:
+                ids[slot] = 0
+
+recent_messages = MessageIndex()
+
 async def is_admin(client, chat_id: int, user_id: int) -> bool:
-    """Check if a user is admin or owner in a chat, with caching."""
-    if (chat_id, user_id) in ADMINS_CACHE:
-        return ADMINS_CACHE[(chat_id, user_id)]
-    try:
-        member = await client.get_chat_member(chat_id, user_id)
-        is_admin = member.status in (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER)
-        ADMINS_CACHE[(chat_id, user_id)] = is_admin
-        return is_admin
+    """Check if a user is admin or owner in a chat, using the cached roster."""
+    try:
+        return user_id in await admin_cache.get(client, chat_id)
     except Exception:
         return False
 
+async def get_staff_mentions(client, chat_id: int) -> list:
+    """Return mentions of the human admins of a chat from the cached roster."""
+    roster = await admin_cache.get(client, chat_id)
+    return [mention for is_bot, mention in roster.values() if not is_bot]
+
 async def resolve_user(client, message: Message):
     """Resolve user from reply, user ID, or username."""
     if message.reply_to_message and message.reply_to_message.from_user:
         return message.reply_to_message.from_user
     if len(message.command) > 1:
-        user_ref = message.command[1]
         try:
-            if user_ref.isdigit():
-                return await client.get_users(int(user_ref))
-            if user_ref.startswith("@"):
-                return await client.get_users(user_ref[1:])
+            return await lookup_user(client, message.command[1])
         except Exception as e:
-            await message.reply(f"❌ User not found: {e}")
+            await reply(message, f"❌ User not found: {e}")
             return None
     return None
 
-async def delete_message_with_delay(message: Message, delay=5):
-    """Delete a message after a delay."""
-    await asyncio.sleep(delay)
-    try:
-        await message.delete()
-    except Exception:
-        pass
+async def lookup_user(client, user_ref: str):
+    """Resolve a user ID or @username through the peer cache; None if it is neither."""
+    if user_ref.isdigit():
+        user = peer_cache.get(int(user_ref))
+        lookup = int(user_ref)
+    elif user_ref.startswith("@"):
+        user = peer_cache.get_by_username(user_ref[1:])
+        lookup = user_ref[1:]
+    else:
+        return None
+    if user is None:
+        user = await client.get_users(lookup)
+        peer_cache.put(user)
+    return user
+
+def delete_message_with_delay(message: Message, delay=5):
+    """Delete a message after a delay, via the scheduler."""
+    scheduler.schedule(delay, "delete", message.chat.id, message.id)
+
+async def call_with_floodwait(func, *args, retries=FLOOD_WAIT_RETRIES, **kwargs):
+    """Call an API method, sleeping out FloodWait errors for up to `retries` retries."""
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except FloodWait as e:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(e.value)
+
+async def iter_ids(message_ids):
+    for message_id in message_ids:
+        yield message_id
+
+async def iter_id_range(first_id: int, last_id: int):
+    """Yield message IDs from last_id down to first_id without touching the API."""
+    for message_id in range(last_id, first_id - 1, -1):
+        yield message_id
 
-async def purge_messages_in_chunks(client, chat_id, message_ids):
-    """Delete messages in batches of up to 100."""
-    for i in range(0, len(message_ids), 100):
-        chunk = message_ids[i:i + 100]
+async def purge_message_ids(client, chat_id, message_ids, status: Message = None) -> tuple:
+    """Delete an async stream of message IDs in concurrent chunks while it is still being produced.
+
+    Returns (deleted, failed). If a status message is given it is edited with progress.
+    """
+    semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+    progress = {"deleted": 0, "failed": 0}
+    tasks = set()
+
+    async def delete_chunk(chunk):
         try:
-            await client.delete_messages(chat_id, chunk)
+            deleted = await outbound.submit(
+                chat_id, lambda: client.delete_messages(chat_id, chunk), PRIORITY_MODERATION, chat_limited=False
+            )
+            progress["deleted"] += deleted if isinstance(deleted, int) else len(chunk)
         except Exception:
-            pass
+            progress["failed"] += len(chunk)
+        finally:
+            semaphore.release()
+
+    async def submit(chunk):
+        await semaphore.acquire()
+        task = asyncio.create_task(delete_chunk(chunk))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    last_report = time.monotonic()
+    chunk = []
+    async for message_id in message_ids:
+        chunk.append(message_id)
+        if len(chunk) < PURGE_CHUNK:
+            continue
+        await submit(chunk)
+        chunk = []
+        if status and time.monotonic() - last_report >= PURGE_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            try:
+                await edit(status, f"🧹 Purging… {progress['deleted']} deleted so far.")
+            except Exception:
+                pass
+    if chunk:
+        await submit(chunk)
+    await asyncio.gather(*tasks)
+    return progress["deleted"], progress["failed"]
 
 def user_mention(user):
     """Return mention string for a user."""
@@ -80,264 +1026,1340 @@ def user_mention(user):
 async def check_admin_and_reply(client, message: Message):
     """Check if user is admin and reply if not."""
     if not await is_admin(client, message.chat.id, message.from_user.id):
-        await message.reply("⛔️ You need admin permissions!")
+        await reply(message, "⛔️ You need admin permissions!")
         return False
     return True
 
-# --- BASIC COMMANDS ---
+# --- SCHEDULER ---
 
-@app.on_message(filters.command("start") & filters.private)
-async def start(client, message: Message):
-    await message.reply("👋 Hello! I'm an advanced group management bot. Add me to a group and make me admin!")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+KEYED_JOBS = ("unmute", "unban")  # at most one pending job per (kind, chat, user)
 
-@app.on_message(filters.command("help"))
-async def help_command(client, message: Message):
-    help_text = """
-🛠 **Advanced Group Management Bot**
+def parse_duration(text: str):
+    """Parse '90s', '30m', '2h', '1d' or '1w' into seconds; a bare number is minutes. None if invalid."""
+    match = re.fullmatch(r"(\d+)([smhdw]?)", text.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or "m"]
 
-👮 **Admin Tools:**
-/ban [user] - Ban a user
-/unban [user] - Unban a user
-/kick [user] - Kick a user
-/mute [user] [minutes] - Mute a user
-/unmute [user] - Unmute a user
-/warn [user] - Warn a user
-/unwarn [user] - Remove warning
-/warns [user] - Check warnings
-/purge [reply] - Bulk delete messages
-/pin [reply] - Pin a message
-/unpin - Unpin current message
-/settitle [text] - Change group title
-/setphoto [reply] - Set group photo
-/setdescription [text] - Set group description
-/promote [user] - Promote to admin
-/demote [user] - Demote admin
+def format_span(seconds: float) -> str:
+    """Rough length of time for display: '45s', '12m', '5h', '3d'."""
+    for unit, suffix in ((86400, "d"), (3600, "h"), (60, "m")):
+        if seconds >= unit:
+            return f"{int(seconds // unit)}{suffix}"
+    return f"{max(int(seconds), 0)}s"
 
-📝 **Group Features:**
-/setrules [text] - Set group rules
-/rules - Show rules
-/setwelcome [text] - Set welcome message
-/welcome - Show welcome
-/report [reply] - Report to admins
-/staff - Show admins
+def format_duration(seconds: int) -> str:
+    for unit, name in ((604800, "week"), (86400, "day"), (3600, "hour"), (60, "minute")):
+        if seconds >= unit and seconds % unit == 0:
+            count = seconds // unit
+            return f"{count} {name}{'s' if count != 1 else ''}"
+    return f"{seconds} seconds"
 
-💾 **Utilities:**
-/setnote [name] [text] - Save note
-/getnote [name] - Get note
-/id - Get user/chat ID
-/info [user] - Get user info
+class Scheduler:
+    """Persistent timed jobs (delayed deletes, unmutes, unbans) on one heap.
 
-🎉 **Fun:**
-/slap [reply] - Slap a user
-/roll - Roll a dice
-/coin - Flip a coin
-/say [text] - Make bot say something
+    Jobs are rows of the store's jobs table, mirrored in a min-heap of (due, id).
+    A single task sleeps until the earliest due time, or until an earlier job is
+    scheduled, then pops everything that is due and runs it as a batch, so a
+    backlog of overdue jobs after a restart is cleared in a few bulk passes.
+    Cancelled jobs are left in the heap and skipped when popped. Keyed jobs
+    (one unmute per chat member, say) replace the previous job with the same key.
     """
-    await message.reply(help_text)
 
-@app.on_message(filters.command("ping"))
-async def ping(client, message: Message):
-    start_time = time.time()
-    reply = await message.reply("🏓 Pinging...")
-    end_time = time.time()
-    await reply.edit(f"🏓 Pong! `{round((end_time - start_time) * 1000, 2)}ms`")
+    def __init__(self):
+        self._heap = []   # (due, id), may include cancelled ids
+        self._jobs = {}   # id -> (due, kind, chat_id, target)
+        self._keys = {}   # (kind, chat_id, target) -> id, for keyed jobs
+        self._ids = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._client = None
 
-# --- MODERATION COMMANDS ---
+    def __len__(self):
+        return len(self._jobs)
 
-@app.on_message(filters.command("ban") & filters.group)
-async def ban_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
-    try:
-        await client.ban_chat_member(message.chat.id, target.id)
-        await message.reply(f"🔨 Banned {user_mention(target)}", disable_web_page_preview=True)
-    except Exception as e:
-        await message.reply(f"❌ Ban failed: {str(e)}")
+    def schedule(self, delay: float, kind: str, chat_id: int, target: int, keyed=False) -> int:
+        if keyed:
+            self.cancel(kind, chat_id, target)
+        job_id = next(self._ids)
+        due = time.time() + delay
+        self._add(job_id, due, kind, chat_id, target, keyed)
+        store.put("jobs", job_id, due, kind, chat_id, target)
+        return job_id
 
-@app.on_message(filters.command("unban") & filters.group)
-async def unban_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
-    try:
-        await client.unban_chat_member(message.chat.id, target.id)
-        await message.reply(f"✅ Unbanned {user_mention(target)}", disable_web_page_preview=True)
-    except Exception as e:
-        await message.reply(f"❌ Unban failed: {str(e)}")
+    def _add(self, job_id: int, due: float, kind: str, chat_id: int, target: int, keyed: bool):
+        self._jobs[job_id] = (due, kind, chat_id, target)
+        if keyed:
+            self._keys[(kind, chat_id, target)] = job_id
+        if not self._heap or due < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due, job_id))
 
-@app.on_message(filters.command("kick") & filters.group)
-async def kick_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
-    try:
-        await client.ban_chat_member(
-            message.chat.id,
-            target.id,
-            until_date=datetime.now() + timedelta(seconds=30)
-        )
-        await client.unban_chat_member(message.chat.id, target.id)
-        await message.reply(f"👢 Kicked {user_mention(target)}", disable_web_page_preview=True)
-    except Exception as e:
-        await message.reply(f"❌ Kick failed: {str(e)}")
+    def cancel(self, kind: str, chat_id: int, target: int) -> bool:
+        """Cancel the keyed job for (kind, chat_id, target), if there is one."""
+        job_id = self._keys.pop((kind, chat_id, target), None)
+        if job_id is None or self._jobs.pop(job_id, None) is None:
+            return False
+        store.delete("jobs", job_id)
+        if len(self._heap) > 2 * len(self._jobs) + 1024:
+            self._heap = [(due, job_id) for job_id, (due, *_) in self._jobs.items()]
+            heapq.heapify(self._heap)
+        return True
 
-@app.on_message(filters.command("mute") & filters.group)
-async def mute_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
-    duration = 60
-    if len(message.command) > 2 and message.command[2].isdigit():
-        duration = int(message.command[2])
-    try:
-        await client.restrict_chat_member(
-            message.chat.id,
-            target.id,
-            ChatPermissions(
-                can_send_messages=False,
-                can_send_media_messages=False,
-                can_send_other_messages=False,
-                can_add_web_page_previews=False
-            ),
-            until_date=datetime.now() + timedelta(minutes=duration)
-        )
-        await message.reply(f"🔇 Muted {user_mention(target)} for {duration} minutes", disable_web_page_preview=True)
-    except Exception as e:
-        await message.reply(f"❌ Mute failed: {str(e)}")
+    def restore(self, rows):
+        """Load persisted (id, due, kind, chat_id, target) rows; overdue ones fire on the first pass."""
+        last = 0
+        for job_id, due, kind, chat_id, target in rows:
+            last = max(last, job_id)
+            if owns(chat_id):
+                self._add(job_id, due, kind, chat_id, target, kind in KEYED_JOBS)
+        first = max(last + 1, next(self._ids))
+        if SHARD is None:
+            self._ids = itertools.count(first)
+        else:
+            # Shard workers share the jobs table, so each one allocates IDs from its own residue class.
+            index, count = SHARD
+            self._ids = itertools.count(first + (index - first) % count, count)
 
-@app.on_message(filters.command("unmute") & filters.group)
-async def unmute_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
-    try:
-        await client.restrict_chat_member(
-            message.chat.id,
-            target.id,
-            ChatPermissions(
-                can_send_messages=True,
-                can_send_media_messages=True,
-                can_send_other_messages=True,
-                can_add_web_page_previews=True
-            )
-        )
-        await message.reply(f"🔊 Unmuted {user_mention(target)}", disable_web_page_preview=True)
-    except Exception as e:
-        await message.reply(f"❌ Unmute failed: {str(e)}")
+    def start(self, client):
+        self._client = client
+        self._task = asyncio.create_task(self._run())
 
-@app.on_message(filters.command("warn") & filters.group)
-async def warn_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
-    user_id = target.id
-    chat_id = message.chat.id
-    warnings.setdefault(chat_id, {})
-    warnings[chat_id].setdefault(user_id, 0)
-    warnings[chat_id][user_id] += 1
-    count = warnings[chat_id][user_id]
-    if count >= 3:
-        try:
-            await client.restrict_chat_member(
-                chat_id,
-                user_id,
-                ChatPermissions(
-                    can_send_messages=False,
-                    can_send_media_messages=False,
-                    can_send_other_messages=False,
-                    can_add_web_page_previews=False
-                ),
-                until_date=datetime.now() + timedelta(hours=24)
-            )
-            warnings[chat_id][user_id] = 0
-            await message.reply(f"🔇 Muted {user_mention(target)} for 24 hours due to 3 warnings.")
-        except Exception as e:
-            await message.reply(f"⚠️ Warning added but mute failed: {str(e)}")
-    else:
-        await message.reply(f"⚠️ Warned {user_mention(target)} (Warnings: {count}/3)")
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < SCHEDULER_BATCH:
+            _, job_id = heapq.heappop(self._heap)
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                continue
+            _, kind, chat_id, target = job
+            if self._keys.get((kind, chat_id, target)) == job_id:
+                del self._keys[(kind, chat_id, target)]
+            store.delete("jobs", job_id)
+            due.append((kind, chat_id, target))
+        return due
 
-@app.on_message(filters.command("unwarn") & filters.group)
-async def unwarn_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
-        return
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            due = self._pop_due(time.time())
+            if due:
+                await self._fire(due)
+                continue
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, jobs: list):
+        client = self._client
+        deletes = {}
+        calls = []
+        for kind, chat_id, target in jobs:
+            if kind == "delete":
+                deletes.setdefault(chat_id, []).append(target)
+            elif kind == "unmute":
+                calls.append((client.restrict_chat_member, chat_id, target, UNMUTED_PERMISSIONS))
+            elif kind == "unban":
+                calls.append((client.unban_chat_member, chat_id, target))
+        semaphore = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+
+        async def run(func, *args):
+            async with semaphore:
+                await call_with_floodwait(func, *args)
+
+        async def delete_chunk(chat_id, chunk):
+            async with semaphore:
+                await outbound.submit(
+                    chat_id, lambda: client.delete_messages(chat_id, chunk), PRIORITY_NORMAL, chat_limited=False
+                )
+
+        tasks = [run(*call) for call in calls]
+        for chat_id, message_ids in deletes.items():
+            for start in range(0, len(message_ids), PURGE_CHUNK):
+                tasks.append(delete_chunk(chat_id, message_ids[start:start + PURGE_CHUNK]))
+        # Failures (message already gone, rights revoked) are dropped; the job is done either way.
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+scheduler = Scheduler()
+
+# --- WARNINGS ---
+
+WARN_TIER_ACTIONS = ("mute", "kick", "ban")
+
+class WarnTier:
+    __slots__ = ("count", "action", "seconds")
+
+    def __init__(self, count: int, action: str, seconds: int = None):
+        self.count = count
+        self.action = action
+        self.seconds = seconds  # None = indefinitely (not used for kick)
+
+    def __str__(self):
+        return f"{self.count} {self.action}" + (f" {self.seconds}s" if self.seconds else "")
+
+    def describe(self) -> str:
+        text = f"{self.count} warnings → {self.action}"
+        if self.seconds and self.action != "kick":
+            text += f" for {format_duration(self.seconds)}"
+        return text
+
+def parse_warn_tiers(text: str) -> tuple:
+    """Parse '3 mute 1d, 5 kick, 7 ban' into WarnTiers sorted by count. Raises ValueError."""
+    tiers = {}
+    for part in text.split(","):
+        words = part.split()
+        if not 2 <= len(words) <= 3 or not words[0].isdigit() or int(words[0]) < 1:
+            raise ValueError(f"bad tier {part.strip()!r}")
+        action = words[1].lower()
+        if action not in WARN_TIER_ACTIONS:
+            raise ValueError(f"unknown action {words[1]!r}")
+        seconds = None
+        if len(words) == 3:
+            seconds = parse_duration(words[2])
+            if seconds is None:
+                raise ValueError(f"bad duration {words[2]!r}")
+        tiers[int(words[0])] = WarnTier(int(words[0]), action, seconds)
+    if not tiers:
+        raise ValueError("no tiers")
+    return tuple(tiers[count] for count in sorted(tiers))
+
+class WarnEntry:
+    __slots__ = ("warned_at", "expires_at", "actor", "reason")
+
+    def __init__(self, warned_at: float, expires_at: float, actor: int, reason: str):
+        self.warned_at = warned_at
+        self.expires_at = expires_at  # inf if it never lapses
+        self.actor = actor
+        self.reason = reason
+
+class WarnBook:
+    """Active warnings per (chat, user), each with its own timestamp, reason and expiry.
+
+    Each warning keeps the lifetime the chat had when it was given, so after a
+    /warnexpiry change a user's warnings no longer lapse in the order they were
+    given: reads check every entry of the user's (short) deque, with no
+    per-warning timers. A heap of (expiry, chat, user) per warning lets every
+    add also drop lapsed warnings of other users, so memory holds active
+    offenders only. Stale heap entries are skipped.
+    """
+
+    def __init__(self):
+        self._users = {}  # (chat_id, user_id) -> deque of WarnEntry, oldest first
+        self._decay = []  # (expires_at of the newest warning, chat_id, user_id)
+
+    def __len__(self):
+        return len(self._users)
+
+    def _forget(self, chat_id: int, user_id: int, entries):
+        for entry in entries:
+            store.delete("warns", chat_id, user_id, entry.warned_at)
+
+    def _insert(self, chat_id: int, user_id: int, entry: WarnEntry):
+        entries = self._users.setdefault((chat_id, user_id), deque())
+        entries.append(entry)
+        if entry.expires_at != float("inf"):
+            heapq.heappush(self._decay, (entry.expires_at, chat_id, user_id))
+
+    def add(self, chat_id: int, user_id: int, actor: int, reason: str, expiry: int, now: float = None) -> deque:
+        """Record a warning lasting `expiry` seconds (0 = until removed) and return the user's active ones."""
+        now = time.time() if now is None else now
+        self.sweep(now)
+        entries = self.active(chat_id, user_id, now)
+        if entries and entries[-1].warned_at >= now:
+            now = entries[-1].warned_at + 1e-6  # keep (chat, user, warned_at) unique
+        entry = WarnEntry(now, now + expiry if expiry else float("inf"), actor, reason)
+        self._insert(chat_id, user_id, entry)
+        store.put("warns", chat_id, user_id, entry.warned_at, entry.expires_at, actor, reason)
+        return self._users[(chat_id, user_id)]
+
+    def active(self, chat_id: int, user_id: int, now: float = None) -> deque:
+        """The user's unexpired warnings, oldest first (empty if none)."""
+        entries = self._users.get((chat_id, user_id))
+        if not entries:
+            return deque()
+        now = time.time() if now is None else now
+        lapsed = [entry for entry in entries if entry.expires_at <= now]
+        if lapsed:
+            self._forget(chat_id, user_id, lapsed)
+            entries = deque(entry for entry in entries if entry.expires_at > now)
+            if entries:
+                self._users[(chat_id, user_id)] = entries
+            else:
+                del self._users[(chat_id, user_id)]
+        return entries
+
+    def count(self, chat_id: int, user_id: int) -> int:
+        return len(self.active(chat_id, user_id))
+
+    def remove_latest(self, chat_id: int, user_id: int):
+        """Take back the newest active warning; returns it, or None if there was none."""
+        entries = self.active(chat_id, user_id)
+        if not entries:
+            return None
+        entry = entries.pop()
+        self._forget(chat_id, user_id, (entry,))
+        if not entries:
+            del self._users[(chat_id, user_id)]
+        return entry
+
+    def clear(self, chat_id: int, user_id: int) -> int:
+        entries = self._users.pop((chat_id, user_id), ())
+        self._forget(chat_id, user_id, entries)
+        return len(entries)
+
+    def sweep(self, now: float = None):
+        """Drop lapsed warnings, evicting users left with none."""
+        now = time.time() if now is None else now
+        while self._decay and self._decay[0][0] <= now:
+            _, chat_id, user_id = heapq.heappop(self._decay)
+            self.active(chat_id, user_id, now)
+
+    def restore(self, rows):
+        """Load (chat_id, user_id, warned_at, expires_at, actor, reason, chat expiry) rows, dropping lapsed ones."""
+        now = time.time()
+        for chat_id, user_id, warned_at, expires_at, actor, reason, chat_expiry in sorted(rows, key=lambda row: row[2]):
+            if expires_at is None:
+                # Warnings from before per-warning expiry take the chat's lifetime.
+                expiry = WARN_EXPIRY if chat_expiry is None else int(chat_expiry)
+                expires_at = warned_at + expiry if expiry else float("inf")
+            if expires_at <= now:
+                store.delete("warns", chat_id, user_id, warned_at)
+                continue
+            self._insert(chat_id, user_id, WarnEntry(warned_at, expires_at, actor, reason or ""))
+
+warn_book = WarnBook()
+
+async def apply_warn_tier(client, chat_id: int, target, tier: WarnTier, actor: int) -> str:
+    """Carry out a tier's action; returns the reply text."""
+    user_id = target.id
+    until = datetime.now() + timedelta(seconds=tier.seconds) if tier.seconds else None
+    if tier.action == "mute":
+        if until:
+            await client.restrict_chat_member(chat_id, user_id, MUTED_PERMISSIONS, until_date=until)
+            scheduler.schedule(tier.seconds, "unmute", chat_id, user_id, keyed=True)
+        else:
+            await client.restrict_chat_member(chat_id, user_id, MUTED_PERMISSIONS)
+            scheduler.cancel("unmute", chat_id, user_id)
+        verb = "🔇 Muted"
+    elif tier.action == "kick":
+        await client.ban_chat_member(chat_id, user_id, until_date=datetime.now() + timedelta(seconds=30))
+        await client.unban_chat_member(chat_id, user_id)
+        verb = "👢 Kicked"
+    else:
+        if until:
+            await client.ban_chat_member(chat_id, user_id, until_date=until)
+            scheduler.schedule(tier.seconds, "unban", chat_id, user_id, keyed=True)
+        else:
+            await client.ban_chat_member(chat_id, user_id)
+            scheduler.cancel("unban", chat_id, user_id)
+        verb = "🔨 Banned"
+    audit.record(chat_id, tier.action, actor, user_id, tier.seconds or 0)
+    duration = f" for {format_duration(tier.seconds)}" if tier.seconds and tier.action != "kick" else ""
+    return f"{verb} {user_mention(target)}{duration} after {tier.count} warnings."
+
+async def add_warning(client, chat_id: int, target, actor: int = None, reason: str = "", strict=False) -> str:
+    """Add a warning and apply the highest tier the new count has reached, if any. Returns the reply text.
+
+    `actor` is the admin who warned; None means the bot did on its own. The
+    last tier also clears the user's warnings, so the ladder starts over; a
+    user left at or past it (its action failed, or /warnpolicy was lowered)
+    gets it again on the next warning. A failed tier action is reported in
+    the text, or raised if `strict`.
+    """
+    if actor is None:
+        actor = client.me.id if client.me else 0
+    settings = await chat_settings.get(chat_id)
+    count = len(warn_book.add(chat_id, target.id, actor, reason, settings.warn_expiry))
+    audit.record(chat_id, "warn", actor, target.id, count)
+    tiers = settings.warn_tiers
+    text = f"⚠️ Warned {user_mention(target)} (Warnings: {count}/{tiers[-1].count})"
+    if reason:
+        text += f"\nReason: {reason}"
+    tier = next((tier for tier in reversed(tiers) if tier.count <= count), None)
+    if tier is None:
+        return text
+    try:
+        result = await apply_warn_tier(client, chat_id, target, tier, actor)
+    except Exception as e:
+        if strict:
+            raise
+        return f"{text}\n⚠️ {tier.action.capitalize()} failed: {str(e)}"
+    if tier is tiers[-1]:
+        warn_book.clear(chat_id, target.id)
+    return result
+
+# --- AUDIT LOG ---
+
+AUDIT_ACTIONS = ("ban", "unban", "kick", "mute", "unmute", "warn", "unwarn", "promote", "demote", "purge")
+AUDIT_CODES = {action: code for code, action in enumerate(AUDIT_ACTIONS)}
+# time, chat_id, actor, target, action, value (duration in seconds, warning count or messages purged)
+AUDIT_RECORD = struct.Struct("<Iqqqbi")
+AUDIT_COLUMNS = ("I", "q", "q", "q", "b", "i")  # array typecodes of the same fields in a compacted block
+AUDIT_HEADER = struct.Struct("<4sII")           # b"AUDC", records, blocks; then block end offsets
+AUDIT_MAGIC = b"AUDC"
+AUDIT_BLOCK_RECORDS = 1024                      # records per compressed block of a compacted segment
+
+def audit_dir() -> str:
+    # Shard workers write separate logs; a change in shard count starts new ones.
+    return AUDIT_DIR if SHARD is None else os.path.join(AUDIT_DIR, f"shard{SHARD[0]}of{SHARD[1]}")
+
+def encode_segment(raw: bytes) -> bytes:
+    """Raw records to a header, block offsets and blocks of zlib-compressed columns."""
+    step = AUDIT_BLOCK_RECORDS * AUDIT_RECORD.size
+    blocks = []
+    for start in range(0, len(raw), step):
+        rows = list(AUDIT_RECORD.iter_unpack(raw[start:start + step]))
+        columns = b"".join(array(code, (row[i] for row in rows)).tobytes() for i, code in enumerate(AUDIT_COLUMNS))
+        blocks.append(zlib.compress(columns, 6))
+    ends = array("I", itertools.accumulate(map(len, blocks)))
+    header = AUDIT_HEADER.pack(AUDIT_MAGIC, len(raw) // AUDIT_RECORD.size, len(blocks))
+    return header + ends.tobytes() + b"".join(blocks)
+
+def decode_block(data: bytes) -> list:
+    """One compacted block as arrays, in AUDIT_RECORD field order."""
+    raw = zlib.decompress(data)
+    count = len(raw) // AUDIT_RECORD.size
+    columns = []
+    offset = 0
+    for code in AUDIT_COLUMNS:
+        column = array(code)
+        column.frombytes(raw[offset:offset + count * column.itemsize])
+        offset += count * column.itemsize
+        columns.append(column)
+    return columns
+
+class CompactedSegment:
+    """Where the blocks of one compacted segment file start and end."""
+    __slots__ = ("path", "count", "bounds")
+
+    def __init__(self, path: str, head: bytes):
+        magic, self.count, blocks = AUDIT_HEADER.unpack_from(head)
+        if magic != AUDIT_MAGIC:
+            raise ValueError(f"{path} is not a compacted audit segment")
+        self.path = path
+        base = AUDIT_HEADER.size + 4 * blocks
+        ends = array("I")
+        ends.frombytes(head[AUDIT_HEADER.size:base])
+        self.bounds = [base] + [base + end for end in ends]
+
+    @classmethod
+    def open(cls, path: str):
+        with open(path, "rb") as f:
+            head = f.read(AUDIT_HEADER.size)
+            head += f.read(4 * AUDIT_HEADER.unpack(head)[2])
+        return cls(path, head)
+
+    def read_blocks(self, numbers) -> dict:
+        blocks = {}
+        with open(self.path, "rb") as f:
+            for number in numbers:
+                f.seek(self.bounds[number])
+                blocks[number] = decode_block(f.read(self.bounds[number + 1] - self.bounds[number]))
+        return blocks
+
+def _index_add(index: dict, key: int, position: int):
+    # Most (chat, user) keys only ever see one action, so a lone position is stored as a plain int.
+    positions = index.get(key)
+    if positions is None:
+        index[key] = position
+    elif type(positions) is int:
+        index[key] = array("q", (positions, position))
+    else:
+        positions.append(position)
+
+class AuditLog:
+    """Append-only moderation log of fixed-width binary records with in-memory indexes.
+
+    Records are numbered in write order and stored in segments of
+    AUDIT_SEGMENT_RECORDS, named after their first record number. The open
+    segment is a file of raw records; sealed ones are compacted in the
+    background into blocks of zlib-compressed columns. record() only appends
+    to memory and the indexes, a flush task writes behind. Record numbers are
+    indexed by chat, (chat, target) and (chat, actor), so a /modlog query
+    decodes only the blocks holding the records it shows.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.count = 0               # records written or queued
+        self.first = 0               # oldest record kept; older ones were dropped with their segment
+        self._segments = []          # first record number of every segment, ascending
+        self._compacted = {}         # first -> CompactedSegment
+        self._sealed = {}            # first -> raw bytes of a sealed segment not compacted yet
+        self._tail_first = 0         # first record number of the open segment
+        self._tail = bytearray()     # raw records of the open segment
+        self._unwritten = []         # (segment first, record bytes) waiting for the next flush
+        self._blocks = OrderedDict()  # (segment first, block) -> decoded columns, least recently read first
+        self._by_chat = {}
+        self._by_target = {}         # chat_id << 64 | user_id -> position or array of positions
+        self._by_actor = {}
+        self._ready = None
+        self._tasks = []
+
+    def _file(self, first: int, compacted=False) -> str:
+        return os.path.join(self.path, f"{first:012d}.{'col' if compacted else 'raw'}")
+
+    def _index(self, position: int, chat_id: int, actor: int, target: int, indexes=None):
+        by_chat, by_target, by_actor = indexes or (self._by_chat, self._by_target, self._by_actor)
+        _index_add(by_chat, chat_id, position)
+        _index_add(by_actor, chat_id << 64 | actor, position)
+        # Chat-wide actions (a /purge) have no target and are only listed under the chat and the actor.
+        if target:
+            _index_add(by_target, chat_id << 64 | target, position)
+
+    def record(self, chat_id: int, action: str, actor: int, target: int, value: int = 0):
+        """Append one action. Never blocks: the record reaches disk on the next flush."""
+        position = self.count
+        if position - self._tail_first == AUDIT_SEGMENT_RECORDS:
+            self._sealed[self._tail_first] = bytes(self._tail)
+            self._tail_first = position
+            self._tail = bytearray()
+            self._segments.append(position)
+        data = AUDIT_RECORD.pack(int(time.time()), chat_id, actor or 0, target or 0, AUDIT_CODES[action], value)
+        self._tail += data
+        self._unwritten.append((self._tail_first, data))
+        self.count += 1
+        self._index(position, chat_id, actor or 0, target or 0)
+
+    # --- storage ---
+
+    def _scan(self) -> tuple:
+        """(segment firsts, compacted segments, record count) from the file names and headers."""
+        os.makedirs(self.path, exist_ok=True)
+        kinds = {}
+        for name in os.listdir(self.path):
+            stem, _, kind = name.partition(".")
+            if stem.isdigit() and kind in ("raw", "col") and kinds.get(int(stem)) != "col":
+                kinds[int(stem)] = kind
+        compacted = {}
+        for first, kind in kinds.items():
+            if kind == "col":
+                compacted[first] = CompactedSegment.open(self._file(first, True))
+                # A .raw left next to its .col by an interrupted compaction is a stale copy.
+                if os.path.exists(self._file(first)):
+                    os.remove(self._file(first))
+        firsts = sorted(kinds)
+        count = 0
+        if firsts:
+            last = firsts[-1]
+            if last in compacted:
+                count = last + compacted[last].count
+            else:
+                size = os.path.getsize(self._file(last))
+                # Drop a record cut short by a crash.
+                os.truncate(self._file(last), size - size % AUDIT_RECORD.size)
+                count = last + size // AUDIT_RECORD.size
+        return firsts, compacted, count
+
+    def _read_raw(self, first: int) -> bytes:
+        with open(self._file(first), "rb") as f:
+            return f.read()
+
+    async def open(self):
+        """Find the segments and reopen the newest; the indexes are rebuilt in the background."""
+        self.path = audit_dir()
+        self._segments, self._compacted, self.count = await asyncio.to_thread(self._scan)
+        if not self._segments:
+            self._segments = [0]
+        last = self._segments[-1]
+        if last in self._compacted or self.count - last >= AUDIT_SEGMENT_RECORDS:
+            self._segments.append(self.count)
+        self._tail_first = self._segments[-1]
+        if self._tail_first < self.count:
+            self._tail = bytearray(await asyncio.to_thread(self._read_raw, self._tail_first))
+        self.first = self._segments[0]
+        self._ready = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._load(list(self._segments), self._tail_first, bytes(self._tail))),
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._compact_loop()),
+        ]
+
+    def _build(self, segments: list, tail_first: int, tail: bytes) -> tuple:
+        indexes = ({}, {}, {})
+        sealed = {}
+        for first in segments:
+            if first >= tail_first:
+                break
+            segment = self._compacted.get(first)
+            if segment is not None:
+                blocks = segment.read_blocks(range(len(segment.bounds) - 1))
+                rows = itertools.chain.from_iterable(
+                    zip(blocks[number][1], blocks[number][2], blocks[number][3]) for number in sorted(blocks)
+                )
+            else:
+                sealed[first] = raw = self._read_raw(first)
+                rows = ((row[1], row[2], row[3]) for row in AUDIT_RECORD.iter_unpack(raw))
+            for position, (chat_id, actor, target) in enumerate(rows, first):
+                self._index(position, chat_id, actor, target, indexes)
+        for position, row in enumerate(AUDIT_RECORD.iter_unpack(tail), tail_first):
+            self._index(position, row[1], row[2], row[3], indexes)
+        return indexes, sealed
+
+    async def _load(self, segments: list, tail_first: int, tail: bytes):
+        """Index the records that were on disk at open(); records added since are already indexed."""
+        try:
+            (by_chat, by_target, by_actor), sealed = await asyncio.to_thread(self._build, segments, tail_first, tail)
+            self._sealed.update(sealed)
+            for loaded, live in ((by_chat, self._by_chat), (by_target, self._by_target), (by_actor, self._by_actor)):
+                for key, positions in live.items():
+                    for position in (positions,) if type(positions) is int else positions:
+                        _index_add(loaded, key, position)
+            self._by_chat, self._by_target, self._by_actor = by_chat, by_target, by_actor
+        except Exception as e:
+            print(f"❌ Audit log index failed: {e}")
+        finally:
+            self._ready.set()
+
+    def _write(self, batches: list):
+        for first, data in batches:
+            with open(self._file(first), "ab") as f:
+                f.write(data)
+
+    async def flush(self):
+        if not self._unwritten:
+            return
+        batches, self._unwritten = self._unwritten, []
+        grouped = []
+        for first, data in batches:
+            if grouped and grouped[-1][0] == first:
+                grouped[-1][1].append(data)
+            else:
+                grouped.append((first, [data]))
+        try:
+            await asyncio.to_thread(self._write, [(first, b"".join(chunks)) for first, chunks in grouped])
+        except Exception as e:
+            self._unwritten = batches + self._unwritten
+            print(f"❌ Audit log flush failed: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(AUDIT_FLUSH_INTERVAL)
+            await self.flush()
+
+    def _compact(self, first: int, raw: bytes) -> CompactedSegment:
+        target = self._file(first, True)
+        with open(target + ".tmp", "wb") as f:
+            f.write(encode_segment(raw))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + ".tmp", target)
+        os.remove(self._file(first))
+        return CompactedSegment.open(target)
+
+    def _expire(self, firsts: list):
+        for first in firsts:
+            for compacted in (True, False):
+                if os.path.exists(self._file(first, compacted)):
+                    os.remove(self._file(first, compacted))
+
+    async def compact(self):
+        """Compact sealed raw segments into columns and drop segments past AUDIT_RETENTION."""
+        await self._ready.wait()
+        await self.flush()
+        for first in sorted(self._sealed):
+            if any(pending == first for pending, _ in self._unwritten):
+                continue
+            self._compacted[first] = await asyncio.to_thread(self._compact, first, self._sealed[first])
+            del self._sealed[first]
+        if not AUDIT_RETENTION:
+            return
+        cutoff = time.time() - AUDIT_RETENTION
+        expired = []
+        for first, following in zip(self._segments, self._segments[1:]):
+            if (await self._read([following - 1]))[0][0] >= cutoff:
+                break
+            expired.append(first)
+        if not expired:
+            return
+        self._segments = self._segments[len(expired):]
+        self.first = self._segments[0]
+        for first in expired:
+            self._compacted.pop(first, None)
+        for key in [key for key in self._blocks if key[0] < self.first]:
+            del self._blocks[key]
+        await asyncio.to_thread(self._expire, expired)
+        for index in (self._by_chat, self._by_target, self._by_actor):
+            for key, positions in list(index.items()):
+                if type(positions) is int:
+                    if positions < self.first:
+                        del index[key]
+                elif positions[0] < self.first:
+                    del positions[:bisect_left(positions, self.first)]
+                    if not positions:
+                        del index[key]
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(AUDIT_COMPACT_INTERVAL)
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"❌ Audit log compaction failed: {e}")
+
+    # --- queries ---
+
+    def _read_blocks(self, wanted: list) -> dict:
+        by_segment = {}
+        for first, number in wanted:
+            by_segment.setdefault(first, []).append(number)
+        return {
+            (first, number): columns
+            for first, numbers in by_segment.items()
+            for number, columns in self._compacted[first].read_blocks(numbers).items()
+        }
+
+    async def _read(self, positions) -> list:
+        """Records at these positions as (time, chat_id, actor, target, action, value) tuples."""
+        located = []
+        missing = []
+        for position in positions:
+            if position >= self._tail_first:
+                located.append((self._tail, position - self._tail_first))
+                continue
+            first = self._segments[bisect_right(self._segments, position) - 1]
+            if first in self._sealed:
+                located.append((self._sealed[first], position - first))
+                continue
+            key = (first, (position - first) // AUDIT_BLOCK_RECORDS)
+            located.append((key, (position - first) % AUDIT_BLOCK_RECORDS))
+            if key not in self._blocks and key not in missing:
+                missing.append(key)
+        if missing:
+            self._blocks.update(await asyncio.to_thread(self._read_blocks, missing))
+        rows = []
+        for source, offset in located:
+            if type(source) is tuple:
+                self._blocks.move_to_end(source)
+                row = tuple(column[offset] for column in self._blocks[source])
+            else:
+                row = AUDIT_RECORD.unpack_from(source, offset * AUDIT_RECORD.size)
+            rows.append((*row[:4], AUDIT_ACTIONS[row[4]], row[5]))
+        while len(self._blocks) > AUDIT_BLOCK_CACHE:
+            self._blocks.popitem(last=False)
+        return rows
+
+    async def query(self, chat_id: int, target: int = None, actor: int = None, limit=10) -> list:
+        """The newest `limit` actions in a chat, optionally only those against `target` or by `actor`."""
+        await self._ready.wait()
+        if target is not None:
+            positions = self._by_target.get(chat_id << 64 | target)
+        elif actor is not None:
+            positions = self._by_actor.get(chat_id << 64 | actor)
+        else:
+            positions = self._by_chat.get(chat_id)
+        if positions is None:
+            return []
+        if type(positions) is int:
+            positions = (positions,)
+        start = max(len(positions) - limit, bisect_left(positions, self.first))
+        return await self._read(reversed(positions[start:]))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._ready is not None:
+            await self.flush()
+
+audit = AuditLog()
+
+# --- MEDIA ---
+
+class MediaTooLarge(Exception):
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"The file is {size / 2**20:.1f} MB; the limit is {limit / 2**20:.0f} MB.")
+        self.size = size
+        self.limit = limit
+
+class MediaLoader:
+    """Downloads media into memory for re-upload, with a size cap and a limit on concurrent transfers.
+
+    fetch() streams the file chunk by chunk into a BytesIO, so nothing touches
+    the disk and an oversized file is abandoned as soon as it passes the cap.
+    The transfer slot is held, and the buffer kept, until the caller's block
+    ends; the buffer is closed on the way out whether or not the block failed.
+    """
+
+    def __init__(self, concurrency=MEDIA_CONCURRENCY, max_bytes=MEDIA_MAX_BYTES):
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self._semaphore = None
+        self.active = 0
+
+    @contextlib.asynccontextmanager
+    async def fetch(self, client, media, name: str, max_bytes: int = None):
+        """Yield `media` (a Photo, Sticker, Document... or a file ID) as a BytesIO named `name`."""
+        max_bytes = max_bytes or self.max_bytes
+        size = getattr(media, "file_size", None)
+        if size and size > max_bytes:
+            raise MediaTooLarge(size, max_bytes)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.active += 1
+            buffer = io.BytesIO()
+            buffer.name = name  # pyrogram picks the upload's file name and MIME type from it
+            try:
+                chunks = client.stream_media(getattr(media, "file_id", media))
+                try:
+                    async for chunk in chunks:
+                        if buffer.tell() + len(chunk) > max_bytes:
+                            raise MediaTooLarge(buffer.tell() + len(chunk), max_bytes)
+                        buffer.write(chunk)
+                finally:
+                    await chunks.aclose()
+                buffer.seek(0)
+                yield buffer
+            finally:
+                buffer.close()
+                self.active -= 1
+
+media_loader = MediaLoader()
+
+# --- COMMAND ROUTER ---
+
+CHAT_ANY, CHAT_GROUP, CHAT_PRIVATE = "any", "group", "private"
+CHAT_TYPES = {
+    CHAT_GROUP: (enums.ChatType.GROUP, enums.ChatType.SUPERGROUP),
+    CHAT_PRIVATE: (enums.ChatType.PRIVATE,),
+}
+# Same quoting rules as pyrogram's filters.command, so handlers see identical message.command lists.
+COMMAND_ARG_RE = re.compile(r"([\"'])(.*?)(?<!\\)\1|(\S+)")
+
+class CommandSpec:
+    __slots__ = ("callback", "chat", "admin")
+
+    def __init__(self, callback, chat: str, admin: bool):
+        self.callback = callback
+        self.chat = chat
+        self.admin = admin
+
+COMMANDS = {}  # command name -> CommandSpec
+
+def command(*names, chat=CHAT_GROUP, admin=False):
+    """Register a command handler with route_command.
+
+    `chat` limits where the command works (CHAT_GROUP, CHAT_PRIVATE or CHAT_ANY);
+    `admin` makes the router reject non-admins before the handler runs.
+    """
+    def decorator(callback):
+        spec = CommandSpec(callback, chat, admin)
+        for name in names:
+            COMMANDS[name] = spec
+        return callback
+    return decorator
+
+def parse_command(text: str, username: str):
+    """Split '/cmd@bot arg "quoted arg"' into ['cmd', 'arg', 'quoted arg'], or None if it is not ours."""
+    head, *rest = text[1:].split(None, 1)
+    name, _, target = head.partition("@")
+    if target and target.lower() != username:
+        return None
+    name = name.lower()
+    if name not in COMMANDS:
+        return None
+    args = [
+        re.sub(r"\\([\"'])", r"\1", found.group(2) or found.group(3) or "")
+        for found in COMMAND_ARG_RE.finditer(rest[0] if rest else "")
+    ]
+    return [name] + args
+
+async def _starts_with_slash(_, __, message: Message) -> bool:
+    text = message.text or message.caption
+    return bool(text) and text[0] == "/" and len(text) > 1 and not text[1].isspace()
+
+@app.on_message(filters.create(_starts_with_slash))
+async def route_command(client, message: Message):
+    """Single entry point for every command: parse once, look up, check chat type and admin."""
+    me = client.me
+    parsed = parse_command(message.text or message.caption, (me.username or "").lower() if me else "")
+    if parsed is None:
+        return
+    spec = COMMANDS[parsed[0]]
+    if spec.chat != CHAT_ANY and message.chat.type not in CHAT_TYPES[spec.chat]:
+        return
+    message.command = parsed
+    metrics.commands[parsed[0]] += 1
+    start = time.perf_counter()
+    try:
+        if spec.admin and (not message.from_user or not await check_admin_and_reply(client, message)):
+            return
+        await spec.callback(client, message)
+    except Exception as e:
+        metrics.handler_errors[(spec.callback.__name__, type(e).__name__)] += 1
+        raise
+    finally:
+        metrics.observe(metrics.handler_latency, spec.callback.__name__, time.perf_counter() - start)
+
+# --- BASIC COMMANDS ---
+
+@command("start", chat=CHAT_PRIVATE)
+async def start(client, message: Message):
+    await reply(message, "👋 Hello! I'm an advanced group management bot. Add me to a group and make me admin!")
+
+@command("help", chat=CHAT_ANY)
+async def help_command(client, message: Message):
+    help_text = """
+🛠 **Advanced Group Management Bot**
+
+👮 **Admin Tools:**
+/ban [user] - Ban a user
+/unban [user] - Unban a user
+/tban [user] [duration] - Ban a user for a while (30m, 2h, 1d)
+/kick [user] - Kick a user
+/mute [user] [minutes] - Mute a user
+/tmute [user] [duration] - Mute a user for a while (30m, 2h, 1d)
+/unmute [user] - Unmute a user
+/warn [user] [reason] - Warn a user
+/unwarn [user] - Remove warning
+/warns [user] - Check warnings, with reasons and expiry
+/warnpolicy [3 mute 1d, 5 kick, 7 ban|reset] - Escalation tiers
+/warnexpiry [duration|off] - How long warnings count
+/massban, /masskick, /massmute, /masswarn [IDs/@users] [joined:minutes] - Act on many users at once
+/purge [reply|count] - Bulk delete messages
+/purgeuser [user] [count] - Delete a user's recent messages
+/modlog [user|by admin] [count] - Recent moderation actions
+/pin [reply] - Pin a message
+/unpin - Unpin current message
+/settitle [text] - Change group title
+/setphoto [reply] - Set group photo
+/setdescription [text] - Set group description
+/promote [user] - Promote to admin
+/demote [user] - Demote admin
+/queuestats - Outbound queue metrics
+/stats - Handler and API metrics
+
+📝 **Group Features:**
+/setrules [text] - Set group rules
+/rules - Show rules
+/setwelcome [text] - Set welcome message
+/welcome - Show welcome
+/welcomewindow [seconds] - Combine joins into one welcome
+/antiraid [joins/s|off] [silent|restrict] - Raid mode settings
+/report [reply] - Report to admins
+/staff - Show admins
+/addblacklist [words] - Blacklist whole words or "phrases" (spam* also matches spammer)
+/unblacklist [words] - Remove blacklisted words
+/blacklist - Show blacklisted words
+/blacklistmode [delete|warn|mute] - Action on blacklisted words
+/antilink [off|on|strict] [delete|warn|mute] - Link, invite and channel-forward spam
+/allowlink, /denylink, /unlistlink [domains|@channels] - Per-chat link lists
+/filter [trigger] [reply] - Add an auto-reply filter
+/stop [trigger] - Remove a filter
+/filters - List filters
+/setflood [messages] [seconds] [minutes] - Anti-flood settings
+
+💾 **Utilities:**
+/translate [lang] [text|reply] - Translate text
+/setnote [name] [text] - Save note
+/getnote [name] - Get note (or send #name)
+/notes [prefix] [page] - List notes
+/clearnote [name] - Delete a note
+/id - Get user/chat ID
+/info [user] - Get user info
+
+🎉 **Fun:**
+/slap [reply] - Slap a user
+/roll - Roll a dice
+/coin - Flip a coin
+/say [text] - Make bot say something
+    """
+    await reply(message, help_text)
+
+@command("ping", chat=CHAT_ANY)
+async def ping(client, message: Message):
+    start_time = time.time()
+    sent = await reply(message, "🏓 Pinging...", wait=True)
+    end_time = time.time()
+    await edit(sent, f"🏓 Pong! `{round((end_time - start_time) * 1000, 2)}ms`")
+
+@command("queuestats", admin=True)
+async def queue_stats(client, message: Message):
+    stats = outbound.stats()
+    lines = [
+        f"• {name}: {lane['depth']} queued, {lane['sent']} sent, "
+        f"wait avg {lane['avg_wait'] * 1000:.0f}ms / max {lane['max_wait'] * 1000:.0f}ms"
+        for name, lane in stats["lanes"].items()
+    ]
+    inbound = executor.stats(top=0)
+    here = executor.chat_stats(message.chat.id)
+    await reply(
+        message,
+        "📤 **Outbound queue**\n" + "\n".join(lines) +
+        f"\nFloodWaits: {stats['flood_waits']} · failures: {stats['failures']} · chats tracked: {stats['chats']}"
+        "\n\n📥 **Incoming updates**\n• queued: " +
+        ", ".join(f"{name} {count}" for name, count in inbound["depth"].items()) +
+        "\n• shed: " + ", ".join(f"{name} {count}" for name, count in inbound["shed"].items()) +
+        f"\n• this chat: {here['handled']} handled, {here['shed']} shed, "
+        f"wait avg {here['avg_wait'] * 1000:.0f}ms / max {here['max_wait'] * 1000:.0f}ms"
+    )
+
+# --- MODERATION COMMANDS ---
+
+@command("ban", admin=True)
+async def ban_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    try:
+        await client.ban_chat_member(message.chat.id, target.id)
+        # A pending unban from an earlier /tban would lift this one.
+        scheduler.cancel("unban", message.chat.id, target.id)
+        audit.record(message.chat.id, "ban", message.from_user.id, target.id)
+        await reply(message, f"🔨 Banned {user_mention(target)}", disable_web_page_preview=True)
+    except Exception as e:
+        await reply(message, f"❌ Ban failed: {str(e)}")
+
+@command("unban", admin=True)
+async def unban_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    try:
+        await client.unban_chat_member(message.chat.id, target.id)
+        scheduler.cancel("unban", message.chat.id, target.id)
+        audit.record(message.chat.id, "unban", message.from_user.id, target.id)
+        await reply(message, f"✅ Unbanned {user_mention(target)}", disable_web_page_preview=True)
+    except Exception as e:
+        await reply(message, f"❌ Unban failed: {str(e)}")
+
+@command("tban", admin=True)
+async def tban_user(client, message: Message):
+    target, seconds = await resolve_timed_target(client, message)
+    if not target:
+        return
+    try:
+        await client.ban_chat_member(message.chat.id, target.id, until_date=datetime.now() + timedelta(seconds=seconds))
+        scheduler.schedule(seconds, "unban", message.chat.id, target.id, keyed=True)
+        audit.record(message.chat.id, "ban", message.from_user.id, target.id, seconds)
+        await reply(
+            message, f"🔨 Banned {user_mention(target)} for {format_duration(seconds)}", disable_web_page_preview=True
+        )
+    except Exception as e:
+        await reply(message, f"❌ Ban failed: {str(e)}")
+
+@command("kick", admin=True)
+async def kick_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    try:
+        await client.ban_chat_member(
+            message.chat.id,
+            target.id,
+            until_date=datetime.now() + timedelta(seconds=30)
+        )
+        await client.unban_chat_member(message.chat.id, target.id)
+        audit.record(message.chat.id, "kick", message.from_user.id, target.id)
+        await reply(message, f"👢 Kicked {user_mention(target)}", disable_web_page_preview=True)
+    except Exception as e:
+        await reply(message, f"❌ Kick failed: {str(e)}")
+
+@command("mute", admin=True)
+async def mute_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    duration = 60
+    if len(message.command) > 2 and message.command[2].isdigit():
+        duration = int(message.command[2])
+    try:
+        await client.restrict_chat_member(
+            message.chat.id,
+            target.id,
+            MUTED_PERMISSIONS,
+            until_date=datetime.now() + timedelta(minutes=duration)
+        )
+        scheduler.schedule(duration * 60, "unmute", message.chat.id, target.id, keyed=True)
+        audit.record(message.chat.id, "mute", message.from_user.id, target.id, duration * 60)
+        await reply(message, f"🔇 Muted {user_mention(target)} for {duration} minutes", disable_web_page_preview=True)
+    except Exception as e:
+        await reply(message, f"❌ Mute failed: {str(e)}")
+
+async def resolve_timed_target(client, message: Message):
+    """Resolve (user, seconds) for /tban and /tmute; the duration is always the last argument."""
+    needed = 2 if message.reply_to_message else 3
+    seconds = parse_duration(message.command[-1]) if len(message.command) >= needed else None
+    target = await resolve_user(client, message)
+    if not target or not seconds:
+        await reply(message, f"⚠️ Usage: /{message.command[0]} [user] <duration>, e.g. 30m, 2h, 1d")
+        return None, None
+    return target, seconds
+
+@command("tmute", admin=True)
+async def tmute_user(client, message: Message):
+    target, seconds = await resolve_timed_target(client, message)
+    if not target:
+        return
+    try:
+        await client.restrict_chat_member(
+            message.chat.id,
+            target.id,
+            MUTED_PERMISSIONS,
+            until_date=datetime.now() + timedelta(seconds=seconds)
+        )
+        scheduler.schedule(seconds, "unmute", message.chat.id, target.id, keyed=True)
+        audit.record(message.chat.id, "mute", message.from_user.id, target.id, seconds)
+        await reply(
+            message, f"🔇 Muted {user_mention(target)} for {format_duration(seconds)}", disable_web_page_preview=True
+        )
+    except Exception as e:
+        await reply(message, f"❌ Mute failed: {str(e)}")
+
+@command("unmute", admin=True)
+async def unmute_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    try:
+        await client.restrict_chat_member(
+            message.chat.id,
+            target.id,
+            UNMUTED_PERMISSIONS
+        )
+        scheduler.cancel("unmute", message.chat.id, target.id)
+        audit.record(message.chat.id, "unmute", message.from_user.id, target.id)
+        await reply(message, f"🔊 Unmuted {user_mention(target)}", disable_web_page_preview=True)
+    except Exception as e:
+        await reply(message, f"❌ Unmute failed: {str(e)}")
+
+@command("warn", admin=True)
+async def warn_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    reason = " ".join(message.command[1:] if message.reply_to_message else message.command[2:])
+    await reply(message, await add_warning(client, message.chat.id, target, message.from_user.id, reason))
+
+@command("unwarn", admin=True)
+async def unwarn_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
     user_id = target.id
     chat_id = message.chat.id
-    if warnings.get(chat_id, {}).get(user_id, 0) > 0:
-        warnings[chat_id][user_id] -= 1
-        count = warnings[chat_id][user_id]
-        await message.reply(f"✅ Removed warning from {user_mention(target)} (Now: {count}/3)")
+    if warn_book.remove_latest(chat_id, user_id):
+        count = warn_book.count(chat_id, user_id)
+        limit = (await chat_settings.get(chat_id)).warn_tiers[-1].count
+        audit.record(chat_id, "unwarn", message.from_user.id, user_id, count)
+        await reply(message, f"✅ Removed warning from {user_mention(target)} (Now: {count}/{limit})")
     else:
-        await message.reply(f"ℹ️ {user_mention(target)} has no warnings.")
+        await reply(message, f"ℹ️ {user_mention(target)} has no warnings.")
 
-@app.on_message(filters.command("warns") & filters.group)
+@command("warns")
 async def check_warns(client, message: Message):
     target = await resolve_user(client, message)
     if not target:
         target = message.from_user
-    user_id = target.id
     chat_id = message.chat.id
-    count = warnings.get(chat_id, {}).get(user_id, 0)
-    await message.reply(f"⚠️ {user_mention(target)} has {count}/3 warnings.")
+    entries = warn_book.active(chat_id, target.id)
+    settings = await chat_settings.get(chat_id)
+    text = f"⚠️ {user_mention(target)} has {len(entries)}/{settings.warn_tiers[-1].count} warnings."
+    now = time.time()
+    me = client.me.id if client.me else 0
+    for number, entry in enumerate(entries, 1):
+        by = peer_cache.get(entry.actor)
+        text += f"\n{number}. {entry.reason or 'no reason given'} — "
+        if by:
+            text += f"by {user_mention(by)}, "
+        elif entry.actor == me:
+            text += "automatic, "
+        text += f"{format_span(now - entry.warned_at)} ago, "
+        if entry.expires_at == float("inf"):
+            text += "never lapses"
+        else:
+            text += f"lapses in {format_span(entry.expires_at - now)}"
+    upcoming = [tier for tier in settings.warn_tiers if tier.count > len(entries)]
+    if upcoming:
+        text += f"\nNext: {upcoming[0].describe()}"
+    await reply(message, text, disable_web_page_preview=True)
+
+@command("warnpolicy", admin=True)
+async def warn_policy(client, message: Message):
+    chat_id = message.chat.id
+    text = " ".join(message.command[1:]).strip()
+    if text.lower() == "reset":
+        store.delete("settings", chat_id, "warn_tiers")
+        (await chat_settings.get(chat_id)).warn_tiers = parse_warn_tiers(WARN_TIERS)
+    elif text:
+        try:
+            await chat_settings.set_warn_tiers(chat_id, parse_warn_tiers(text))
+        except ValueError as e:
+            await reply(message, f"⚠️ {e}. Usage: /warnpolicy 3 mute 1d, 5 kick, 7 ban")
+            return
+    settings = await chat_settings.get(chat_id)
+    if settings.warn_expiry:
+        expiry = f"each warning lapses after {format_duration(settings.warn_expiry)}"
+    else:
+        expiry = "warnings never lapse"
+    await reply(
+        message,
+        "⚖️ **Warning policy**\n" + "\n".join(f"• {tier.describe()}" for tier in settings.warn_tiers) +
+        f"\nThe last tier resets the count; {expiry}."
+    )
+
+@command("warnexpiry", admin=True)
+async def warn_expiry(client, message: Message):
+    args = message.command[1:]
+    if not args:
+        settings = await chat_settings.get(message.chat.id)
+        current = format_duration(settings.warn_expiry) if settings.warn_expiry else "never"
+        await reply(message, f"⏳ Warnings lapse after: {current}. Usage: /warnexpiry <duration|off>, e.g. 30d")
+        return
+    seconds = 0 if args[0].lower() in ("off", "never") else parse_duration(args[0])
+    if seconds is None:
+        await reply(message, "⚠️ Usage: /warnexpiry <duration|off>, e.g. 12h, 30d")
+        return
+    await chat_settings.set(message.chat.id, "warn_expiry", seconds)
+    # Existing warnings keep the lifetime they were given.
+    if seconds:
+        await reply(message, f"✅ New warnings lapse after {format_duration(seconds)}.")
+    else:
+        await reply(message, "✅ New warnings never lapse.")
+
+async def report_purge(status: Message, deleted: int, failed: int):
+    text = f"🧹 Deleted {deleted} messages."
+    if failed:
+        text += f" ({failed} could not be deleted)"
+    try:
+        await edit(status, text)
+    except Exception:
+        pass
+    delete_message_with_delay(status, 5)
+
+@command("purge", admin=True)
+async def purge_messages(client, message: Message):
+    count = None
+    if len(message.command) > 1:
+        if not message.command[1].isdigit() or int(message.command[1]) < 1:
+            await reply(message, "⚠️ Usage: /purge (reply) or /purge <count>")
+            return
+        count = int(message.command[1])
+    elif not message.reply_to_message:
+        await reply(message, "⚠️ Reply to the first message to purge from, or use /purge <count>.")
+        return
+    chat_id = message.chat.id
+    try:
+        status = await reply(message, "🧹 Purging…", wait=True)
+        if count is None:
+            # Deleting IDs that no longer exist is a no-op, so the range needs no history lookup.
+            ids = iter_id_range(message.reply_to_message.id, message.id)
+            recent_messages.forget(chat_id, range(message.reply_to_message.id, message.id + 1))
+        else:
+            found = [message.id] + recent_messages.recent(chat_id, count, before_id=message.id)
+            recent_messages.forget(chat_id, found)
+            ids = iter_ids(found)
+        deleted, failed = await purge_message_ids(client, chat_id, ids, status)
+        audit.record(chat_id, "purge", message.from_user.id, 0, deleted)
+        await report_purge(status, deleted, failed)
+    except Exception as e:
+        await reply(message, f"❌ Purge failed: {str(e)}")
+
+@command("purgeuser", admin=True)
+async def purge_user_messages(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Usage: /purgeuser <user> [count], or reply to one of their messages.")
+        return
+    count = 100
+    args = message.command[1:] if message.reply_to_message else message.command[2:]
+    if args and args[0].isdigit():
+        count = int(args[0])
+    chat_id = message.chat.id
+    try:
+        status = await reply(message, f"🧹 Purging messages from {user_mention(target)}…", disable_web_page_preview=True, wait=True)
+        found = [message.id] + recent_messages.recent(chat_id, count, user_id=target.id, before_id=message.id)
+        recent_messages.forget(chat_id, found)
+        deleted, failed = await purge_message_ids(client, chat_id, iter_ids(found), status)
+        audit.record(chat_id, "purge", message.from_user.id, target.id, deleted)
+        await report_purge(status, deleted, failed)
+    except Exception as e:
+        await reply(message, f"❌ Purge failed: {str(e)}")
+
+AUDIT_ICONS = {
+    "ban": "🔨", "unban": "✅", "kick": "👢", "mute": "🔇", "unmute": "🔊",
+    "warn": "⚠️", "unwarn": "✅", "promote": "👑", "demote": "👑", "purge": "🧹",
+}
+
+def audit_user(user_id: int) -> str:
+    user = peer_cache.get(user_id)
+    return user_mention(user) if user else f"`{user_id}`"
 
-@app.on_message(filters.command("purge") & filters.group)
-async def purge_messages(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    if not message.reply_to_message:
-        await message.reply("⚠️ Reply to the first message to purge from.")
-        return
-    try:
-        start_id = message.reply_to_message.id
-        end_id = message.id
-        messages_to_delete = []
-        async for msg in client.get_chat_history(
-            chat_id=message.chat.id,
-            offset_id=end_id + 1,
-            limit=100,
-            reverse=True,
-        ):
-            if msg.id < start_id:
-                break
-            if start_id <= msg.id <= end_id:
-                messages_to_delete.append(msg.id)
-        if not messages_to_delete:
-            await message.reply("❌ No messages found to delete.")
+def format_audit(row) -> str:
+    when, _, actor, target, action, value = row
+    text = f"• {datetime.fromtimestamp(when):%d %b %H:%M} {AUDIT_ICONS[action]} {action}"
+    if action == "purge":
+        text += f" {value} messages" + (f" from {audit_user(target)}" if target else "")
+    else:
+        text += f" {audit_user(target)}"
+        if action in ("ban", "mute") and value:
+            text += f" for {format_duration(value)}"
+        elif action in ("warn", "unwarn"):
+            # Tiers are per chat and can change, so only the count at the time is shown.
+            text += f" (warnings: {value})"
+    return text + f" by {audit_user(actor)}"
+
+@command("modlog", admin=True)
+async def show_modlog(client, message: Message):
+    """/modlog [count], /modlog <user> [count] for actions against them, /modlog by <admin> [count]."""
+    args = message.command[1:]
+    by = bool(args) and args[0].lower() == "by"
+    if by:
+        args = args[1:]
+    limit = 10
+    if args and args[-1].isdigit() and int(args[-1]) <= AUDIT_QUERY_MAX and (len(args) > 1 or not by):
+        limit = max(int(args.pop()), 1)  # real user IDs are never this small
+    user = None
+    if args:
+        try:
+            user = await lookup_user(client, args[0])
+        except Exception as e:
+            await reply(message, f"❌ User not found: {e}")
             return
-        await purge_messages_in_chunks(client, message.chat.id, messages_to_delete)
-        notify = await message.reply(f"🧹 Deleted {len(messages_to_delete)} messages.")
-        await delete_message_with_delay(notify, 5)
-    except Exception as e:
-        await message.reply(f"❌ Purge failed: {str(e)}")
+    elif message.reply_to_message and message.reply_to_message.from_user:
+        user = message.reply_to_message.from_user
+    if (args or by) and user is None:
+        await reply(
+            message,
+            "⚠️ Usage: /modlog [count], /modlog <user> [count] or /modlog by <admin> [count]"
+            f" (count ≤ {AUDIT_QUERY_MAX})"
+        )
+        return
+    rows = await audit.query(
+        message.chat.id,
+        target=user.id if user and not by else None,
+        actor=user.id if user and by else None,
+        limit=limit
+    )
+    if user is None:
+        title = "📋 **Moderation log**"
+    elif by:
+        title = f"📋 **Actions by {user_mention(user)}**"
+    else:
+        title = f"📋 **Actions against {user_mention(user)}**"
+    await reply(
+        message, title + "\n" + ("\n".join(map(format_audit, rows)) or "Nothing recorded yet."),
+        disable_web_page_preview=True
+    )
 
-@app.on_message(filters.command("pin") & filters.group)
+@command("pin", admin=True)
 async def pin_message(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
     if not message.reply_to_message:
-        await message.reply("⚠️ Reply to a message to pin.")
+        await reply(message, "⚠️ Reply to a message to pin.")
         return
     try:
         await client.pin_chat_message(
@@ -345,230 +2367,1591 @@ async def pin_message(client, message: Message):
             message.reply_to_message.id,
             disable_notification=True
         )
-        await message.reply("📌 Message pinned.")
+        await reply(message, "📌 Message pinned.")
     except Exception as e:
-        await message.reply(f"❌ Pin failed: {str(e)}")
+        await reply(message, f"❌ Pin failed: {str(e)}")
 
-@app.on_message(filters.command("unpin") & filters.group)
+@command("unpin", admin=True)
 async def unpin_message(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
     try:
         await client.unpin_chat_message(message.chat.id)
-        await message.reply("📌 Message unpinned.")
+        await reply(message, "📌 Message unpinned.")
     except Exception as e:
-        await message.reply(f"❌ Unpin failed: {str(e)}")
+        await reply(message, f"❌ Unpin failed: {str(e)}")
 
-@app.on_message(filters.command("settitle") & filters.group)
+@command("settitle", admin=True)
 async def set_title(client, message: Message):
-    if not await check_admin_and_reply(client, message):
+    if len(message.command) < 2:
+        await reply(message, "⚠️ Usage: /settitle <new title>")
+        return
+    title = " ".join(message.command[1:])
+    try:
+        await client.set_chat_title(message.chat.id, title)
+        await reply(message, f"✅ Title updated to: {title}")
+    except Exception as e:
+        await reply(message, f"❌ Title change failed: {str(e)}")
+
+@command("setphoto", admin=True)
+async def set_photo(client, message: Message):
+    if not message.reply_to_message or not message.reply_to_message.photo:
+        await reply(message, "⚠️ Reply to a photo to set as group photo.")
+        return
+    try:
+        async with media_loader.fetch(client, message.reply_to_message.photo, "photo.jpg") as photo:
+            await client.set_chat_photo(message.chat.id, photo=photo)
+        await reply(message, "✅ Group photo updated!")
+    except MediaTooLarge as e:
+        await reply(message, f"⚠️ {e}")
+    except Exception as e:
+        await reply(message, f"❌ Failed to set photo: {str(e)}")
+
+@command("setdescription", admin=True)
+async def set_description(client, message: Message):
+    if len(message.command) < 2:
+        await reply(message, "⚠️ Usage: /setdescription <text>")
+        return
+    desc = " ".join(message.command[1:])
+    try:
+        await client.set_chat_description(message.chat.id, desc)
+        await reply(message, "✅ Group description updated!")
+    except Exception as e:
+        await reply(message, f"❌ Failed to set description: {str(e)}")
+
+@command("promote", admin=True)
+async def promote_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    try:
+        await client.promote_chat_member(
+            message.chat.id,
+            target.id,
+            privileges=ChatPrivileges(
+                can_manage_chat=True,
+                can_delete_messages=True,
+                can_manage_video_chats=True,
+                can_restrict_members=True,
+                can_promote_members=False,
+                can_change_info=True,
+                can_post_messages=True,
+                can_edit_messages=True,
+                can_invite_users=True,
+                can_pin_messages=True,
+                can_manage_topics=True
+            )
+        )
+        admin_cache.invalidate(message.chat.id)
+        audit.record(message.chat.id, "promote", message.from_user.id, target.id)
+        await reply(message, f"👑 Promoted {user_mention(target)} to admin!")
+    except Exception as e:
+        await reply(message, f"❌ Promote failed: {str(e)}")
+
+@command("demote", admin=True)
+async def demote_user(client, message: Message):
+    target = await resolve_user(client, message)
+    if not target:
+        await reply(message, "⚠️ Reply to a user, or provide a valid username/ID.")
+        return
+    try:
+        await client.promote_chat_member(
+            message.chat.id,
+            target.id,
+            privileges=ChatPrivileges()
+        )
+        admin_cache.invalidate(message.chat.id)
+        audit.record(message.chat.id, "demote", message.from_user.id, target.id)
+        await reply(message, f"👑 Demoted {user_mention(target)} from admin!")
+    except Exception as e:
+        await reply(message, f"❌ Demote failed: {str(e)}")
+
+BULK_ACTIONS = {
+    # command -> (progress text, summary verb, default duration in seconds or None)
+    "massban": ("Banning", "Banned", None),
+    "masskick": ("Kicking", "Kicked", None),
+    "massmute": ("Muting", "Muted", 3600),
+    "masswarn": ("Warning", "Warned", None),
+}
+BULK_SUMMARY_NAMES = 20        # failed/skipped users listed by name in the summary
+
+async def resolve_bulk_targets(client, message: Message, args) -> tuple:
+    """Resolve IDs, @usernames, joined:<minutes> and the replied-to user into (users, unresolved refs)."""
+    users = {}
+    if message.reply_to_message and message.reply_to_message.from_user:
+        user = message.reply_to_message.from_user
+        users[user.id] = user
+    lookups = []
+    for arg in args:
+        if arg.lower().startswith("joined:") and arg[7:].isdigit():
+            since = time.time() - int(arg[7:]) * 60
+            for joined_at, user in welcome_batcher.joins.get(message.chat.id, ()):
+                if joined_at >= since:
+                    users[user.id] = user
+        elif arg.isdigit():
+            user = peer_cache.get(int(arg))
+            if user:
+                users[user.id] = user
+            else:
+                lookups.append((arg, int(arg)))
+        elif arg.startswith("@"):
+            user = peer_cache.get_by_username(arg[1:])
+            if user:
+                users[user.id] = user
+            else:
+                lookups.append((arg, arg[1:]))
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def lookup(ref):
+        async with semaphore:
+            user = await call_with_floodwait(client.get_users, ref)
+        peer_cache.put(user)
+        return user
+
+    unresolved = []
+    results = await asyncio.gather(*(lookup(ref) for _, ref in lookups), return_exceptions=True)
+    for (arg, _), result in zip(lookups, results):
+        if isinstance(result, BaseException):
+            unresolved.append(arg)
+        else:
+            users[result.id] = result
+    return list(users.values()), unresolved
+
+@command(*BULK_ACTIONS, admin=True)
+async def bulk_moderate(client, message: Message):
+    """Apply one action to many users at once and report the outcome in a single message."""
+    action = message.command[0]
+    progress, verb, seconds = BULK_ACTIONS[action]
+    args = message.command[1:]
+    if action in ("massban", "massmute") and args and not args[-1].isdigit() and parse_duration(args[-1]):
+        seconds = parse_duration(args.pop())
+    users, unresolved = await resolve_bulk_targets(client, message, args)
+    if not users:
+        await reply(
+            message,
+            f"⚠️ Usage: /{action} <IDs/@usernames…> [joined:<minutes>]"
+            f"{' [duration]' if action in ('massban', 'massmute') else ''}, or reply to a user."
+        )
+        return
+    chat_id = message.chat.id
+    roster = await admin_cache.get(client, chat_id)
+    me = client.me.id if client.me else None
+    skipped = [user for user in users if user.id in roster or user.id == me]
+    targets = [user for user in users if user.id not in roster and user.id != me]
+    status = await reply(message, f"⏳ {progress} {len(targets)} users…", wait=True)
+    until = datetime.now() + timedelta(seconds=seconds) if seconds else None
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def apply(user):
+        async with semaphore:
+            if action == "massban":
+                if until:
+                    await call_with_floodwait(client.ban_chat_member, chat_id, user.id, until_date=until)
+                    scheduler.schedule(seconds, "unban", chat_id, user.id, keyed=True)
+                else:
+                    await call_with_floodwait(client.ban_chat_member, chat_id, user.id)
+                    scheduler.cancel("unban", chat_id, user.id)
+                audit.record(chat_id, "ban", message.from_user.id, user.id, seconds or 0)
+            elif action == "masskick":
+                await call_with_floodwait(
+                    client.ban_chat_member, chat_id, user.id, until_date=datetime.now() + timedelta(seconds=30)
+                )
+                await call_with_floodwait(client.unban_chat_member, chat_id, user.id)
+                audit.record(chat_id, "kick", message.from_user.id, user.id)
+            elif action == "massmute":
+                await call_with_floodwait(client.restrict_chat_member, chat_id, user.id, MUTED_PERMISSIONS, until_date=until)
+                scheduler.schedule(seconds, "unmute", chat_id, user.id, keyed=True)
+                audit.record(chat_id, "mute", message.from_user.id, user.id, seconds)
+            else:
+                # The warning is kept, but a user whose tier action failed counts as failed.
+                await add_warning(client, chat_id, user, message.from_user.id, strict=True)
+
+    results = await asyncio.gather(*(apply(user) for user in targets), return_exceptions=True)
+    failed = [user for user, result in zip(targets, results) if isinstance(result, BaseException)]
+
+    def names(items):
+        listed = ", ".join(items[:BULK_SUMMARY_NAMES])
+        return listed + (f" and {len(items) - BULK_SUMMARY_NAMES} more" if len(items) > BULK_SUMMARY_NAMES else "")
+
+    text = f"✅ {verb} {len(targets) - len(failed)}/{len(targets)} users"
+    if seconds and action != "masskick":
+        text += f" for {format_duration(seconds)}"
+    text += "."
+    if failed:
+        text += f"\n❌ Failed: {names([user_mention(user) for user in failed])}"
+    if skipped:
+        text += f"\n🛡 Skipped admins: {names([user_mention(user) for user in skipped])}"
+    if unresolved:
+        text += f"\n❓ Not found: {names(unresolved)}"
+    try:
+        await edit(status, text, disable_web_page_preview=True)
+    except Exception:
+        await reply(message, text, disable_web_page_preview=True)
+
+# --- GROUP FEATURES ---
+
+WELCOME_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+WELCOME_FIELDS = ("mention", "title", "first", "id", "count", "username")
+
+class WelcomeTemplate:
+    """A welcome message parsed once into (literal, placeholder) pairs."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts = []
+        self.unknown = set()
+        literal = ""
+        pieces = WELCOME_PLACEHOLDER_RE.split(source)
+        for i, piece in enumerate(pieces):
+            if i % 2 == 0:
+                literal += piece
+            elif piece in WELCOME_FIELDS:
+                self.parts.append((literal, piece))
+                literal = ""
+            else:
+                self.unknown.add(piece)
+                literal += "{" + piece + "}"
+        self.tail = literal
+        self.fields = {field for _, field in self.parts}
+
+    def render(self, values: dict) -> str:
+        return "".join([literal + values[field] for literal, field in self.parts]) + self.tail
+
+RAID_ACTIONS = ("silent", "restrict")
+
+class ChatSettings:
+    __slots__ = (
+        "rules", "welcome", "welcome_window", "raid_rate", "raid_action", "flood_limit", "flood_window", "flood_mute",
+        "link_mode", "link_action", "link_allow", "link_deny", "warn_tiers", "warn_expiry"
+    )
+
+    def __init__(self, rules: str, welcome: WelcomeTemplate, welcome_window=WELCOME_WINDOW,
+                 raid_rate=RAID_JOIN_RATE, raid_action="silent", flood_limit=FLOOD_LIMIT,
+                 flood_window=FLOOD_WINDOW, flood_mute=FLOOD_MUTE_MINUTES, link_mode=LINK_MODE,
+                 link_action="delete", link_allow=frozenset(), link_deny=frozenset(), warn_tiers=None,
+                 warn_expiry=WARN_EXPIRY):
+        self.rules = rules
+        self.welcome = welcome
+        self.welcome_window = welcome_window
+        self.raid_rate = raid_rate
+        self.raid_action = raid_action
+        self.flood_limit = flood_limit
+        self.flood_window = flood_window
+        self.flood_mute = flood_mute
+        self.link_mode = link_mode
+        self.link_action = link_action
+        self.link_allow = link_allow  # frozenset of domains
+        self.link_deny = link_deny
+        self.warn_tiers = warn_tiers or parse_warn_tiers(WARN_TIERS)  # WarnTiers sorted by count
+        self.warn_expiry = warn_expiry
+
+class SettingsCache:
+    """Per-chat rules, welcome and anti-raid settings, loaded on first use and LRU-bounded."""
+
+    def __init__(self, max_chats=SETTINGS_CACHE_MAX_CHATS):
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._default_welcome = None
+
+    def _default_template(self) -> WelcomeTemplate:
+        if self._default_welcome is None or self._default_welcome.source != welcome_message:
+            self._default_welcome = WelcomeTemplate(welcome_message)
+        return self._default_welcome
+
+    async def get(self, chat_id: int) -> ChatSettings:
+        settings = self._chats.get(chat_id)
+        if settings is not None:
+            self._chats.move_to_end(chat_id)
+            return settings
+        values = await store.fetch_settings(chat_id)
+        welcome = values.get("welcome")
+        settings = ChatSettings(
+            values.get("rules", rules_text),
+            WelcomeTemplate(welcome) if welcome is not None else self._default_template(),
+            float(values.get("welcome_window", WELCOME_WINDOW)),
+            float(values.get("raid_rate", RAID_JOIN_RATE)),
+            values.get("raid_action", "silent"),
+            int(values.get("flood_limit", FLOOD_LIMIT)),
+            float(values.get("flood_window", FLOOD_WINDOW)),
+            int(values.get("flood_mute", FLOOD_MUTE_MINUTES)),
+            values.get("link_mode", LINK_MODE),
+            values.get("link_action", "delete"),
+            frozenset(values.get("link_allow", "").split()),
+            frozenset(values.get("link_deny", "").split()),
+            parse_warn_tiers(values.get("warn_tiers", WARN_TIERS)),
+            int(values.get("warn_expiry", WARN_EXPIRY))
+        )
+        self._remember(chat_id, settings)
+        return settings
+
+    def _remember(self, chat_id: int, settings: ChatSettings):
+        self._chats[chat_id] = settings
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def chat_ids(self) -> list:
+        """Cached chats, least recently used first."""
+        return list(self._chats)
+
+    async def set(self, chat_id: int, key: str, value):
+        setattr(await self.get(chat_id), key, value)
+        store.put("settings", chat_id, key, str(value))
+
+    async def set_rules(self, chat_id: int, rules: str):
+        await self.set(chat_id, "rules", rules)
+
+    async def set_welcome(self, chat_id: int, template: WelcomeTemplate):
+        (await self.get(chat_id)).welcome = template
+        store.put("settings", chat_id, "welcome", template.source)
+
+    async def set_warn_tiers(self, chat_id: int, tiers: tuple):
+        (await self.get(chat_id)).warn_tiers = tiers
+        store.put("settings", chat_id, "warn_tiers", ", ".join(map(str, tiers)))
+
+    async def set_domains(self, chat_id: int, key: str, domains: frozenset):
+        setattr(await self.get(chat_id), key, domains)
+        store.put("settings", chat_id, key, " ".join(sorted(domains)))
+
+chat_settings = SettingsCache()
+
+async def welcome_values(client, chat, user, template: WelcomeTemplate, count=None) -> dict:
+    """Build the placeholder values a template needs; the member count costs an API call."""
+    values = {
+        "mention": user.mention,
+        "title": chat.title or "",
+        "first": user.first_name or "",
+        "id": str(user.id),
+        "username": f"@{user.username}" if user.username else user.mention,
+    }
+    if "count" in template.fields:
+        if count is None:
+            try:
+                count = await client.get_chat_members_count(chat.id)
+            except Exception:
+                count = "?"
+        values["count"] = str(count)
+    return values
+
+@command("setrules", admin=True)
+async def set_rules(client, message: Message):
+    if len(message.command) < 2:
+        await reply(message, "⚠️ Usage: /setrules <text>")
+        return
+    await chat_settings.set_rules(message.chat.id, " ".join(message.command[1:]))
+    await reply(message, "✅ Rules updated!")
+
+@command("rules")
+async def show_rules(_, message: Message):
+    await reply(message, (await chat_settings.get(message.chat.id)).rules)
+
+@command("setwelcome", admin=True)
+async def set_welcome(client, message: Message):
+    if len(message.command) < 2:
+        await reply(
+            message,
+            "⚠️ Usage: /setwelcome <message>\n"
+            "Placeholders: {mention}, {title}, {first}, {id}, {count}, {username}."
+        )
+        return
+    template = WelcomeTemplate(" ".join(message.command[1:]))
+    await chat_settings.set_welcome(message.chat.id, template)
+    if template.unknown:
+        unknown = ", ".join("{" + name + "}" for name in sorted(template.unknown))
+        await reply(message, f"✅ Welcome message updated! Unknown placeholders left as text: {unknown}")
+    else:
+        await reply(message, "✅ Welcome message updated!")
+
+@command("welcome")
+async def show_welcome(client, message: Message):
+    template = (await chat_settings.get(message.chat.id)).welcome
+    await reply(message, template.render(await welcome_values(client, message.chat, message.from_user, template)))
+
+class WelcomeBatcher:
+    """Coalesces joins per chat into one welcome and switches to raid mode on join bursts.
+
+    Joins are collected for the chat's welcome window and greeted with a single
+    message, which replaces the previous welcome. The window runs in a task of
+    its own, so the handler returns at once and doesn't hold up the chat's lane.
+    When the join rate over RAID_DETECT_WINDOW reaches the chat's raid rate,
+    welcomes stop until RAID_MODE_DURATION after the last burst, and new members
+    are optionally restricted until then.
+    """
+
+    def __init__(self):
+        self.joins = {}          # chat_id -> deque of (timestamp, user) for recent joins
+        self._pending = {}       # chat_id -> (trigger message, [users])
+        self._last_welcome = {}  # chat_id -> Message
+        self._raid_until = {}    # chat_id -> monotonic deadline
+        self._flushes = {}       # chat_id -> task greeting the pending joins when the window ends
+
+    def record(self, chat_id: int, users) -> float:
+        """Log joins and return the chat's join rate per second over RAID_DETECT_WINDOW."""
+        now = time.time()
+        log = self.joins.get(chat_id)
+        if log is None:
+            log = self.joins[chat_id] = deque(maxlen=JOIN_LOG_SIZE)
+        for user in users:
+            log.append((now, user))
+        recent = 0
+        for joined_at, _ in reversed(log):
+            if now - joined_at > RAID_DETECT_WINDOW:
+                break
+            recent += 1
+        return recent / RAID_DETECT_WINDOW
+
+    def in_raid(self, chat_id: int) -> bool:
+        deadline = self._raid_until.get(chat_id)
+        if deadline is None:
+            return False
+        if deadline <= time.monotonic():
+            del self._raid_until[chat_id]
+            return False
+        return True
+
+    async def on_join(self, client, message: Message):
+        chat_id = message.chat.id
+        settings = await chat_settings.get(chat_id)
+        users = [user for user in message.new_chat_members if not user.is_self]
+        if not users:
+            return
+        rate = self.record(chat_id, users)
+        if settings.raid_rate and rate >= settings.raid_rate:
+            started = not self.in_raid(chat_id)
+            self._raid_until[chat_id] = time.monotonic() + RAID_MODE_DURATION
+            if started:
+                self._pending.pop(chat_id, None)
+                await reply(
+                    message,
+                    f"🚨 Raid detected ({rate:.1f} joins/s). Welcomes are paused"
+                    + (" and new members are restricted." if settings.raid_action == "restrict" else "."),
+                    quote=False,
+                    priority=PRIORITY_MODERATION
+                )
+        if self.in_raid(chat_id):
+            if settings.raid_action == "restrict":
+                await self._restrict(client, chat_id, users)
+            return
+        pending = self._pending.get(chat_id)
+        if pending is not None:
+            pending[1].extend(users)
+            self._pending[chat_id] = (message, pending[1])
+            return
+        self._pending[chat_id] = (message, users)
+        if settings.welcome_window > 0:
+            self._flushes[chat_id] = asyncio.create_task(self._flush_later(client, chat_id, settings))
+        else:
+            await self._flush(client, chat_id, settings)
+
+    async def _flush_later(self, client, chat_id: int, settings: ChatSettings):
+        await asyncio.sleep(settings.welcome_window)
+        self._flushes.pop(chat_id, None)
+        try:
+            await self._flush(client, chat_id, settings)
+        except Exception as e:
+            print(f"❌ Welcome in {chat_id} failed: {e!r}")
+
+    async def _restrict(self, client, chat_id: int, users):
+        until = datetime.now() + timedelta(seconds=RAID_MODE_DURATION)
+        for user in users:
+            try:
+                await call_with_floodwait(client.restrict_chat_member, chat_id, user.id, MUTED_PERMISSIONS, until_date=until)
+                # Telegram lifts this one itself; a stale unmute from before the user left must not.
+                scheduler.cancel("unmute", chat_id, user.id)
+            except Exception:
+                pass
+
+    async def _flush(self, client, chat_id: int, settings: ChatSettings):
+        pending = self._pending.pop(chat_id, None)
+        if pending is None:
+            return
+        message, users = pending
+        template = settings.welcome
+        values = await welcome_values(client, message.chat, users[0], template)
+        if len(users) > 1:
+            group_values = [await welcome_values(client, message.chat, user, template, values.get("count")) for user in users]
+            for field in ("mention", "first", "id", "username"):
+                values[field] = ", ".join(user_values[field] for user_values in group_values)
+        previous = self._last_welcome.pop(chat_id, None)
+        if previous is not None:
+            try:
+                await delete(previous, PRIORITY_NORMAL)
+            except Exception:
+                pass
+        self._last_welcome[chat_id] = await reply(message, template.render(values), quote=False, wait=True)
+
+welcome_batcher = WelcomeBatcher()
+
+@app.on_message(filters.new_chat_members & filters.group)
+async def welcome_new_member(client, message: Message):
+    await welcome_batcher.on_join(client, message)
+
+@command("welcomewindow", admin=True)
+async def set_welcome_window(client, message: Message):
+    try:
+        window = float(message.command[1])
+    except (IndexError, ValueError):
+        window = -1
+    if not 0 <= window <= 60:
+        await reply(message, "⚠️ Usage: /welcomewindow <seconds 0-60>")
+        return
+    await chat_settings.set(message.chat.id, "welcome_window", window)
+    await reply(message, f"✅ Joins within {window:g}s will share one welcome message.")
+
+@command("antiraid", admin=True)
+async def set_antiraid(client, message: Message):
+    args = [arg.lower() for arg in message.command[1:]]
+    if args and args[0] == "off":
+        await chat_settings.set(message.chat.id, "raid_rate", 0.0)
+        await reply(message, "✅ Raid detection disabled.")
+        return
+    try:
+        rate = float(args[0])
+    except (IndexError, ValueError):
+        rate = 0
+    action = args[1] if len(args) > 1 else "silent"
+    if rate <= 0 or action not in RAID_ACTIONS:
+        await reply(message, "⚠️ Usage: /antiraid <joins per second> [silent|restrict] or /antiraid off")
+        return
+    await chat_settings.set(message.chat.id, "raid_rate", rate)
+    await chat_settings.set(message.chat.id, "raid_action", action)
+    await reply(message, f"✅ Raid mode ({action}) triggers at {rate:g} joins/s.")
+
+@command("report")
+async def report_user(client, message: Message):
+    if not message.reply_to_message:
+        await reply(message, "⚠️ Reply to a message to report.")
+        return
+    admins = await get_staff_mentions(client, message.chat.id)
+    if admins:
+        admin_list = "\n".join(admins)
+        report_msg = (
+            f"🚨 **Report**\n"
+            f"👤 Reporter: {message.from_user.mention}\n"
+            f"⚠️ Reported message: [Link]({message.reply_to_message.link})\n"
+            f"🛡 Admins notified:\n{admin_list}"
+        )
+        await reply(message, report_msg)
+    else:
+        await reply(message, "ℹ️ No admins available to notify.")
+
+@command("staff")
+async def show_staff(client, message: Message):
+    admins = await get_staff_mentions(client, message.chat.id)
+    if admins:
+        await reply(message, "👮 **Group Admins:**\n" + "\n".join(admins))
+    else:
+        await reply(message, "ℹ️ No admins found.")
+
+@app.on_chat_member_updated(group=-1)
+async def track_admin_changes(_, update):
+    """Drop a chat's cached roster whenever someone gains or loses admin rights."""
+    old, new = update.old_chat_member, update.new_chat_member
+    if any(member and member.status in ADMIN_STATUSES for member in (old, new)):
+        admin_cache.invalidate(update.chat.id)
+
+@app.on_message(group=-1)
+async def observe_message(_, message: Message):
+    """Index every message and feed its sender, replied-to sender and new members into the peer cache."""
+    message.content_hash = recent_messages.add(message)
+    if message.from_user:
+        peer_cache.put(message.from_user)
+    if message.reply_to_message and message.reply_to_message.from_user:
+        peer_cache.put(message.reply_to_message.from_user)
+    for user in message.new_chat_members or ():
+        peer_cache.put(user)
+
+# --- BLACKLIST ---
+
+BLACKLIST_MODES = ("delete", "warn", "mute")
+BLACKLIST_MUTE_MINUTES = 60
+
+ZERO_WIDTH_CHARS = "\u00ad\u180e\u200b\u200c\u200d\u2060\ufeff"
+HOMOGLYPHS = {
+    # Cyrillic
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h", "о": "o",
+    "р": "p", "с": "c", "т": "t", "у": "y", "х": "x", "і": "i", "ј": "j", "ѕ": "s",
+    # Greek
+    "α": "a", "β": "b", "ε": "e", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p",
+    "τ": "t", "υ": "u", "χ": "x",
+}
+_NORMALISE_TABLE = str.maketrans({**dict.fromkeys(ZERO_WIDTH_CHARS), **HOMOGLYPHS})
+
+def normalise_text(text: str) -> str:
+    """Fold case, compatibility forms, look-alike letters and zero-width characters."""
+    return unicodedata.normalize("NFKC", text).casefold().translate(_NORMALISE_TABLE)
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+class BlacklistMatcher:
+    """Aho-Corasick automaton over normalised blacklist terms.
+
+    Terms match whole words only, so "spam" leaves "antispam" alone; a leading or
+    trailing `*` lets a term match inside a word on that side ("spam*" catches
+    "spammer", "*spam*" matches anywhere). Terms are inserted into and removed
+    from the trie in place; failure links are recomputed once, lazily, before the
+    next scan after any change.
+    """
+
+    def __init__(self, terms=()):
+        self._goto = [{}]        # node -> {char: node}
+        self._term = [None]      # node -> (term, open at start, open at end, length) ending exactly there
+        self._fail = [0]
+        self._match = [None]     # nearest node with a term on the failure chain, itself included
+        self._terms = set()
+        self._orphans = 0
+        self._dirty = False
+        for term in terms:
+            self.add(term)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __iter__(self):
+        return iter(sorted(self._terms))
+
+    def add(self, term: str) -> bool:
+        term = normalise_text(term).strip()
+        core = term.strip("*")
+        if not core or term in self._terms:
+            return False
+        node = 0
+        for char in core:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._term.append(None)
+                self._fail.append(0)
+                self._match.append(None)
+            node = nxt
+        if self._term[node]:
+            # "spam" and "spam*" share a node; the newer spelling replaces the older.
+            self._terms.discard(self._term[node][0])
+        self._term[node] = (term, term[0] == "*", term[-1] == "*", len(core))
+        self._terms.add(term)
+        self._dirty = True
+        return True
+
+    def remove(self, term: str) -> bool:
+        term = normalise_text(term).strip()
+        if term not in self._terms:
+            return False
+        self._terms.remove(term)
+        core = term.strip("*")
+        path = [0]
+        for char in core:
+            path.append(self._goto[path[-1]][char])
+        self._term[path[-1]] = None
+        # Unlink the now-dead tail of the branch; its slots are reclaimed by _compact.
+        for depth in range(len(core), 0, -1):
+            node = path[depth]
+            if self._goto[node] or self._term[node]:
+                break
+            del self._goto[path[depth - 1]][core[depth - 1]]
+            self._orphans += 1
+        if self._orphans > len(self._goto) // 2:
+            self._compact()
+        self._dirty = True
+        return True
+
+    def _compact(self):
+        terms = self._terms
+        self.__init__()
+        for term in terms:
+            self.add(term)
+
+    def _link(self):
+        """Breadth-first pass that sets failure links and propagated matches."""
+        goto, fail, match, term = self._goto, self._fail, self._match, self._term
+        queue = []
+        for node in goto[0].values():
+            fail[node] = 0
+            match[node] = node if term[node] else None
+            queue.append(node)
+        for parent in queue:
+            for char, node in goto[parent].items():
+                state = fail[parent]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[node] = goto[state].get(char, 0)
+                match[node] = node if term[node] else match[fail[node]]
+                queue.append(node)
+        self._dirty = False
+
+    def search(self, text: str, normalised=False):
+        """Return the first blacklisted term found in text, or None."""
+        if self._dirty:
+            self._link()
+        if not normalised:
+            text = normalise_text(text)
+        goto, fail, match, terms = self._goto, self._fail, self._match, self._term
+        last = len(text) - 1
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            node = match[state]
+            while node is not None:
+                term, open_start, open_end, length = terms[node]
+                if (open_start or i < length or not _is_word_char(text[i - length])) and (
+                    open_end or i == last or not _is_word_char(text[i + 1])
+                ):
+                    return term
+                node = match[fail[node]]
+        return None
+
+def get_blacklist(chat_id: int) -> BlacklistMatcher:
+    """Return a chat's blacklist, seeding it from the default blacklist_words."""
+    matcher = blacklists.get(chat_id)
+    if matcher is None:
+        matcher = blacklists[chat_id] = BlacklistMatcher(blacklist_words)
+    return matcher
+
+def save_blacklist(chat_id: int, added=(), removed=()):
+    """Persist a blacklist edit; the first edit in a chat also stores its seeded defaults."""
+    if chat_id not in custom_blacklists:
+        custom_blacklists.add(chat_id)
+        store.put("settings", chat_id, "blacklist_custom", "1")
+        added = list(blacklists[chat_id])
+    for term in added:
+        store.put("blacklist", chat_id, normalise_text(term).strip())
+    for term in removed:
+        store.delete("blacklist", chat_id, normalise_text(term).strip())
+
+@command("addblacklist", admin=True)
+async def add_blacklist(client, message: Message):
+    if len(message.command) < 2:
+        await reply(
+            message,
+            "⚠️ Usage: /addblacklist <word> [\"a phrase\" ...]\n"
+            "Terms match whole words; add `*` at either end to match inside words too (`spam*`, `*spam*`)."
+        )
         return
+    matcher = get_blacklist(message.chat.id)
+    added = [term for term in message.command[1:] if matcher.add(term)]
+    save_blacklist(message.chat.id, added=added)
+    await reply(message, f"🚫 Added {len(added)} term(s) to the blacklist ({len(matcher)} total).")
+
+@command("unblacklist", admin=True)
+async def remove_blacklist(client, message: Message):
     if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /settitle <new title>")
+        await reply(message, "⚠️ Usage: /unblacklist <word> [\"a phrase\" ...]")
+        return
+    matcher = get_blacklist(message.chat.id)
+    removed = [term for term in message.command[1:] if matcher.remove(term)]
+    save_blacklist(message.chat.id, removed=removed)
+    await reply(message, f"✅ Removed {len(removed)} term(s) from the blacklist ({len(matcher)} left).")
+
+@command("blacklist")
+async def show_blacklist(_, message: Message):
+    matcher = get_blacklist(message.chat.id)
+    if not len(matcher):
+        await reply(message, "ℹ️ The blacklist is empty.")
+        return
+    terms = list(matcher)
+    shown = "\n".join(f"• `{term}`" for term in terms[:100])
+    more = f"\n…and {len(terms) - 100} more" if len(terms) > 100 else ""
+    mode = blacklist_modes.get(message.chat.id, "delete")
+    await reply(message, f"🚫 **Blacklist** (action: {mode}):\n{shown}{more}")
+
+@command("blacklistmode", admin=True)
+async def set_blacklist_mode(client, message: Message):
+    if len(message.command) < 2 or message.command[1].lower() not in BLACKLIST_MODES:
+        await reply(message, "⚠️ Usage: /blacklistmode <delete|warn|mute>")
+        return
+    blacklist_modes[message.chat.id] = message.command[1].lower()
+    store.put("settings", message.chat.id, "blacklist_mode", message.command[1].lower())
+    await reply(message, f"✅ Blacklisted messages will now be handled with: {message.command[1].lower()}")
+
+@app.on_message(filters.group & (filters.text | filters.caption), group=1)
+async def scan_blacklist(client, message: Message):
+    text = message.text or message.caption
+    if not message.from_user or text.startswith("/"):
+        return
+    chat_id = message.chat.id
+    term = get_blacklist(chat_id).search(text)
+    if term is None or await is_admin(client, chat_id, message.from_user.id):
+        return
+    await punish(client, message, blacklist_modes.get(chat_id, "delete"), "blacklisted word", BLACKLIST_MUTE_MINUTES)
+
+async def punish(client, message: Message, action: str, reason: str, mute_minutes: int):
+    """Delete an offending message, then warn or mute its sender if `action` asks for it."""
+    chat_id = message.chat.id
+    try:
+        await delete(message)
+    except Exception:
+        pass
+    if action == "warn":
+        await reply(
+            message, await add_warning(client, chat_id, message.from_user, reason=reason),
+            quote=False, priority=PRIORITY_MODERATION
+        )
+    elif action == "mute":
+        try:
+            await client.restrict_chat_member(
+                chat_id,
+                message.from_user.id,
+                MUTED_PERMISSIONS,
+                until_date=datetime.now() + timedelta(minutes=mute_minutes)
+            )
+            # Replaces any earlier unmute, which would otherwise end this mute early.
+            scheduler.schedule(mute_minutes * 60, "unmute", chat_id, message.from_user.id, keyed=True)
+            audit.record(chat_id, "mute", client.me.id if client.me else 0, message.from_user.id, mute_minutes * 60)
+            await reply(
+                message,
+                f"🔇 Muted {user_mention(message.from_user)} for {mute_minutes} minutes ({reason}).",
+                quote=False, priority=PRIORITY_MODERATION
+            )
+        except Exception as e:
+            await reply(message, f"❌ Mute failed: {str(e)}", quote=False, priority=PRIORITY_MODERATION)
+
+# --- LINK SPAM ---
+
+LINK_MODES = ("off", "on", "strict")
+LINK_ACTIONS = ("delete", "warn", "mute")
+
+# Scheme-less "example.com/path" counts too; the TLD must be letters so "3.14" and "v1.2" do not.
+URL_RE = re.compile(
+    r"(?:\b[a-z][a-z0-9+.-]*://)?(?<![\w@.-])((?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,24})\b(/\S*)?"
+)
+INVITE_RE = re.compile(r"^(?:joinchat/|\+)[\w-]+|^[a-z]\w{3,31}\b")
+TELEGRAM_DOMAINS = frozenset(("t.me", "telegram.me", "telegram.dog"))
+
+class LinkClassifier:
+    """Staged link and forward spam check; cheap stages first, first hit wins.
+
+    1. Forwards from channels the chat has not allow-listed.
+    2. Messages with no '.' (so no URL) and no link entities stop here.
+    3. URL extraction with one precompiled pattern over the dotted words, plus
+       hidden text-link targets.
+    4. Domain checks against the chat's deny and allow sets, each one hash lookup
+       per domain and parent domain; Telegram invites and links to other chats.
+    5. The same link message from several senders within LINK_REPEAT_WINDOW,
+       using the recent-message index's content hashes.
+
+    classify() is synchronous and takes no locks, so it is benchmarked directly.
+    """
+
+    @staticmethod
+    def domains(domain: str):
+        """'a.b.example.com' -> 'a.b.example.com', 'b.example.com', 'example.com'."""
+        parts = domain.split(".")
+        return (".".join(parts[i:]) for i in range(len(parts) - 1))
+
+    def _listed(self, domain: str, listed: frozenset) -> bool:
+        return bool(listed) and any(candidate in listed for candidate in self.domains(domain))
+
+    def extract(self, message: Message) -> list:
+        """Return (domain, path) pairs for every link in the message text, caption and text-link entities."""
+        text = message.text or message.caption or ""
+        links = []
+        if "." in text:
+            # Matching only the dotted words is several times faster than running the pattern over the whole text.
+            for word in text.lower().split():
+                if "." in word:
+                    links.extend(URL_RE.findall(word))
+        for entity in message.entities or message.caption_entities or ():
+            if entity.url:
+                links.extend(URL_RE.findall(entity.url.lower()))
+        return links
+
+    def classify(self, message: Message, settings: ChatSettings):
+        """Return the reason a message is link spam, or None."""
+        mode = settings.link_mode
+        if mode == "off":
+            return None
+        forwarded = message.forward_from_chat
+        if forwarded and forwarded.type == enums.ChatType.CHANNEL:
+            handle = (forwarded.username or "").lower()
+            if not handle or f"t.me/{handle}" not in settings.link_allow:
+                return "forwarded channel post"
+        links = self.extract(message)
+        if not links:
+            return None
+        own = (message.chat.username or "").lower()
+        for domain, path in links:
+            if self._listed(domain, settings.link_deny):
+                return f"blocked domain {domain}"
+            if domain in TELEGRAM_DOMAINS:
+                target = path[1:]
+                if INVITE_RE.match(target) and target.split("/", 1)[0] != own:
+                    if f"t.me/{target.split('/', 1)[0]}" not in settings.link_allow:
+                        return "Telegram invite"
+                continue
+            if mode == "strict" and not self._listed(domain, settings.link_allow):
+                return f"unapproved domain {domain}"
+        content = getattr(message, "content_hash", 0)
+        if content and message.from_user:
+            senders = recent_messages.senders(message.chat.id, content, LINK_REPEAT_WINDOW, LINK_REPEAT_LIMIT)
+            if len(senders) >= LINK_REPEAT_LIMIT:
+                return "repeated link spam"
+        return None
+
+link_classifier = LinkClassifier()
+
+@app.on_message(filters.group, group=2)
+async def scan_links(client, message: Message):
+    if not message.from_user or message.service:
+        return
+    settings = await chat_settings.get(message.chat.id)
+    reason = link_classifier.classify(message, settings)
+    if reason is None or await is_admin(client, message.chat.id, message.from_user.id):
+        return
+    await punish(client, message, settings.link_action, reason, LINK_MUTE_MINUTES)
+
+def normalise_domain(text: str):
+    """'https://www.Example.com/x' -> 'example.com'; '@channel' or 't.me/channel' -> 't.me/channel'."""
+    text = text.strip().lower()
+    if text.startswith("@"):
+        return f"t.me/{text[1:]}" if re.fullmatch(r"@[a-z]\w{3,31}", text) else None
+    found = URL_RE.search(text)
+    if not found:
+        return None
+    domain, path = found.groups()
+    if domain.startswith("www."):
+        domain = domain[4:]
+    if domain in TELEGRAM_DOMAINS and path and INVITE_RE.match(path[1:]):
+        return f"t.me/{path[1:].split('/', 1)[0]}"
+    return domain
+
+@command("antilink", admin=True)
+async def antilink(client, message: Message):
+    args = [arg.lower() for arg in message.command[1:]]
+    chat_id = message.chat.id
+    if not args:
+        settings = await chat_settings.get(chat_id)
+        await reply(
+            message,
+            f"🔗 **Anti-link:** {settings.link_mode} (action: {settings.link_action})\n"
+            f"✅ Allowed: {', '.join(sorted(settings.link_allow)) or 'none'}\n"
+            f"⛔️ Blocked: {', '.join(sorted(settings.link_deny)) or 'none'}",
+            disable_web_page_preview=True
+        )
+        return
+    if args[0] not in LINK_MODES or (len(args) > 1 and args[1] not in LINK_ACTIONS):
+        await reply(message, "⚠️ Usage: /antilink [off|on|strict] [delete|warn|mute]")
+        return
+    await chat_settings.set(chat_id, "link_mode", args[0])
+    if len(args) > 1:
+        await chat_settings.set(chat_id, "link_action", args[1])
+    settings = await chat_settings.get(chat_id)
+    await reply(message, f"✅ Anti-link is now {settings.link_mode} (action: {settings.link_action}).")
+
+@command("allowlink", "denylink", "unlistlink", admin=True)
+async def edit_link_lists(client, message: Message):
+    domains = [normalise_domain(arg) for arg in message.command[1:]]
+    if not domains or None in domains:
+        await reply(message, f"⚠️ Usage: /{message.command[0]} <domain or @channel> …")
+        return
+    chat_id = message.chat.id
+    settings = await chat_settings.get(chat_id)
+    added = frozenset(domains)
+    allow, deny = settings.link_allow - added, settings.link_deny - added
+    if message.command[0] == "allowlink":
+        allow |= added
+    elif message.command[0] == "denylink":
+        deny |= added
+    await chat_settings.set_domains(chat_id, "link_allow", allow)
+    await chat_settings.set_domains(chat_id, "link_deny", deny)
+    verb = {"allowlink": "Allowed", "denylink": "Blocked", "unlistlink": "Unlisted"}[message.command[0]]
+    await reply(message, f"✅ {verb}: {', '.join(sorted(added))}", disable_web_page_preview=True)
+
+# --- KEYWORD FILTERS ---
+
+FILTER_REGEX_PREFIX = "re:"
+GLOBAL_FLAGS_RE = re.compile(r"\(\?[aiLmsux]+\)")
+WORD_RE = re.compile(r"\w+")
+
+class ChatFilters:
+    """A chat's auto-reply triggers.
+
+    Word and phrase triggers are indexed by their first word, so a message costs
+    one dict lookup per word. Regex triggers (and phrases with punctuation) share
+    one precompiled alternation that is rebuilt only when the filter set changes;
+    patterns with their own groups or global inline flags can't be spliced into it
+    safely (backreferences would be renumbered, flags would leak) and are compiled
+    on their own instead.
+    """
+
+    def __init__(self):
+        self.words = {}      # first casefolded word -> [(words, trigger, reply)]
+        self.patterns = {}   # trigger -> (pattern, reply)
+        self.hits = Counter()
+        self._regex = None
+        self._groups = []    # alternation group name -> index into this list
+        self._separate = []  # [(trigger, compiled)] for patterns kept out of the alternation
+
+    def __len__(self):
+        return sum(map(len, self.words.values())) + len(self.patterns)
+
+    def triggers(self):
+        return sorted([entry[1] for entries in self.words.values() for entry in entries] + list(self.patterns))
+
+    def add(self, trigger: str, reply: str):
+        """Add or replace a trigger. Raises re.error for an invalid regex trigger."""
+        self.remove(trigger)
+        if trigger.startswith(FILTER_REGEX_PREFIX):
+            pattern = trigger[len(FILTER_REGEX_PREFIX):]
+            re.compile(pattern, re.IGNORECASE)
+        else:
+            words = tuple(WORD_RE.findall(trigger.casefold()))
+            if words and " ".join(words) == trigger.casefold():
+                self.words.setdefault(words[0], []).append((words, trigger, reply))
+                return
+            pattern = r"(?<!\w)" + re.escape(trigger) + r"(?!\w)"
+        self.patterns[trigger] = (pattern, reply)
+        self._compile()
+
+    def remove(self, trigger: str) -> bool:
+        if trigger in self.patterns:
+            del self.patterns[trigger]
+            self._compile()
+        else:
+            words = tuple(WORD_RE.findall(trigger.casefold()))
+            entries = self.words.get(words[0], []) if words else []
+            kept = [entry for entry in entries if entry[1] != trigger]
+            if len(kept) == len(entries):
+                return False
+            if kept:
+                self.words[words[0]] = kept
+            else:
+                del self.words[words[0]]
+        self.hits.pop(trigger, None)
+        return True
+
+    def _compile(self):
+        self._groups, self._separate = [], []
+        for trigger, (pattern, _) in self.patterns.items():
+            compiled = re.compile(pattern, re.IGNORECASE)
+            if compiled.groups or GLOBAL_FLAGS_RE.match(pattern):
+                self._separate.append((trigger, compiled))
+            else:
+                self._groups.append(trigger)
+        if not self._groups:
+            self._regex = None
+            return
+        self._regex = re.compile(
+            "|".join(f"(?P<f{i}>{self.patterns[trigger][0]})" for i, trigger in enumerate(self._groups)),
+            re.IGNORECASE
+        )
+
+    def match(self, text: str):
+        """Return (trigger, reply) for the first filter that fires on text, or None."""
+        if self.words:
+            tokens = WORD_RE.findall(text.casefold())
+            for i, token in enumerate(tokens):
+                entries = self.words.get(token)
+                if entries:
+                    for words, trigger, reply in entries:
+                        if len(words) == 1 or tuple(tokens[i:i + len(words)]) == words:
+                            self.hits[trigger] += 1
+                            return trigger, reply
+        best, first = None, len(text) + 1
+        if self._regex:
+            found = self._regex.search(text)
+            if found:
+                best, first = self._groups[int(found.lastgroup[1:])], found.start()
+        for trigger, compiled in self._separate:
+            found = compiled.search(text)
+            if found and found.start() < first:
+                best, first = trigger, found.start()
+        if best is None:
+            return None
+        self.hits[best] += 1
+        return best, self.patterns[best][1]
+
+@command("filter", admin=True)
+async def add_filter(client, message: Message):
+    if len(message.command) < 3:
+        await reply(
+            message,
+            "⚠️ Usage: /filter <trigger> <reply>\n"
+            "Quote multi-word triggers, prefix regex triggers with `re:`."
+        )
         return
-    title = " ".join(message.command[1:])
+    trigger = message.command[1]
+    response = " ".join(message.command[2:])
+    chat_filters = filters_dict.setdefault(message.chat.id, ChatFilters())
     try:
-        await client.set_chat_title(message.chat.id, title)
-        await message.reply(f"✅ Title updated to: {title}")
-    except Exception as e:
-        await message.reply(f"❌ Title change failed: {str(e)}")
+        chat_filters.add(trigger, response)
+    except re.error as e:
+        await reply(message, f"❌ Invalid regex: {str(e)}")
+        return
+    store.put("filters", message.chat.id, trigger, response)
+    await reply(message, f"✅ Filter `{trigger}` saved!")
 
-@app.on_message(filters.command("setphoto") & filters.group)
-async def set_photo(client, message: Message):
-    if not await check_admin_and_reply(client, message):
+@command("stop", admin=True)
+async def stop_filter(client, message: Message):
+    if len(message.command) < 2:
+        await reply(message, "⚠️ Usage: /stop <trigger>")
         return
-    if not message.reply_to_message or not message.reply_to_message.photo:
-        await message.reply("⚠️ Reply to a photo to set as group photo.")
+    trigger = message.command[1]
+    chat_filters = filters_dict.get(message.chat.id)
+    if chat_filters and chat_filters.remove(trigger):
+        store.delete("filters", message.chat.id, trigger)
+        await reply(message, f"🛑 Filter `{trigger}` removed.")
+    else:
+        await reply(message, f"⚠️ Filter `{trigger}` not found.")
+
+@command("filters")
+async def list_filters(_, message: Message):
+    chat_filters = filters_dict.get(message.chat.id)
+    if not chat_filters:
+        await reply(message, "ℹ️ No filters in this chat.")
         return
-    try:
-        photo = await client.download_media(message.reply_to_message.photo.file_id)
-        await client.set_chat_photo(message.chat.id, photo)
-        await message.reply("✅ Group photo updated!")
-    except Exception as e:
-        await message.reply(f"❌ Failed to set photo: {str(e)}")
+    lines = [f"• `{trigger}` ({chat_filters.hits[trigger]} hits)" for trigger in chat_filters.triggers()]
+    shown = "\n".join(lines[:100])
+    more = f"\n…and {len(lines) - 100} more" if len(lines) > 100 else ""
+    await reply(message, f"🔎 **Filters** ({len(lines)}):\n{shown}{more}")
 
-@app.on_message(filters.command("setdescription") & filters.group)
-async def set_description(client, message: Message):
-    if not await check_admin_and_reply(client, message):
+@app.on_message(filters.group & (filters.text | filters.caption), group=3)
+async def run_filters(_, message: Message):
+    chat_filters = filters_dict.get(message.chat.id)
+    if not chat_filters:
         return
-    if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /setdescription <text>")
+    text = message.text or message.caption
+    if text.startswith("/"):
         return
-    desc = " ".join(message.command[1:])
-    try:
-        await client.set_chat_description(message.chat.id, desc)
-        await message.reply("✅ Group description updated!")
-    except Exception as e:
-        await message.reply(f"❌ Failed to set description: {str(e)}")
+    hit = chat_filters.match(text)
+    if hit:
+        await reply(message, hit[1])
 
-@app.on_message(filters.command("promote") & filters.group)
-async def promote_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
+# --- ANTI-FLOOD ---
+
+class FloodTracker:
+    """Sliding-window message counter per (chat, user), stored in flat arrays.
+
+    Each tracked pair owns a slot holding a ring of its last FLOOD_MAX_LIMIT
+    message timestamps. A user floods when the message `limit` messages before
+    the current one is less than `window` seconds old, i.e. when more than
+    `limit` messages fall inside the window; that is one array read per message.
+    Slots are recycled LRU-first, and pairs idle for FLOOD_IDLE_TTL are freed
+    as new messages arrive, so memory is fixed at FLOOD_MAX_TRACKED slots.
+    """
+
+    def __init__(self, capacity=FLOOD_MAX_TRACKED, ring=FLOOD_MAX_LIMIT):
+        self.capacity = capacity
+        self.ring = ring
+        self._times = array("d", bytes(8 * capacity * ring))
+        self._heads = array("H", bytes(2 * capacity))
+        self._last = array("d", bytes(8 * capacity))
+        self._slots = OrderedDict()  # (chat_id, user_id) -> slot, least recently active first
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _evict_idle(self, now: float):
+        slots = self._slots
+        while slots:
+            key, slot = next(iter(slots.items()))
+            if now - self._last[slot] < FLOOD_IDLE_TTL:
+                break
+            del slots[key]
+            self._free.append(slot)
+
+    def _slot(self, key, now: float) -> int:
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._slots.move_to_end(key)
+            return slot
+        self._evict_idle(now)
+        if self._free:
+            slot = self._free.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+        base = slot * self.ring
+        self._times[base:base + self.ring] = array("d", bytes(8 * self.ring))
+        self._heads[slot] = 0
+        self._slots[key] = slot
+        return slot
+
+    def hit(self, chat_id: int, user_id: int, limit: int, window: float, now=None) -> bool:
+        """Record a message and return True if more than `limit` fall within `window` seconds."""
+        now = time.monotonic() if now is None else now
+        slot = self._slot((chat_id, user_id), now)
+        base = slot * self.ring
+        head = self._heads[slot]
+        oldest = self._times[base + (head - limit) % self.ring]
+        self._times[base + head] = now
+        self._heads[slot] = (head + 1) % self.ring
+        self._last[slot] = now
+        return oldest > 0 and now - oldest < window
+
+    def reset(self, chat_id: int, user_id: int):
+        slot = self._slots.pop((chat_id, user_id), None)
+        if slot is not None:
+            self._free.append(slot)
+
+flood_tracker = FloodTracker()
+
+@app.on_message(filters.group, group=4)
+async def check_flood(client, message: Message):
+    if message.service or not message.from_user:
         return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
+    chat_id, user_id = message.chat.id, message.from_user.id
+    if DUPLICATE_LIMIT and getattr(message, "content_hash", 0):
+        repeats = recent_messages.duplicates(
+            chat_id, user_id, message.content_hash, DUPLICATE_WINDOW, minimum=DUPLICATE_LIMIT + 1
+        )
+        if len(repeats) > DUPLICATE_LIMIT and not await is_admin(client, chat_id, user_id):
+            # Keep the first DUPLICATE_LIMIT copies; every copy past that is removed.
+            extra = repeats[:len(repeats) - DUPLICATE_LIMIT]
+            recent_messages.forget(chat_id, extra)
+            try:
+                await outbound.submit(
+                    chat_id, lambda: client.delete_messages(chat_id, extra), PRIORITY_MODERATION, chat_limited=False
+                )
+            except Exception:
+                pass
+            return
+    settings = await chat_settings.get(chat_id)
+    if not settings.flood_limit:
+        return
+    if not flood_tracker.hit(chat_id, user_id, settings.flood_limit, settings.flood_window):
+        return
+    flood_tracker.reset(chat_id, user_id)
+    if await is_admin(client, chat_id, user_id):
         return
     try:
-        await client.promote_chat_member(
-            message.chat.id,
-            target.id,
-            privileges=ChatPrivileges(
-                can_manage_chat=True,
-                can_delete_messages=True,
-                can_manage_video_chats=True,
-                can_restrict_members=True,
-                can_promote_members=False,
-                can_change_info=True,
-                can_post_messages=True,
-                can_edit_messages=True,
-                can_invite_users=True,
-                can_pin_messages=True,
-                can_manage_topics=True
-            )
+        await client.restrict_chat_member(
+            chat_id,
+            user_id,
+            MUTED_PERMISSIONS,
+            until_date=datetime.now() + timedelta(minutes=settings.flood_mute)
+        )
+        scheduler.schedule(settings.flood_mute * 60, "unmute", chat_id, user_id, keyed=True)
+        audit.record(chat_id, "mute", client.me.id if client.me else 0, user_id, settings.flood_mute * 60)
+        await reply(
+            message,
+            f"🌊 Muted {user_mention(message.from_user)} for {settings.flood_mute} minutes for flooding.",
+            quote=False,
+            priority=PRIORITY_MODERATION,
+            disable_web_page_preview=True
         )
-        await message.reply(f"👑 Promoted {user_mention(target)} to admin!")
     except Exception as e:
-        await message.reply(f"❌ Promote failed: {str(e)}")
+        await reply(message, f"❌ Flood mute failed: {str(e)}", quote=False, priority=PRIORITY_MODERATION)
 
-@app.on_message(filters.command("demote") & filters.group)
-async def demote_user(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    target = await resolve_user(client, message)
-    if not target:
-        await message.reply("⚠️ Reply to a user, or provide a valid username/ID.")
+@command("setflood", admin=True)
+async def set_flood(client, message: Message):
+    args = message.command[1:]
+    if args and args[0].lower() == "off":
+        await chat_settings.set(message.chat.id, "flood_limit", 0)
+        await reply(message, "✅ Anti-flood disabled.")
         return
     try:
-        await client.promote_chat_member(
-            message.chat.id,
-            target.id,
-            privileges=ChatPrivileges()
+        limit = int(args[0])
+        window = float(args[1]) if len(args) > 1 else FLOOD_WINDOW
+        mute = int(args[2]) if len(args) > 2 else FLOOD_MUTE_MINUTES
+    except (IndexError, ValueError):
+        limit = 0
+    if not 2 <= limit <= FLOOD_MAX_LIMIT or window <= 0 or mute <= 0:
+        await reply(
+            message,
+            f"⚠️ Usage: /setflood <messages 2-{FLOOD_MAX_LIMIT}> [seconds] [mute minutes] or /setflood off"
         )
-        await message.reply(f"👑 Demoted {user_mention(target)} from admin!")
-    except Exception as e:
-        await message.reply(f"❌ Demote failed: {str(e)}")
+        return
+    chat_id = message.chat.id
+    await chat_settings.set(chat_id, "flood_limit", limit)
+    await chat_settings.set(chat_id, "flood_window", window)
+    await chat_settings.set(chat_id, "flood_mute", mute)
+    await reply(message, f"✅ {limit} messages within {window:g}s now mutes for {mute} minutes.")
 
-# --- GROUP FEATURES ---
+# --- UTILITIES ---
 
-@app.on_message(filters.command("setrules") & filters.group)
-async def set_rules(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /setrules <text>")
-        return
-    global rules_text
-    rules_text = " ".join(message.command[1:])
-    await message.reply("✅ Rules updated!")
+class TranslationBackend:
+    """A translation provider. translate() blocks and is only called from worker threads."""
 
-@app.on_message(filters.command("rules") & filters.group)
-async def show_rules(_, message: Message):
-    await message.reply(rules_text)
+    def translate(self, text: str, dest: str) -> str:
+        raise NotImplementedError
 
-@app.on_message(filters.command("setwelcome") & filters.group)
-async def set_welcome(client, message: Message):
-    if not await check_admin_and_reply(client, message):
-        return
-    if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /setwelcome <message>\nUse {mention} and {title} as placeholders.")
-        return
-    global welcome_message
-    welcome_message = " ".join(message.command[1:])
-    await message.reply("✅ Welcome message updated!")
+    def languages(self) -> set:
+        raise NotImplementedError
 
-@app.on_message(filters.command("welcome") & filters.group)
-async def show_welcome(_, message: Message):
-    await message.reply(welcome_message.replace("{mention}", "USER").replace("{title}", message.chat.title))
+class GoogleTranslateBackend(TranslationBackend):
+    """googletrans with one Translator (and HTTP session) kept for the life of the bot.
 
-@app.on_message(filters.new_chat_members & filters.group)
-async def welcome_new_member(client, message: Message):
-    for user in message.new_chat_members:
-        welcome_text = welcome_message.replace("{mention}", user.mention).replace("{title}", message.chat.title)
-        await message.reply(welcome_text)
+    googletrans and its HTTP stack are imported on first use, so bots that never
+    see /translate never pay for them at startup.
+    """
 
-@app.on_message(filters.command("report") & filters.group)
-async def report_user(client, message: Message):
-    if not message.reply_to_message:
-        await message.reply("⚠️ Reply to a message to report.")
-        return
-    admins = []
-    async for member in client.get_chat_members(message.chat.id, filter=enums.ChatMembersFilter.ADMINISTRATORS):
-        if not member.user.is_bot and member.status in (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER):
-            admins.append(member.user.mention)
-    if admins:
-        admin_list = "\n".join(admins)
-        report_msg = (
-            f"🚨 **Report**\n"
-            f"👤 Reporter: {message.from_user.mention}\n"
-            f"⚠️ Reported message: [Link]({message.reply_to_message.link})\n"
-            f"🛡 Admins notified:\n{admin_list}"
-        )
-        await message.reply(report_msg)
-    else:
-        await message.reply("ℹ️ No admins available to notify.")
+    def __init__(self):
+        self._translator = None
 
-@app.on_message(filters.command("staff") & filters.group)
-async def show_staff(client, message: Message):
-    admins = []
-    async for member in client.get_chat_members(message.chat.id, filter=enums.ChatMembersFilter.ADMINISTRATORS):
-        if not member.user.is_bot and member.status in (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER):
-            admins.append(member.user.mention)
-    if admins:
-        await message.reply("👮 **Group Admins:**\n" + "\n".join(admins))
-    else:
-        await message.reply("ℹ️ No admins found.")
+    def translate(self, text: str, dest: str) -> str:
+        if self._translator is None:
+            from googletrans import Translator
+            self._translator = Translator()
+        return self._translator.translate(text, dest=dest).text
 
-# --- UTILITIES ---
+    def languages(self) -> set:
+        from googletrans import LANGUAGES
+        return set(LANGUAGES)
+
+class FakeTranslationBackend(TranslationBackend):
+    """Offline backend for benchmarks: tags the text after sleeping for `latency` seconds."""
+
+    def __init__(self, latency=0.05, languages=("en", "de", "es", "fr", "ru")):
+        self.latency = latency
+        self.calls = 0
+        self._languages = set(languages)
+
+    def translate(self, text: str, dest: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"[{dest}] {text}"
+
+    def languages(self) -> set:
+        return self._languages
+
+class TranslationService:
+    """Runs a backend in a bounded thread pool with an LRU result cache.
+
+    Identical requests that arrive while one is in flight share its result
+    instead of calling the backend again.
+    """
+
+    def __init__(self, backend: TranslationBackend, workers=TRANSLATE_WORKERS, cache_size=TRANSLATE_CACHE_SIZE):
+        self.backend = backend
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate")
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._languages = None
+        self.hits = 0
+        self.misses = 0
+
+    async def languages(self) -> set:
+        if self._languages is None:
+            # The first call may import the backend's library; keep that off the event loop.
+            loop = asyncio.get_running_loop()
+            self._languages = await loop.run_in_executor(self._executor, self.backend.languages)
+        return self._languages
+
+    async def translate(self, text: str, dest=TRANSLATE_DEFAULT_LANG) -> str:
+        key = (text, dest)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.get_running_loop().run_in_executor(self._executor, self.backend.translate, text, dest)
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._settle(key, done))
+        return await asyncio.shield(future)
 
-@app.on_message(filters.command("translate") & filters.group)
+    def _settle(self, key, future):
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._cache[key] = future.result()
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+translation_service = TranslationService(GoogleTranslateBackend())
+
+@command("translate")
 async def translate_text(_, message: Message):
-    if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /translate <text>")
+    args = message.command[1:]
+    source = None
+    if message.reply_to_message:
+        source = message.reply_to_message.text or message.reply_to_message.caption
+    dest = TRANSLATE_DEFAULT_LANG
+    if args and args[0].lower() in await translation_service.languages() and (source or len(args) > 1):
+        dest = args.pop(0).lower()
+    if not source:
+        source = " ".join(args)
+    if not source:
+        await reply(message, "⚠️ Usage: /translate [lang] <text>, or reply to a message with /translate [lang]")
         return
-    text = " ".join(message.command[1:])
-    translator = Translator()
     try:
-        translated = translator.translate(text, dest='en')
-        await message.reply(f"🌐 Translation: {translated.text}")
+        translated = await translation_service.translate(source, dest)
+        await reply(message, f"🌐 Translation ({dest}): {translated}")
     except Exception as e:
-        await message.reply(f"❌ Translation failed: {str(e)}")
+        await reply(message, f"❌ Translation failed: {str(e)}")
+
+class ChatNotes:
+    """One chat's note names, sorted for prefix lookup. Bodies stay in the store."""
+
+    __slots__ = ("names",)
+
+    def __init__(self):
+        self.names = []  # lowercase names, sorted
+
+    def add(self, name: str):
+        position = bisect_left(self.names, name)
+        if position == len(self.names) or self.names[position] != name:
+            self.names.insert(position, name)
+
+    def remove(self, name: str) -> bool:
+        position = bisect_left(self.names, name)
+        if position < len(self.names) and self.names[position] == name:
+            del self.names[position]
+            return True
+        return False
+
+    def __contains__(self, name: str) -> bool:
+        position = bisect_left(self.names, name)
+        return position < len(self.names) and self.names[position] == name
+
+    def with_prefix(self, prefix: str) -> list:
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + "\U0010ffff", start)
+        return self.names[start:end]
+
+    def suggestions(self, name: str) -> list:
+        # In large chats only names sharing the first letter are compared; difflib is quadratic per pair.
+        pool = self.with_prefix(name[:1]) if len(self.names) > NOTE_FUZZY_SCAN else self.names
+        return difflib.get_close_matches(name, pool, n=3, cutoff=0.6)
+
+class NoteIndex:
+    """Note names per chat in memory, note bodies read from the store on demand through a small LRU."""
+
+    def __init__(self, cache_size=NOTE_BODY_CACHE):
+        self.cache_size = cache_size
+        self._chats = {}              # chat_id -> ChatNotes
+        self._bodies = OrderedDict()  # (chat_id, name) -> text
+
+    def chat(self, chat_id: int) -> ChatNotes:
+        """The chat's notes; read-only, and shared and empty for chats without any."""
+        return self._chats.get(chat_id) or NO_NOTES
+
+    def add(self, chat_id: int, name: str):
+        self._chats.setdefault(chat_id, ChatNotes()).add(name)
+
+    def _remember(self, key, text: str):
+        self._bodies[key] = text
+        self._bodies.move_to_end(key)
+        while len(self._bodies) > self.cache_size:
+            self._bodies.popitem(last=False)
+
+    def save(self, chat_id: int, name: str, text: str):
+        self.add(chat_id, name)
+        self._remember((chat_id, name), text)
+        store.put("notes", chat_id, name, text)
 
-@app.on_message(filters.command("setnote") & filters.group)
+    def remove(self, chat_id: int, name: str) -> bool:
+        notes_here = self._chats.get(chat_id)
+        if not notes_here or not notes_here.remove(name):
+            return False
+        self._bodies.pop((chat_id, name), None)
+        store.delete("notes", chat_id, name)
+        return True
+
+    async def body(self, chat_id: int, name: str):
+        key = (chat_id, name)
+        text = self._bodies.get(key)
+        if text is None and name in self.chat(chat_id):
+            text = await store.fetch_note(chat_id, name)
+            if text is not None:
+                self._remember(key, text)
+        elif text is not None:
+            self._bodies.move_to_end(key)
+        return text
+
+NO_NOTES = ChatNotes()
+note_index = NoteIndex()
+HASHTAG_RE = re.compile(r"(?<!\w)#(\w+)")
+
+@command("setnote")
 async def set_note(client, message: Message):
     if len(message.command) < 3:
-        await message.reply("⚠️ Usage: /setnote <name> <text>")
+        await reply(message, "⚠️ Usage: /setnote <name> <text>")
         return
-    name = message.command[1]
+    name = message.command[1].lower()
     text = " ".join(message.command[2:])
-    chat_id = message.chat.id
-    notes.setdefault(chat_id, {})
-    notes[chat_id][name] = text
-    await message.reply(f"📝 Note `{name}` saved!")
+    note_index.save(message.chat.id, name, text)
+    await reply(message, f"📝 Note `{name}` saved! Get it with /getnote {name} or #{name}")
 
-@app.on_message(filters.command("getnote") & filters.group)
+@command("getnote")
 async def get_note(_, message: Message):
     if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /getnote <name>")
+        await reply(message, "⚠️ Usage: /getnote <name>")
         return
-    name = message.command[1]
+    name = message.command[1].lower()
     chat_id = message.chat.id
-    if chat_id in notes and name in notes[chat_id]:
-        await message.reply(notes[chat_id][name])
+    chat_notes = note_index.chat(chat_id)
+    if name not in chat_notes:
+        matches = chat_notes.with_prefix(name)
+        if len(matches) != 1:
+            if matches:
+                listed = ", ".join(f"`{match}`" for match in matches[:NOTES_PAGE_SIZE])
+                more = f" and {len(matches) - NOTES_PAGE_SIZE} more" if len(matches) > NOTES_PAGE_SIZE else ""
+                await reply(message, f"🔎 Notes starting with `{name}`: {listed}{more}")
+            else:
+                suggestions = chat_notes.suggestions(name)
+                hint = f" Did you mean {', '.join(f'`{s}`' for s in suggestions)}?" if suggestions else ""
+                await reply(message, f"⚠️ Note `{name}` not found.{hint}")
+            return
+        name = matches[0]
+    text = await note_index.body(chat_id, name)
+    if text is None:
+        await reply(message, f"⚠️ Note `{name}` not found.")
+        return
+    await reply(message, text)
+
+@command("clearnote", admin=True)
+async def clear_note(_, message: Message):
+    if len(message.command) < 2:
+        await reply(message, "⚠️ Usage: /clearnote <name>")
+        return
+    name = message.command[1].lower()
+    if note_index.remove(message.chat.id, name):
+        await reply(message, f"🗑 Note `{name}` deleted.")
     else:
-        await message.reply(f"⚠️ Note `{name}` not found.")
+        await reply(message, f"⚠️ Note `{name}` not found.")
+
+@command("notes")
+async def list_notes(_, message: Message):
+    args = message.command[1:]
+    page = int(args.pop()) if args and args[-1].isdigit() else 1
+    prefix = args[0].lower() if args else ""
+    chat_notes = note_index.chat(message.chat.id)
+    names = chat_notes.with_prefix(prefix) if prefix else chat_notes.names
+    if not names:
+        await reply(message, f"ℹ️ No notes{f' starting with `{prefix}`' if prefix else ''} in this chat.")
+        return
+    pages = (len(names) + NOTES_PAGE_SIZE - 1) // NOTES_PAGE_SIZE
+    page = min(max(page, 1), pages)
+    shown = names[(page - 1) * NOTES_PAGE_SIZE:page * NOTES_PAGE_SIZE]
+    text = f"📝 **Notes** ({len(names)}, page {page}/{pages}):\n" + "\n".join(f"• #{name}" for name in shown)
+    if page < pages:
+        text += f"\n\nNext: /notes {f'{prefix} ' if prefix else ''}{page + 1}"
+    await reply(message, text)
+
+@app.on_message(filters.group & (filters.text | filters.caption), group=5)
+async def note_hashtags(_, message: Message):
+    """Answer '#name' in an ordinary message with the note of that name."""
+    text = message.text or message.caption
+    if "#" not in text:
+        return
+    chat_notes = note_index.chat(message.chat.id)
+    if not chat_notes.names:
+        return
+    for match in HASHTAG_RE.finditer(text):
+        name = match.group(1).lower()
+        if name in chat_notes:
+            body = await note_index.body(message.chat.id, name)
+            if body is not None:
+                await reply(message, body)
+            return
 
-@app.on_message(filters.command("id"))
+@command("id", chat=CHAT_ANY)
 async def user_id(_, message: Message):
     if message.chat.type == enums.ChatType.PRIVATE:
-        await message.reply(f"🆔 Your ID: `{message.from_user.id}`")
+        await reply(message, f"🆔 Your ID: `{message.from_user.id}`")
     elif message.reply_to_message:
         user = message.reply_to_message.from_user
-        await message.reply(f"👤 {user_mention(user)}'s ID: `{user.id}`", disable_web_page_preview=True)
+        await reply(message, f"👤 {user_mention(user)}'s ID: `{user.id}`", disable_web_page_preview=True)
     else:
-        await message.reply(f"👤 Your ID: `{message.from_user.id}`\n💬 Chat ID: `{message.chat.id}`")
+        await reply(message, f"👤 Your ID: `{message.from_user.id}`\n💬 Chat ID: `{message.chat.id}`")
 
-@app.on_message(filters.command("info") & filters.group)
+@command("info")
 async def user_info(client, message: Message):
     target = await resolve_user(client, message)
     if not target:
@@ -586,41 +3969,767 @@ async def user_info(client, message: Message):
             f"🛡 Status: {status.status.name}\n"
             f"📅 Joined: {joined_date}"
         )
-        await message.reply(info_text)
+        await reply(message, info_text)
     except Exception as e:
-        await message.reply(f"❌ Error: {str(e)}")
+        await reply(message, f"❌ Error: {str(e)}")
 
 # --- FUN COMMANDS ---
 
-@app.on_message(filters.command("slap") & filters.group)
+@command("slap")
 async def slap_user(_, message: Message):
     if message.reply_to_message and message.reply_to_message.from_user:
         target = message.reply_to_message.from_user
-        await message.reply(f"👋 {message.from_user.mention} slapped {target.mention} with a large trout! 🐟")
+        await reply(message, f"👋 {message.from_user.mention} slapped {target.mention} with a large trout! 🐟")
     else:
-        await message.reply("⚠️ Reply to a user to slap.")
+        await reply(message, "⚠️ Reply to a user to slap.")
 
-@app.on_message(filters.command("roll"))
+@command("roll", chat=CHAT_ANY)
 async def roll_dice(_, message: Message):
     import random
-    await message.reply(f"🎲 You rolled a {random.randint(1, 6)}!")
+    await reply(message, f"🎲 You rolled a {random.randint(1, 6)}!")
 
-@app.on_message(filters.command("coin"))
+@command("coin", chat=CHAT_ANY)
 async def flip_coin(_, message: Message):
     import random
     side = "Heads" if random.randint(0, 1) == 0 else "Tails"
-    await message.reply(f"🪙 Coin flip: **{side}**")
+    await reply(message, f"🪙 Coin flip: **{side}**")
 
-@app.on_message(filters.command("say") & filters.group)
+@command("say")
 async def say_command(_, message: Message):
     if len(message.command) < 2:
-        await message.reply("⚠️ Usage: /say <text>")
+        await reply(message, "⚠️ Usage: /say <text>")
         return
     text = " ".join(message.command[1:])
-    await message.reply(text)
+    await reply(message, text)
+
+# --- METRICS ---
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+API_METHODS = (
+    "send_message", "edit_message_text", "delete_messages", "get_messages", "get_chat_member",
+    "get_chat_members", "get_chat_members_count", "get_users", "ban_chat_member", "unban_chat_member",
+    "restrict_chat_member", "promote_chat_member", "pin_chat_message", "unpin_chat_message",
+    "set_chat_title", "set_chat_photo", "set_chat_description", "download_media", "stream_media",
+)
+
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if it is in the overflow bucket)."""
+        wanted = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """Handler and API counters and latency histograms, kept in plain dicts."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.handler_latency = {}
+        self.handler_errors = Counter()   # (handler, exception type) -> count
+        self.commands = Counter()
+        self.api_calls = Counter()
+        self.api_latency = {}
+        self.api_errors = Counter()       # (method, exception type) -> count
+        self.queue_latency = {}           # shedding class -> time from arrival to handling
+
+    def observe(self, histograms: dict, name: str, seconds: float):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def snapshot(self) -> dict:
+        def histograms(source):
+            return {
+                name: {"count": h.count, "total": h.total, "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+                for name, h in source.items()
+            }
+        return {
+            "uptime": time.time() - self.started,
+            "startup": {**startup.phases, "first_update": startup.first_update},
+            "handlers": histograms(self.handler_latency),
+            "handler_errors": {f"{name}:{error}": count for (name, error), count in self.handler_errors.items()},
+            "commands": dict(self.commands),
+            "api_calls": dict(self.api_calls),
+            "api_latency": histograms(self.api_latency),
+            "api_errors": {f"{name}:{error}": count for (name, error), count in self.api_errors.items()},
+            "queue_latency": histograms(self.queue_latency),
+            "executor": executor.stats(),
+        }
+
+    def render_prometheus(self) -> str:
+        lines = []
+
+        def histogram(metric, label, source, help_text):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, h in sorted(source.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {h.total}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {h.count}')
+
+        def counter(metric, labels, source, help_text):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for key, count in sorted(source.items()):
+                values = key if isinstance(key, tuple) else (key,)
+                rendered = ",".join(f'{label}="{value}"' for label, value in zip(labels, values))
+                lines.append(f"{metric}{{{rendered}}} {count}")
+
+        histogram("bot_handler_seconds", "handler", self.handler_latency, "Handler run time.")
+        counter("bot_handler_errors_total", ("handler", "error"), self.handler_errors, "Handler exceptions by type.")
+        counter("bot_commands_total", ("command",), self.commands, "Commands handled.")
+        counter("bot_api_calls_total", ("method",), self.api_calls, "Telegram API calls.")
+        histogram("bot_api_seconds", "method", self.api_latency, "Sampled Telegram API call latency.")
+        counter("bot_api_errors_total", ("method", "error"), self.api_errors, "Telegram API errors by type.")
+        histogram("bot_update_queue_seconds", "lane", self.queue_latency, "Time updates waited in their chat's queue.")
+        stats = executor.stats()
+        lines.append("# TYPE bot_update_queue_depth gauge")
+        for lane, depth in stats["depth"].items():
+            lines.append(f'bot_update_queue_depth{{lane="{lane}"}} {depth}')
+        counter("bot_updates_shed_total", ("lane",), stats["shed"], "Updates dropped from a full chat queue.")
+        lines.append("# HELP bot_chat_queue_wait_seconds Queue wait in the chats that waited longest on average.")
+        lines.append("# TYPE bot_chat_queue_wait_seconds gauge")
+        for chat_id, chat in stats["chats"].items():
+            lines.append(f'bot_chat_queue_wait_seconds{{chat="{chat_id}",stat="avg"}} {chat["avg_wait"]}')
+            lines.append(f'bot_chat_queue_wait_seconds{{chat="{chat_id}",stat="max"}} {chat["max_wait"]}')
+        stats = outbound.stats()
+        lines.append("# TYPE bot_outbound_queue_depth gauge")
+        for lane, values in stats["lanes"].items():
+            lines.append(f'bot_outbound_queue_depth{{lane="{lane}"}} {values["depth"]}')
+        lines.append("# TYPE bot_outbound_flood_waits_total counter")
+        lines.append(f"bot_outbound_flood_waits_total {stats['flood_waits']}")
+        lines.append("# HELP bot_startup_seconds Time spent in each startup phase.")
+        lines.append("# TYPE bot_startup_seconds gauge")
+        phases = {**startup.phases, "first_update": startup.first_update}
+        for phase, seconds in phases.items():
+            if seconds is not None:
+                lines.append(f'bot_startup_seconds{{phase="{phase}"}} {seconds}')
+        lines.append("# TYPE bot_uptime_seconds gauge")
+        lines.append(f"bot_uptime_seconds {time.time() - self.started}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class StartupTimer:
+    """Startup phases measured from BOOT_TIME, plus the time to the first handled update."""
+
+    def __init__(self, started=BOOT_TIME):
+        self.started = started
+        self.phases = {}          # phase -> seconds, in the order they finished
+        self.first_update = None  # seconds from BOOT_TIME to the first handled update
+        self._last = started
+
+    def mark(self, phase: str):
+        """Record the time since the previous mark as `phase`."""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def update_handled(self):
+        self.first_update = time.perf_counter() - self.started
+        print(f"⏱ First update handled {self.first_update:.2f}s after launch")
+
+    def report(self) -> str:
+        parts = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+        return f"⏱ Startup {self._last - self.started:.2f}s: {parts}"
+
+startup = StartupTimer()
+
+def instrument_handler(callback):
+    """Wrap a handler callback to record run time and errors."""
+    if getattr(callback, "__instrumented__", False):
+        return callback
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(client, update):
+        start = time.perf_counter()
+        try:
+            return await callback(client, update)
+        except (StopPropagation, ContinuePropagation):
+            raise
+        except Exception as e:
+            metrics.handler_errors[(name, type(e).__name__)] += 1
+            raise
+        finally:
+            metrics.observe(metrics.handler_latency, name, time.perf_counter() - start)
+            if startup.first_update is None:
+                startup.update_handled()
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def instrument_handlers(client):
+    # Individual commands are counted and timed by route_command itself.
+    for handlers in client.dispatcher.groups.values():
+        for handler in handlers:
+            handler.callback = instrument_handler(handler.callback)
+
+async def _timed_api_call(name: str, awaitable):
+    sampled = random.random() < METRICS_API_SAMPLE_RATE
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    except Exception as e:
+        metrics.api_errors[(name, type(e).__name__)] += 1
+        raise
+    finally:
+        if sampled:
+            metrics.observe(metrics.api_latency, name, time.perf_counter() - start)
+
+def _instrument_method(name: str, method):
+    def wrapper(*args, **kwargs):
+        metrics.api_calls[name] += 1
+        result = method(*args, **kwargs)
+        # Async generators such as get_chat_members are counted but not timed.
+        return _timed_api_call(name, result) if inspect.isawaitable(result) else result
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def instrument_client(client):
+    """Count every API_METHODS call on this client instance and time a sample of them."""
+    for name in API_METHODS:
+        method = getattr(client, name, None)
+        if method is not None and not getattr(method, "__instrumented__", False):
+            setattr(client, name, _instrument_method(name, method))
+
+async def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve metrics.render_prometheus() over plain HTTP for a Prometheus scraper."""
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = metrics.render_prometheus().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+@command("stats", admin=True)
+async def show_stats(client, message: Message):
+    snapshot = metrics.snapshot()
+    slowest = sorted(snapshot["handlers"].items(), key=lambda item: item[1]["total"], reverse=True)[:8]
+    handler_lines = [
+        f"• {name}: {h['count']}× avg {h['total'] / h['count'] * 1000:.1f}ms p99≤{h['p99'] * 1000:.0f}ms"
+        for name, h in slowest if h["count"]
+    ]
+    top_commands = ", ".join(f"/{name} {count}" for name, count in Counter(snapshot["commands"]).most_common(8))
+    top_api = ", ".join(f"{name} {count}" for name, count in Counter(snapshot["api_calls"]).most_common(6))
+    errors = sum(metrics.handler_errors.values()) + sum(metrics.api_errors.values())
+    await reply(
+        message,
+        f"📊 **Bot stats** (up {timedelta(seconds=int(snapshot['uptime']))})\n"
+        f"**Handlers by total time:**\n" + "\n".join(handler_lines or ["• none yet"]) +
+        f"\n**Commands:** {top_commands or 'none'}"
+        f"\n**API calls:** {top_api or 'none'}"
+        f"\n**Errors:** {errors}"
+    )
+
+# --- WARM START ---
+
+class WarmStart:
+    """Cache snapshots kept in the store so a restarted bot does not begin cold.
+
+    Admin rosters and the peer cache are saved as JSON and restored with the TTL
+    they had left. Settings are already in the store, so only the list of the
+    most active chats (the settings cache's LRU order) is saved; after connecting,
+    those chats get their settings and admin rosters loaded in the background.
+    """
+
+    def __init__(self):
+        self.chats = []  # most active chats from the last snapshot, least active first
+        self._tasks = []
+
+    @staticmethod
+    def _name(name: str) -> str:
+        # Shard workers keep separate snapshots; a change in shard count simply starts them cold.
+        return name if SHARD is None else f"{name}@{SHARD[0]}/{SHARD[1]}"
+
+    def save(self):
+        now = time.time()
+        store.put("snapshots", self._name("admins"), now, json.dumps(admin_cache.dump()))
+        store.put("snapshots", self._name("peers"), now, json.dumps(peer_cache.dump(SNAPSHOT_MAX_USERS)))
+        store.put("snapshots", self._name("chats"), now, json.dumps(chat_settings.chat_ids()[-WARM_CHATS:]))
+
+    def restore(self, rows):
+        now = time.time()
+        names = {self._name(name): name for name in ("admins", "peers", "chats")}
+        for name, saved_at, data in rows:
+            name = names.get(name)
+            elapsed = max(now - saved_at, 0.0)
+            if name == "admins":
+                admin_cache.restore(json.loads(data), elapsed)
+            elif name == "peers":
+                peer_cache.restore(json.loads(data), elapsed)
+            elif name == "chats":
+                self.chats = json.loads(data)
+
+    def start(self, client):
+        self._tasks = [asyncio.create_task(self._prewarm(client)), asyncio.create_task(self._save_loop())]
+
+    async def _prewarm(self, client):
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(WARM_CONCURRENCY)
+
+        async def warm(chat_id):
+            async with semaphore:
+                await chat_settings.get(chat_id)
+                await admin_cache.get(client, chat_id)
+
+        # Most active first, so the busiest chats are ready soonest.
+        results = await asyncio.gather(*(warm(chat_id) for chat_id in reversed(self.chats)), return_exceptions=True)
+        failed = sum(isinstance(result, BaseException) for result in results)
+        startup.phases["prewarm"] = time.perf_counter() - start
+        print(f"🔥 Pre-warmed {len(results) - failed} chats in {startup.phases['prewarm']:.2f}s")
+
+    async def _save_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            self.save()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self.save()
+
+warm_start = WarmStart()
+
+# --- UPDATE EXECUTOR ---
+
+ROUTING_GROUP = -100  # handler group of the forwarders that hand updates to the executor or the shards
+
+def update_priority(update) -> int:
+    """Shedding class of an incoming update: fun commands go first, then other commands, never the rest.
+
+    Plain messages and member updates count as moderation because the blacklist,
+    link, flood and raid checks run on them.
+    """
+    if not isinstance(update, Message):
+        return PRIORITY_MODERATION
+    text = update.text or update.caption
+    if not text or text[0] != "/" or len(text) < 2 or text[1].isspace():
+        return PRIORITY_MODERATION
+    name = text[1:].split(None, 1)[0].partition("@")[0].lower()
+    if name in MODERATION_COMMANDS:
+        return PRIORITY_MODERATION
+    if name in FUN_COMMANDS:
+        return PRIORITY_FUN
+    return PRIORITY_NORMAL
+
+async def dispatch_update(client, update) -> int:
+    """Run an update through app's handler groups the way pyrogram's dispatcher does.
+
+    A handler that raises is logged and its group is done, but later groups still
+    run, so one broken command can't skip the blacklist, link or flood checks.
+    Returns the number of handlers that failed.
+    """
+    kind = ChatMemberUpdatedHandler if isinstance(update, ChatMemberUpdated) else MessageHandler
+    failed = 0
+    for group in sorted(app.dispatcher.groups):
+        if group == ROUTING_GROUP:
+            continue
+        for handler in app.dispatcher.groups[group]:
+            if not isinstance(handler, kind):
+                continue
+            try:
+                if not await handler.check(client, update):
+                    continue
+            except Exception as e:
+                failed += 1
+                print(f"❌ Filter of {handler.callback.__name__} failed in {update.chat.id}: {e!r}")
+                continue
+            try:
+                await handler.callback(client, update)
+            except StopPropagation:
+                return failed
+            except ContinuePropagation:
+                continue
+            except Exception as e:
+                failed += 1
+                print(f"❌ {handler.callback.__name__} failed in {update.chat.id}: {e!r}")
+            break
+    return failed
+
+class ChatLane:
+    __slots__ = ("queue", "running", "handled", "shed", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.queue = deque()  # (priority, queued_at, client, update) waiting behind the running one
+        self.running = False
+        self.handled = 0
+        self.shed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class UpdateExecutor:
+    """Runs each chat's updates in arrival order and different chats in parallel.
+
+    Every chat has a lane with at most `queue_size` waiting updates, drained by
+    one task while `concurrency` bounds how many chats run at once, so a slow
+    /purge or /translate only holds up its own chat. When a lane is full the
+    lowest class goes first: a queued fun command, then another command, and
+    the incoming update itself if nothing queued ranks below it. Moderation
+    updates are never shed; they are queued past the limit instead.
+    """
+
+    def __init__(self, concurrency=EXECUTOR_CONCURRENCY, queue_size=EXECUTOR_CHAT_QUEUE, dispatch=dispatch_update):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.dispatch = dispatch
+        self._lanes = OrderedDict()  # chat_id -> ChatLane, least recently active first
+        self._semaphore = None
+        self._idle = None
+        self._running = 0
+        self.processed = 0
+        self.errors = 0
+        self.depth = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.shed = dict.fromkeys(PRIORITY_NAMES, 0)
+
+    def _lane(self, chat_id) -> ChatLane:
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = ChatLane()
+            if len(self._lanes) > EXECUTOR_MAX_CHATS:
+                # Only idle lanes are dropped; their wait statistics go with them.
+                for old_id, old in self._lanes.items():
+                    if not old.running:
+                        del self._lanes[old_id]
+                        break
+        else:
+            self._lanes.move_to_end(chat_id)
+        return lane
+
+    def submit(self, client, update, priority=None) -> bool:
+        """Queue an update behind its chat's earlier ones; False if it was shed instead."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._idle = asyncio.Event()
+        if priority is None:
+            priority = update_priority(update)
+        chat_id = update.chat.id
+        lane = self._lane(chat_id)
+        if len(lane.queue) >= self.queue_size and not self._make_room(lane, priority):
+            lane.shed += 1
+            self.shed[priority] += 1
+            return False
+        lane.queue.append((priority, time.monotonic(), client, update))
+        self.depth[priority] += 1
+        if not lane.running:
+            lane.running = True
+            self._running += 1
+            self._idle.clear()
+            asyncio.create_task(self._drain(chat_id, lane))
+        return True
+
+    def _make_room(self, lane: ChatLane, priority: int) -> bool:
+        lowest = max(entry[0] for entry in lane.queue)
+        if lowest <= priority:
+            # Nothing queued ranks below the incoming update: shed it, unless it is moderation.
+            return priority == PRIORITY_MODERATION
+        for index, entry in enumerate(lane.queue):
+            if entry[0] == lowest:
+                del lane.queue[index]
+                lane.shed += 1
+                self.depth[lowest] -= 1
+                self.shed[lowest] += 1
+                return True
+
+    async def _drain(self, chat_id: int, lane: ChatLane):
+        while lane.queue:
+            async with self._semaphore:
+                priority, queued_at, client, update = lane.queue.popleft()
+                self.depth[priority] -= 1
+                waited = time.monotonic() - queued_at
+                lane.handled += 1
+                lane.wait_total += waited
+                lane.wait_max = max(lane.wait_max, waited)
+                metrics.observe(metrics.queue_latency, PRIORITY_NAMES[priority], waited)
+                try:
+                    self.errors += await self.dispatch(client, update) or 0
+                except Exception as e:
+                    self.errors += 1
+                    print(f"❌ Update in {chat_id} failed: {e!r}")
+                self.processed += 1
+        lane.running = False
+        self._running -= 1
+        if not self._running:
+            self._idle.set()
+
+    async def _forward(self, client, update):
+        self.submit(client, update)
+        raise StopPropagation
+
+    def attach(self, client):
+        """Take every update `client` receives off pyrogram's workers and run it here."""
+        client.add_handler(MessageHandler(self._forward), group=ROUTING_GROUP)
+        client.add_handler(ChatMemberUpdatedHandler(self._forward), group=ROUTING_GROUP)
+
+    def chat_stats(self, chat_id) -> dict:
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            return {"depth": 0, "handled": 0, "shed": 0, "avg_wait": 0.0, "max_wait": 0.0}
+        return {
+            "depth": len(lane.queue),
+            "handled": lane.handled,
+            "shed": lane.shed,
+            "avg_wait": lane.wait_total / lane.handled if lane.handled else 0.0,
+            "max_wait": lane.wait_max,
+        }
+
+    def stats(self, top=EXECUTOR_METRICS_CHATS) -> dict:
+        """Totals plus the `top` chats with the longest average queue wait."""
+        slowest = sorted(
+            (chat_id for chat_id, lane in self._lanes.items() if lane.handled),
+            key=lambda chat_id: self._lanes[chat_id].wait_total / self._lanes[chat_id].handled,
+            reverse=True
+        )[:top]
+        return {
+            "processed": self.processed,
+            "errors": self.errors,
+            "running": self._running,
+            "depth": {PRIORITY_NAMES[priority]: count for priority, count in self.depth.items()},
+            "shed": {PRIORITY_NAMES[priority]: count for priority, count in self.shed.items()},
+            "chats": {chat_id: self.chat_stats(chat_id) for chat_id in slowest},
+        }
+
+    async def close(self, timeout=10.0):
+        """Give queued updates up to `timeout` seconds to finish."""
+        if self._running:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+executor = UpdateExecutor()
+
+# --- SHARDING ---
+
+def make_worker_client(index: int) -> Client:
+    """API-only client for a shard worker; the front process is the only one receiving updates."""
+    return Client(
+        f"group_bot_shard{index}", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN,
+        no_updates=True, in_memory=True
+    )
+
+class ShardWorker:
+    """One shard: its own event loop, Client, caches, store connection, scheduler and executor.
+
+    Updates arrive pickled from the front process on a multiprocessing queue,
+    read by a thread and handed to the loop, where the executor runs each
+    chat's updates in order.
+    """
+
+    def __init__(self, index: int, shards: int, client):
+        self.index = index
+        self.shards = shards
+        self.client = client
+
+    def _receive(self, payload: bytes):
+        update = pickle.loads(payload)
+        update.bind(self.client)
+        executor.submit(self.client, update)
+
+    async def run(self, updates, results):
+        global SHARD
+        SHARD = (self.index, self.shards)
+        loop = asyncio.get_running_loop()
+        closed = asyncio.Event()
+
+        def read():
+            while True:
+                payload = updates.get()
+                if payload is None:
+                    loop.call_soon_threadsafe(closed.set)
+                    return
+                loop.call_soon_threadsafe(self._receive, payload)
+
+        await store.open()
+        await audit.open()
+        instrument_handlers(app)
+        instrument_client(self.client)
+        metrics_server = await serve_metrics(port=METRICS_PORT + 1 + self.index) if METRICS_PORT else None
+        await self.client.start()
+        scheduler.start(self.client)
+        warm_start.start(self.client)
+        threading.Thread(target=read, name=f"shard-{self.index}-reader", daemon=True).start()
+        try:
+            await closed.wait()
+            await executor.close(timeout=None)
+        finally:
+            await scheduler.close()
+            await warm_start.close()
+            await outbound.close()
+            await self.client.stop()
+            await audit.close()
+            await store.close()
+            if metrics_server:
+                metrics_server.close()
+            report = getattr(self.client, "report", None)
+            results.put({
+                "shard": self.index,
+                "processed": executor.processed,
+                "errors": executor.errors,
+                "metrics": metrics.snapshot(),
+                "client": report() if report else None,
+            })
+
+def run_shard_worker(index: int, shards: int, updates, results, client_factory):
+    """Entry point of a shard worker process.
+
+    The handlers were registered by tasks scheduled on app.loop when this module
+    was imported, so the worker has to run on that loop (as app.run() does), and
+    its client has to be built there too.
+    """
+    global outbound
+    # All shards send as the same bot, so they split its global budget instead of each taking all of it.
+    outbound = OutboundDispatcher(
+        global_rate=OUTBOUND_GLOBAL_RATE / shards, global_burst=max(OUTBOUND_GLOBAL_BURST / shards, 1)
+    )
+    loop = app.loop
+    asyncio.set_event_loop(loop)
+    client = client_factory(index)
+    loop.run_until_complete(ShardWorker(index, shards, client).run(updates, results))
+
+class ShardedRuntime:
+    """Front half of sharded mode: routes updates by chat to `shards` worker processes.
+
+    Worker i owns the chats with chat_id % shards == i: their caches, settings,
+    warnings, scheduled jobs and outbound queue live only there, so nothing is
+    shared or locked across processes. Updates are pickled (pyrogram objects drop
+    their client when pickled) and re-bound to the worker's own API-only client.
+    A chat always goes to the same worker, whose executor keeps its updates in order.
+
+    attach() takes over a receiving Client; feed() is the same route for a local
+    stand-in update source, which is how the runtime is exercised offline.
+    """
+
+    def __init__(self, shards=SHARDS, client_factory=make_worker_client):
+        self.shards = shards
+        self.client_factory = client_factory
+        self.routed = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._queues = []
+        self._processes = []
+
+    def start(self):
+        for index in range(self.shards):
+            updates = self._context.Queue()
+            process = self._context.Process(
+                target=run_shard_worker, name=f"shard-{index}", daemon=True,
+                args=(index, self.shards, updates, self._results, self.client_factory)
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+
+    def feed(self, update):
+        """Send a Message or ChatMemberUpdated to the worker that owns its chat."""
+        self._queues[update.chat.id % self.shards].put(pickle.dumps(update, pickle.HIGHEST_PROTOCOL))
+        self.routed += 1
+
+    async def _forward(self, _, update):
+        self.feed(update)
+        raise StopPropagation
+
+    def attach(self, client):
+        """Route every update `client` receives to the workers instead of handling it here."""
+        client.add_handler(MessageHandler(self._forward), group=ROUTING_GROUP)
+        client.add_handler(ChatMemberUpdatedHandler(self._forward), group=ROUTING_GROUP)
+
+    async def stop(self, timeout=30.0) -> list:
+        """Let the workers finish what they were sent, stop them, and return their reports by shard."""
+        for updates in self._queues:
+            updates.put(None)
+        deadline = time.monotonic() + timeout
+        reports = []
+        for _ in self._processes:
+            try:
+                reports.append(await asyncio.to_thread(self._results.get, True, max(deadline - time.monotonic(), 0.1)))
+            except queue.Empty:
+                break
+        for process in self._processes:
+            await asyncio.to_thread(process.join, max(deadline - time.monotonic(), 0.1))
+            if process.is_alive():
+                process.terminate()
+        return sorted(reports, key=lambda report: report["shard"])
+
+async def run_sharded():
+    await store.migrate()
+    runtime = ShardedRuntime()
+    runtime.start()
+    runtime.attach(app)
+    await app.start()
+    startup.mark("connect")
+    print(startup.report())
+    print(f"✅ Advanced Group Manager is running with {SHARDS} shards!")
+    try:
+        await idle()
+    finally:
+        await app.stop()
+        await runtime.stop()
 
 # --- RUN BOT ---
 
-if __name__ == "__main__":
+async def main():
+    startup.mark("load")
+    if SHARDS > 1:
+        await run_sharded()
+        return
+    await store.open()
+    await audit.open()
+    startup.mark("store")
+    instrument_handlers(app)
+    instrument_client(app)
+    executor.attach(app)
+    metrics_server = await serve_metrics() if METRICS_PORT else None
+    await app.start()
+    startup.mark("connect")
+    scheduler.start(app)
+    warm_start.start(app)
+    print(startup.report())
     print("✅ Advanced Group Manager is running!")
-    app.run()
+    try:
+        await idle()
+    finally:
+        await executor.close()
+        await scheduler.close()
+        await warm_start.close()
+        await outbound.close()
+        await app.stop()
+        await audit.close()
+        await store.close()
+        if metrics_server:
+            metrics_server.close()
+
+if __name__ == "__main__":
+    app.run(main())
@@ -0,0 +1,67 @@
+"""Blacklist scan throughput against term-list size.
+
+Compares the Aho-Corasick BlacklistMatcher with the naive
+``any(word in text for word in terms)`` loop on the same messages.
+
+    python benchmarks/bench_blacklist.py
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Pikachu02 import BlacklistMatcher, normalise_text
+
+TERM_COUNTS = (10, 100, 1_000, 10_000)
+MESSAGES = 2_000
+MESSAGE_LENGTH = 200
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+def make_messages(rng):
+    messages = []
+    for _ in range(MESSAGES):
+        words = []
+        while sum(map(len, words)) < MESSAGE_LENGTH:
+            words.append(random_word(rng, 2, 8))
+        messages.append(" ".join(words))
+    return messages
+
+def time_scan(scan, messages):
+    start = time.perf_counter()
+    for text in messages:
+        scan(text)
+    return time.perf_counter() - start
+
+def main():
+    rng = random.Random(42)
+    messages = make_messages(rng)
+    total_chars = sum(map(len, messages))
+    print(f"{MESSAGES} messages, {total_chars / MESSAGES:.0f} chars each\n")
+    print(f"{'terms':>8} {'build ms':>10} {'AC msg/s':>12} {'AC MB/s':>9} {'naive msg/s':>12} {'speed-up':>9}")
+    for count in TERM_COUNTS:
+        terms = {random_word(rng, 5, 12) for _ in range(count)}
+        start = time.perf_counter()
+        matcher = BlacklistMatcher(terms)
+        matcher.search("")  # force the failure-link pass
+        build = time.perf_counter() - start
+
+        ac = time_scan(matcher.search, messages)
+        naive_terms = [normalise_text(term) for term in terms]
+
+        def naive_scan(text):
+            text = normalise_text(text)
+            return any(term in text for term in naive_terms)
+
+        naive = time_scan(naive_scan, messages)
+        print(
+            f"{count:>8} {build * 1000:>10.1f} {MESSAGES / ac:>12,.0f} {total_chars / ac / 1e6:>9.2f}"
+            f" {MESSAGES / naive:>12,.0f} {naive / ac:>8.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Per-message cost of the link spam classifier against a fixed budget.
+
+Runs LinkClassifier.classify over a mix of plain chat, links, invites and
+channel forwards in "on" and "strict" mode, prints the mean and p99 per
+message and exits non-zero if the p99 is over BUDGET_US.
+
+    python benchmarks/bench_links.py
+"""
+import os
+import random
+import string
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrogram import enums
+
+from Pikachu02 import ChatSettings, LinkClassifier, recent_messages
+
+BUDGET_US = 50.0     # p99 per message
+MESSAGES = 20_000
+DOMAINS = 1_000      # entries in each of the allow and deny sets
+
+def random_word(rng, low=2, high=9):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+def make_message(rng, index, deny, allow):
+    words = [random_word(rng) for _ in range(rng.randint(3, 30))]
+    kind = rng.random()
+    forward = None
+    if kind < 0.10:
+        words.insert(rng.randrange(len(words)), f"https://{rng.choice(deny)}/{random_word(rng)}")
+    elif kind < 0.25:
+        words.insert(rng.randrange(len(words)), f"www.{rng.choice(allow)}/x?id={index}")
+    elif kind < 0.30:
+        words.insert(rng.randrange(len(words)), f"t.me/+{random_word(rng, 12, 16)}")
+    elif kind < 0.33:
+        forward = SimpleNamespace(type=enums.ChatType.CHANNEL, username=random_word(rng, 5, 10))
+    elif kind < 0.40:
+        words.append("v1.2 costs 3.50")
+    chat = SimpleNamespace(id=-100, username="ourgroup")
+    user = SimpleNamespace(id=rng.randrange(1, 500))
+    message = SimpleNamespace(
+        id=index, chat=chat, from_user=user, text=" ".join(words), caption=None, entities=None,
+        caption_entities=None, forward_from_chat=forward, media=None,
+    )
+    message.content_hash = recent_messages.add(message)
+    return message
+
+def run(classifier, messages, settings):
+    timings = []
+    flagged = 0
+    for message in messages:
+        start = time.perf_counter()
+        verdict = classifier.classify(message, settings)
+        timings.append(time.perf_counter() - start)
+        flagged += verdict is not None
+    timings.sort()
+    mean = sum(timings) / len(timings) * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    return mean, p99, flagged
+
+def main():
+    rng = random.Random(42)
+    deny = [f"{random_word(rng, 4, 10)}.{rng.choice(('com', 'net', 'xyz', 'io'))}" for _ in range(DOMAINS)]
+    allow = [f"{random_word(rng, 4, 10)}.{rng.choice(('com', 'org', 'dev'))}" for _ in range(DOMAINS)]
+    messages = [make_message(rng, index, deny, allow) for index in range(MESSAGES)]
+    classifier = LinkClassifier()
+    print(f"{MESSAGES} messages, {DOMAINS} allowed and {DOMAINS} blocked domains, budget p99 ≤ {BUDGET_US:g}us\n")
+    print(f"{'mode':>8} {'mean us':>9} {'p99 us':>8} {'flagged':>8}")
+    over = False
+    for mode in ("on", "strict"):
+        settings = ChatSettings(
+            "", None, link_mode=mode, link_allow=frozenset(allow), link_deny=frozenset(deny)
+        )
+        mean, p99, flagged = run(classifier, messages, settings)
+        over |= p99 > BUDGET_US
+        print(f"{mode:>8} {mean:>9.2f} {p99:>8.2f} {flagged:>8}")
+    if over:
+        print("\n❌ p99 over budget")
+        sys.exit(1)
+    print("\n✅ within budget")
+
+if __name__ == "__main__":
+    main()
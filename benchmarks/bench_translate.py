@@ -0,0 +1,61 @@
+"""Offline /translate benchmark using FakeTranslationBackend.
+
+Replays a burst of translation requests (with repeats) and compares the old
+blocking path, one backend call per request on the event loop, with
+TranslationService. Also reports how long a concurrent 10ms heartbeat task
+was stalled, which is what every other handler would have felt.
+
+    python benchmarks/bench_translate.py
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Pikachu02 import FakeTranslationBackend, TranslationService
+
+REQUESTS = 200
+DISTINCT_TEXTS = 50
+LATENCY = 0.02
+
+async def heartbeat(stop: asyncio.Event, stalls: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        stalls.append(time.perf_counter() - start - 0.01)
+
+async def run(name, translate, texts):
+    stop, stalls = asyncio.Event(), []
+    beat = asyncio.create_task(heartbeat(stop, stalls))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(translate(text) for text in texts))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    print(f"{name:<22} {elapsed:>8.2f}s {len(texts) / elapsed:>10.0f} req/s {max(stalls, default=0) * 1000:>10.1f}ms")
+
+async def main():
+    rng = random.Random(7)
+    texts = [f"message number {rng.randrange(DISTINCT_TEXTS)}" for _ in range(REQUESTS)]
+    print(f"{REQUESTS} requests, {DISTINCT_TEXTS} distinct texts, {LATENCY * 1000:.0f}ms backend latency\n")
+    print(f"{'path':<22} {'total':>9} {'throughput':>14} {'max stall':>12}")
+
+    blocking = FakeTranslationBackend(latency=LATENCY)
+
+    async def blocking_translate(text):
+        return blocking.translate(text, "en")
+
+    await run("blocking (old)", blocking_translate, texts)
+
+    backend = FakeTranslationBackend(latency=LATENCY)
+    service = TranslationService(backend)
+    await run("TranslationService", lambda text: service.translate(text, "en"), texts)
+    print(f"\nbackend calls: blocking {blocking.calls}, service {backend.calls} "
+          f"(cache hits {service.hits}, shared in-flight {REQUESTS - service.hits - service.misses})")
+
+if __name__ == "__main__":
+    asyncio.run(main())
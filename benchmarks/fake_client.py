@@ -0,0 +1,125 @@
+"""In-process stand-in for pyrogram.Client used by the offline benchmarks.
+
+FakeClient answers the API methods the handlers in Pikachu02.py call, records
+every call, and can add simulated network latency and random FloodWait errors.
+"""
+import asyncio
+import itertools
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from pyrogram import enums, raw, types, utils
+from pyrogram.errors import FloodWait
+
+class FakeClient:
+    """Records API calls and simulates latency and FloodWait.
+
+    `latency` is the mean delay per call in seconds (uniformly jittered by
+    ±50%); `flood_rate` is the probability that a call raises FloodWait with
+    `flood_seconds` as the wait. Like pyrogram.Client it binds to the current
+    event loop and has a thread pool, which Handler.check uses for sync filters.
+    """
+
+    def __init__(self, latency=0.0, flood_rate=0.0, flood_seconds=1, admins=(1,), seed=0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.admins = set(admins)
+        self.loop = asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(4, thread_name_prefix="Handler")
+        self.calls = Counter()
+        self.flood_waits = 0
+        self.me = types.User(id=42, is_self=True, is_bot=True, first_name="Pikachu", username="pikachu_bot")
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1_000_000)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def _api(self, method: str):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self._rng.uniform(0.5, 1.5))
+        if self.flood_rate and self._rng.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_seconds)
+
+    def user(self, user_id: int) -> types.User:
+        return types.User(client=self, id=user_id, is_self=False, is_bot=False,
+                          first_name=f"User{user_id}", username=f"user{user_id}")
+
+    def chat(self, chat_id: int) -> types.Chat:
+        return types.Chat(client=self, id=chat_id, type=enums.ChatType.SUPERGROUP, title=f"Chat {chat_id}")
+
+    def _sent(self, chat_id: int, text: str) -> types.Message:
+        return types.Message(client=self, id=next(self._message_ids), chat=self.chat(chat_id), from_user=self.me, text=text)
+
+    # --- messages ---
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._api("send_message")
+        return self._sent(chat_id, text)
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self._api("edit_message_text")
+        return self._sent(chat_id, text)
+
+    async def delete_messages(self, chat_id, message_ids, revoke=True):
+        await self._api("delete_messages")
+        return len(message_ids) if isinstance(message_ids, (list, tuple, range)) else 1
+
+    async def get_messages(self, chat_id, message_ids, **kwargs):
+        await self._api("get_messages")
+        ids = message_ids if isinstance(message_ids, (list, tuple, range)) else [message_ids]
+        return [types.Message(client=self, id=i, chat=self.chat(chat_id), from_user=self.user(i % 50 + 100), text="old")
+                for i in ids]
+
+    # --- members ---
+
+    async def get_chat_members(self, chat_id, query="", limit=0, filter=None):
+        await self._api("get_chat_members")
+        for user_id in sorted(self.admins):
+            status = enums.ChatMemberStatus.OWNER if user_id == min(self.admins) else enums.ChatMemberStatus.ADMINISTRATOR
+            yield types.ChatMember(client=self, status=status, user=self.user(user_id))
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self._api("get_chat_member")
+        status = enums.ChatMemberStatus.ADMINISTRATOR if user_id in self.admins else enums.ChatMemberStatus.MEMBER
+        return types.ChatMember(client=self, status=status, user=self.user(user_id), joined_date=None)
+
+    async def get_chat_members_count(self, chat_id):
+        await self._api("get_chat_members_count")
+        return 1000
+
+    async def restrict_chat_member(self, chat_id, user_id, permissions, until_date=utils.zero_datetime()):
+        # Encoded like pyrogram does, so arguments Telegram can't take fail here too.
+        raw.types.ChatBannedRights(
+            until_date=utils.datetime_to_timestamp(until_date), send_messages=not permissions.can_send_messages
+        ).write()
+        await self._api("restrict_chat_member")
+        return self.chat(chat_id)
+
+    async def ban_chat_member(self, chat_id, user_id, until_date=utils.zero_datetime()):
+        raw.types.ChatBannedRights(until_date=utils.datetime_to_timestamp(until_date), view_messages=True).write()
+        await self._api("ban_chat_member")
+        return True
+
+    async def get_users(self, user_ids):
+        await self._api("get_users")
+        if isinstance(user_ids, str):
+            digits = "".join(ch for ch in user_ids if ch.isdigit())
+            return self.user(int(digits or 0))
+        return self.user(int(user_ids))
+
+    def __getattr__(self, method):
+        # Everything else (ban_chat_member, restrict_chat_member, pin_chat_message, ...) just succeeds.
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            await self._api(method)
+            return True
+
+        return call
@@ -0,0 +1,235 @@
+"""Offline load-replay harness for the handlers registered on Pikachu02.app.
+
+Synthetic update streams are fed to a Pikachu02.UpdateExecutor that runs
+them through Pikachu02.dispatch_update, the same path the bot uses, against
+a FakeClient. For each scenario it reports p50/p99 handler latency, updates
+per second and API calls per update, and writes everything as JSON so runs
+can be compared across versions. It exits non-zero if a scenario ran no
+handlers at all, which means the dispatcher never saw them registered.
+
+    python benchmarks/replay.py
+    python benchmarks/replay.py --scenario join_raid --latency 0.05 --flood-rate 0.01
+    python benchmarks/replay.py --real-limits --output results/before.json
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pyrogram import enums, types
+
+import Pikachu02
+from fake_client import FakeClient
+
+ADMIN_ID = 1
+WORDS = "hello there how is everyone doing today lol ok sure thanks nice game later see you".split()
+COMMANDS = ["/rules", "/id", "/roll", "/coin", "/warns", "/filters", "/staff", "/ping"]
+
+# --- SCENARIOS ---
+
+def make_message(client, chat_id, message_id, user_id, text=None, **kwargs):
+    return types.Message(
+        client=client,
+        id=message_id,
+        chat=client.chat(chat_id),
+        from_user=client.user(user_id),
+        text=text,
+        **kwargs
+    )
+
+def normal_chat(client, chat_id, rng, size):
+    """Ordinary conversation: 50 users, about 5% commands."""
+    for i in range(size):
+        user_id = rng.randrange(100, 150)
+        if rng.random() < 0.05:
+            text = rng.choice(COMMANDS)
+        else:
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 15)))
+        yield make_message(client, chat_id, i + 1, user_id, text)
+
+def join_raid(client, chat_id, rng, size):
+    """A burst of join service messages, one to three new members each."""
+    user_id = 10_000
+    for i in range(size):
+        members = []
+        for _ in range(rng.randint(1, 3)):
+            members.append(client.user(user_id))
+            user_id += 1
+        yield make_message(
+            client, chat_id, i + 1, members[0].id,
+            new_chat_members=members, service=enums.MessageServiceType.NEW_CHAT_MEMBERS
+        )
+
+def spam_burst(client, chat_id, rng, size):
+    """A few accounts posting the same blacklisted link spam as fast as they can."""
+    spam = ["buy cheap spam now https://spam.example/offer", "SPAM spam spam t.me/joinchat/xyz", "free badword here"]
+    for i in range(size):
+        yield make_message(client, chat_id, i + 1, 20_000 + i % 20, rng.choice(spam))
+
+def mass_warn(client, chat_id, rng, size):
+    """An admin warning a long list of users by ID."""
+    for i in range(size):
+        yield make_message(client, chat_id, i + 1, ADMIN_ID, f"/warn {30_000 + i % (size // 3 + 1)}")
+
+SCENARIOS = {
+    "normal_chat": (normal_chat, 2000),
+    "join_raid": (join_raid, 300),
+    "spam_burst": (spam_burst, 500),
+    "mass_warn": (mass_warn, 300),
+}
+
+# --- REPLAY ---
+
+handlers_run = 0
+
+def counted(callback):
+    @functools.wraps(callback)
+    async def wrapper(client, update):
+        global handlers_run
+        handlers_run += 1
+        return await callback(client, update)
+
+    return wrapper
+
+def count_handlers():
+    """Count every handler callback that runs, so a replay that reached none can fail."""
+    for group, handlers in Pikachu02.app.dispatcher.groups.items():
+        if group == Pikachu02.ROUTING_GROUP:
+            continue
+        for handler in handlers:
+            handler.callback = counted(handler.callback)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def replay(name, updates, client, workers):
+    """Feed updates to an UpdateExecutor with at most `workers` waiting or running, like pyrogram's worker pool."""
+    in_flight = asyncio.Semaphore(workers)
+    latencies = []
+
+    async def timed_dispatch(client, update):
+        start = time.perf_counter()
+        try:
+            return await Pikachu02.dispatch_update(client, update)
+        finally:
+            latencies.append(time.perf_counter() - start)
+            in_flight.release()
+
+    executor = Pikachu02.UpdateExecutor(concurrency=workers, dispatch=timed_dispatch)
+    handlers_before = handlers_run
+    calls_before = client.total_calls
+    start = time.perf_counter()
+    for update in updates:
+        await in_flight.acquire()
+        if not executor.submit(client, update):
+            in_flight.release()
+    await executor.close(timeout=None)
+    elapsed = time.perf_counter() - start
+    calls = client.total_calls - calls_before
+    shed = sum(executor.shed.values())
+    return {
+        "scenario": name,
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_second": len(updates) / elapsed if elapsed else 0.0,
+        "handlers_run": handlers_run - handlers_before,
+        "shed": shed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+        "api_calls": calls,
+        "api_calls_per_update": calls / len(updates) if updates else 0.0,
+        "errors": executor.errors,
+    }
+
+def lift_rate_limits():
+    """Take the outbound token buckets out of the measurement."""
+    Pikachu02.OUTBOUND_GLOBAL_RATE = Pikachu02.OUTBOUND_GLOBAL_BURST = 1e9
+    Pikachu02.OUTBOUND_CHAT_RATE = Pikachu02.OUTBOUND_CHAT_BURST = 1e9
+    Pikachu02.outbound = Pikachu02.OutboundDispatcher()
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return None
+
+async def main(args):
+    if not any(Pikachu02.app.dispatcher.groups.values()):
+        print("❌ no handlers registered on Pikachu02.app")
+        sys.exit(1)
+    if not args.real_limits:
+        lift_rate_limits()
+    count_handlers()
+    client = FakeClient(latency=args.latency, flood_rate=args.flood_rate, admins=(ADMIN_ID,), seed=args.seed)
+    if not args.no_metrics:
+        Pikachu02.instrument_handlers(Pikachu02.app)
+        Pikachu02.instrument_client(client)
+    rng = random.Random(args.seed)
+    results = []
+    print(f"{'scenario':<14} {'updates':>8} {'upd/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'api/upd':>8} {'errors':>7}")
+    for chat_offset, name in enumerate(args.scenario):
+        generate, size = SCENARIOS[name]
+        updates = list(generate(client, -1_000_000 - chat_offset, rng, args.size or size))
+        before = dict(client.calls)
+        result = await replay(name, updates, client, args.workers)
+        result["api_calls_by_method"] = {
+            method: count - before.get(method, 0) for method, count in client.calls.items() if count - before.get(method, 0)
+        }
+        results.append(result)
+        print(
+            f"{name:<14} {result['updates']:>8} {result['updates_per_second']:>10.0f} {result['p50_ms']:>9.2f}"
+            f" {result['p99_ms']:>9.2f} {result['api_calls_per_update']:>8.2f} {result['errors']:>7}"
+        )
+    await Pikachu02.outbound.close(timeout=5)
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "outbound": Pikachu02.outbound.stats(),
+        "flood_waits_injected": client.flood_waits,
+        "metrics": None if args.no_metrics else Pikachu02.metrics.snapshot(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    idle = [result["scenario"] for result in results if not result["handlers_run"]]
+    if idle:
+        print(f"❌ no handlers ran for: {', '.join(idle)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--size", type=int, default=0, help="updates per scenario (default: per-scenario size)")
+    parser.add_argument("--workers", type=int, default=8, help="updates waiting or running at once, like Client(workers=...)")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean simulated API latency in seconds")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability an API call raises FloodWait")
+    parser.add_argument("--real-limits", action="store_true", help="keep the production outbound rate limits")
+    parser.add_argument("--no-metrics", action="store_true", help="run without handler/API instrumentation")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.json"))
+    args = parser.parse_args()
+    args.scenario = args.scenario or list(SCENARIOS)
+    # add_handler registers through tasks scheduled on app.loop, so the replay
+    # has to run on that loop, the way app.run() would.
+    Pikachu02.app.loop.run_until_complete(main(args))
@@ -0,0 +1,123 @@
+"""Sharded runtime replay: 1 worker process against N, with per-chat order checked.
+
+A local stand-in update source feeds /say messages for many chats into
+ShardedRuntime, whose workers run the real handlers against a FakeClient with
+simulated API latency. Each worker reports the texts it sent per chat; the
+run fails if any chat's replies came back out of order or went missing, or if
+no replies came back at all because the workers' handlers never ran.
+
+    python benchmarks/shard_replay.py
+    python benchmarks/shard_replay.py --shards 4 --chats 400 --messages 20 --latency 0.01
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pyrogram import types
+
+import Pikachu02
+from fake_client import FakeClient
+
+ADMIN_ID = 1
+
+class RecordingClient(FakeClient):
+    """FakeClient that remembers what it sent to each chat, in order."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = defaultdict(list)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent[chat_id].append(text)
+        return await super().send_message(chat_id, text, **kwargs)
+
+    def report(self):
+        return {"sent": dict(self.sent), "api_calls": self.total_calls}
+
+class LatencyClientFactory:
+    """Builds a worker's client in the child process, without the outbound rate limits."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __call__(self, index):
+        Pikachu02.OUTBOUND_GLOBAL_RATE = Pikachu02.OUTBOUND_GLOBAL_BURST = 1e9
+        Pikachu02.OUTBOUND_CHAT_RATE = Pikachu02.OUTBOUND_CHAT_BURST = 1e9
+        Pikachu02.outbound = Pikachu02.OutboundDispatcher()
+        return RecordingClient(latency=self.latency, admins=(ADMIN_ID,), seed=index)
+
+def make_updates(chats, messages):
+    """Messages interleaved across chats, the way a busy bot receives them.
+
+    Each message in a chat comes from a different member so the flood check stays quiet.
+    """
+    source = FakeClient()
+    updates = []
+    for index in range(messages):
+        for chat in range(chats):
+            chat_id = -1_000_000 - chat
+            updates.append(types.Message(
+                client=source, id=index + 1, chat=source.chat(chat_id),
+                from_user=source.user(100 + index), text=f"/say {chat_id} {index}"
+            ))
+    return updates
+
+async def run(shards, updates, latency):
+    runtime = Pikachu02.ShardedRuntime(shards, LatencyClientFactory(latency))
+    runtime.start()
+    start = time.perf_counter()
+    for update in updates:
+        runtime.feed(update)
+    reports = await runtime.stop(timeout=600)
+    elapsed = time.perf_counter() - start
+    return elapsed, reports
+
+def check_order(reports, chats, messages):
+    """Return the chat IDs whose replies are missing or out of order."""
+    sent = {}
+    for report in reports:
+        for chat_id, texts in report["client"]["sent"].items():
+            sent[chat_id] = texts
+    bad = []
+    for chat in range(chats):
+        chat_id = -1_000_000 - chat
+        if sent.get(chat_id) != [f"{chat_id} {index}" for index in range(messages)]:
+            bad.append(chat_id)
+    return bad
+
+async def main(args):
+    updates = make_updates(args.chats, args.messages)
+    print(f"{len(updates)} updates over {args.chats} chats, {args.latency * 1000:.0f}ms simulated API latency\n")
+    print(f"{'shards':>7} {'seconds':>9} {'upd/s':>10} {'replies':>8} {'errors':>7} {'bad chats':>10}")
+    await Pikachu02.store.migrate()
+    failed = False
+    for shards in sorted({1, args.shards}):
+        elapsed, reports = await run(shards, updates, args.latency)
+        processed = sum(report["processed"] for report in reports)
+        errors = sum(report["errors"] for report in reports)
+        replies = sum(len(texts) for report in reports for texts in report["client"]["sent"].values())
+        bad = check_order(reports, args.chats, args.messages)
+        failed |= bool(bad) or len(reports) != shards or processed != len(updates) or replies != len(updates)
+        print(f"{shards:>7} {elapsed:>9.2f} {len(updates) / elapsed:>10.0f} {replies:>8} {errors:>7} {len(bad):>10}")
+    if failed:
+        print("\n❌ updates lost or replies out of order")
+        sys.exit(1)
+    print("\n✅ every chat answered in order")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=10, help="messages per chat")
+    parser.add_argument("--latency", type=float, default=0.005, help="mean simulated API latency in seconds")
+    args = parser.parse_args()
+    # Workers open the store; keep it out of the working directory.
+    os.chdir(tempfile.mkdtemp(prefix="shard_replay_"))
+    asyncio.run(main(args))
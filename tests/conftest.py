@@ -0,0 +1,22 @@
+"""Shared setup: import Pikachu02 and benchmarks/fake_client from the repo root."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import Pikachu02
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion on app.loop, the loop Pikachu02 binds to at import."""
+    return Pikachu02.app.loop.run_until_complete
+
+@pytest.fixture(autouse=True, scope="session")
+def drain_outbound():
+    """Let the outbound workers the tests started finish before the loop is dropped."""
+    yield
+    Pikachu02.app.loop.run_until_complete(Pikachu02.outbound.close(timeout=5))
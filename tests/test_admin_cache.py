@@ -0,0 +1,33 @@
+"""AdminCache roster loading and its per-chat fetch locks."""
+import asyncio
+
+from Pikachu02 import AdminCache
+from fake_client import FakeClient
+
+class FailingClient(FakeClient):
+    async def get_chat_members(self, chat_id, query="", limit=0, filter=None):
+        await self._api("get_chat_members")
+        raise RuntimeError("chat not found")
+        yield
+
+def test_failed_fetch_drops_its_lock(run):
+    cache = AdminCache()
+    client = FailingClient()
+    for _ in range(3):
+        try:
+            run(cache.get(client, -1))
+        except RuntimeError:
+            pass
+    assert cache._locks == {}
+
+def test_concurrent_callers_share_one_fetch(run):
+    cache = AdminCache()
+    client = FakeClient(latency=0.01, admins=(1, 2))
+
+    async def burst():
+        return await asyncio.gather(*(cache.get(client, -1) for _ in range(20)))
+
+    rosters = run(burst())
+    assert client.calls["get_chat_members"] == 1
+    assert all(roster.keys() == {1, 2} for roster in rosters)
+    assert cache._locks == {}
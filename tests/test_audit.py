@@ -0,0 +1,52 @@
+"""AuditLog segment encoding, compaction and indexed queries, in a temporary directory."""
+import os
+
+import pytest
+
+import Pikachu02
+from Pikachu02 import AUDIT_RECORD, AuditLog, CompactedSegment, encode_segment
+
+@pytest.fixture
+def small_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(Pikachu02, "AUDIT_DIR", str(tmp_path))
+    monkeypatch.setattr(Pikachu02, "AUDIT_SEGMENT_RECORDS", 100)
+    monkeypatch.setattr(Pikachu02, "AUDIT_BLOCK_RECORDS", 16)
+    return tmp_path
+
+def test_encoded_segment_reads_back(small_segments):
+    rows = [(1_700_000_000 + i, -100 - i % 3, 1, 1000 + i, i % 10, -i) for i in range(40)]
+    path = os.path.join(small_segments, "segment.col")
+    with open(path, "wb") as f:
+        f.write(encode_segment(b"".join(AUDIT_RECORD.pack(*row) for row in rows)))
+    segment = CompactedSegment.open(path)
+    assert segment.count == 40 and len(segment.bounds) == 4  # blocks of 16, 16 and 8
+    blocks = segment.read_blocks(range(3))
+    decoded = [tuple(column[i] for column in blocks[n]) for n in range(3) for i in range(len(blocks[n][0]))]
+    assert decoded == rows
+
+def test_queries_survive_compaction_and_reopen(small_segments, run):
+    async def scenario():
+        log = AuditLog()
+        await log.open()
+        for i in range(250):
+            log.record(-1 if i % 2 else -2, "ban" if i % 5 else "warn", 10 + i % 3, 500 + i % 7, i)
+        await log.compact()
+        assert len(log._compacted) == 2  # records 0-199 sealed, 200-249 still open
+        first = await log.query(-1, target=503, limit=50)
+        await log.close()
+
+        reopened = AuditLog()
+        await reopened.open()
+        second = await reopened.query(-1, target=503, limit=50)
+        by_actor = await reopened.query(-2, actor=11, limit=5)
+        everything = await reopened.query(-1, limit=500)
+        await reopened.close()
+        return first, second, by_actor, everything
+
+    first, second, by_actor, everything = run(scenario())
+    expected = [i for i in reversed(range(250)) if i % 2 and i % 7 == 3]
+    assert [row[5] for row in first] == expected
+    assert second == first
+    assert [row[5] for row in by_actor] == [i for i in reversed(range(250)) if not i % 2 and i % 3 == 1][:5]
+    assert len(everything) == 125 and all(row[1] == -1 for row in everything)
+    assert {row[4] for row in everything} == {"ban", "warn"}
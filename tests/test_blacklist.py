@@ -0,0 +1,28 @@
+"""BlacklistMatcher whole-word matching and wildcards."""
+from Pikachu02 import BlacklistMatcher
+
+def test_terms_match_whole_words_only():
+    matcher = BlacklistMatcher(["spam", "ass"])
+    assert matcher.search("please don't SPAM here") == "spam"
+    assert matcher.search("spam") == "spam"
+    assert matcher.search("antispam bot, this classic password") is None
+
+def test_wildcards_open_a_side():
+    matcher = BlacklistMatcher(["spam*", "*scam*"])
+    assert matcher.search("total spammer") == "spam*"
+    assert matcher.search("antispam") is None
+    assert matcher.search("noscamming") == "*scam*"
+
+def test_shorter_term_behind_a_rejected_longer_one():
+    # "classy" fails the boundary check at its end; "lass" later in the text still has to be found.
+    matcher = BlacklistMatcher(["classy", "lass"])
+    assert matcher.search("a classyish lass") == "lass"
+    # "abc" fails at its start; "*bc" ends at the same character and has to be found too.
+    matcher = BlacklistMatcher(["abc", "*bc"])
+    assert matcher.search("xabc") == "*bc"
+
+def test_phrases_and_removal():
+    matcher = BlacklistMatcher(["buy now"])
+    assert matcher.search("click to buy now!") == "buy now"
+    assert matcher.remove("buy now") and matcher.search("buy now") is None
+    assert not matcher.remove("buy now")
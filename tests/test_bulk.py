@@ -0,0 +1,34 @@
+"""Bulk moderation summaries, through dispatch_update against FakeClient."""
+from pyrogram import types
+
+from Pikachu02 import chat_settings, dispatch_update, parse_warn_tiers
+from fake_client import FakeClient
+
+ADMIN_ID = 1
+CHAT_ID = -8
+
+class BanFailingClient(FakeClient):
+    """Refuses every ban and keeps the texts of edited messages."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.edits = []
+
+    async def ban_chat_member(self, chat_id, user_id, until_date=None):
+        await self._api("ban_chat_member")
+        raise RuntimeError("CHAT_ADMIN_REQUIRED")
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.edits.append(text)
+        return await super().edit_message_text(chat_id, message_id, text, **kwargs)
+
+def test_masswarn_counts_failed_tier_actions(run):
+    client = BanFailingClient(admins=(ADMIN_ID,))
+    run(chat_settings.set_warn_tiers(CHAT_ID, parse_warn_tiers("1 ban")))
+    command = types.Message(
+        client=client, id=1, chat=client.chat(CHAT_ID), from_user=client.user(ADMIN_ID), text="/masswarn 601 602"
+    )
+    run(dispatch_update(client, command))
+    assert client.calls["ban_chat_member"] == 2
+    assert client.edits[-1].startswith("✅ Warned 0/2 users.")
+    assert "❌ Failed:" in client.edits[-1]
@@ -0,0 +1,35 @@
+"""parse_command and route_command, dispatched through dispatch_update against FakeClient."""
+from pyrogram import types
+
+from Pikachu02 import dispatch_update, parse_command
+from fake_client import FakeClient
+
+ADMIN_ID = 1
+
+def message(client, text, user_id=100, chat_id=-1):
+    return types.Message(client=client, id=1, chat=client.chat(chat_id), from_user=client.user(user_id), text=text)
+
+def test_parse_command_arguments():
+    assert parse_command('/filter "hi there" hello \\"you\\"', "bot") == ["filter", "hi there", "hello", '"you"']
+    assert parse_command("/ROLL", "bot") == ["roll"]
+    assert parse_command("/nosuchcommand x", "bot") is None
+
+def test_parse_command_bot_suffix():
+    assert parse_command("/id@Pikachu_Bot", "pikachu_bot") == ["id"]
+    assert parse_command("/id@other_bot", "pikachu_bot") is None
+    assert parse_command("/id@pikachu_bot arg", "pikachu_bot") == ["id", "arg"]
+
+def test_route_command_answers_only_this_bot(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    run(dispatch_update(client, message(client, "/ping@other_bot")))
+    assert client.calls["send_message"] == 0
+    run(dispatch_update(client, message(client, "/ping@pikachu_bot")))
+    run(dispatch_update(client, message(client, "/ping")))
+    assert client.calls["send_message"] == 2
+
+def test_route_command_checks_admin(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    run(dispatch_update(client, message(client, "/ban 555", user_id=100)))
+    assert client.calls["ban_chat_member"] == 0
+    run(dispatch_update(client, message(client, "/ban 555", user_id=ADMIN_ID)))
+    assert client.calls["ban_chat_member"] == 1
@@ -0,0 +1,40 @@
+"""UpdateExecutor lanes: a chat's rate-limited replies must not hold up its moderation."""
+from pyrogram import types
+
+import Pikachu02
+from Pikachu02 import ChatFilters, OutboundDispatcher, UpdateExecutor, filters_dict
+from fake_client import FakeClient
+
+CHAT_ID = -9
+
+def test_filter_replies_do_not_stall_blacklist(run, monkeypatch):
+    monkeypatch.setattr(Pikachu02, "OUTBOUND_CHAT_RATE", 50.0)
+    monkeypatch.setattr(Pikachu02, "OUTBOUND_CHAT_BURST", 1)
+    monkeypatch.setattr(Pikachu02, "outbound", OutboundDispatcher())
+    monkeypatch.setitem(filters_dict, CHAT_ID, ChatFilters())
+    filters_dict[CHAT_ID].add("hello", "hi")
+    client = FakeClient()
+    replies_before_delete = []
+    delete_messages = client.delete_messages
+
+    async def recording_delete(*args, **kwargs):
+        replies_before_delete.append(client.calls["send_message"])
+        return await delete_messages(*args, **kwargs)
+
+    client.delete_messages = recording_delete
+    executor = UpdateExecutor()
+
+    async def scenario():
+        # Every message from a different member, so only the blacklist acts.
+        for index in range(25):
+            user = client.user(1000 + index)
+            executor.submit(client, types.Message(client=client, id=index + 1, chat=client.chat(CHAT_ID), from_user=user, text=f"hello {index}"))
+        spam = types.Message(client=client, id=26, chat=client.chat(CHAT_ID), from_user=client.user(999), text="buy spam now")
+        executor.submit(client, spam)
+        await executor.close(timeout=5)
+        await Pikachu02.outbound.close(timeout=5)
+
+    run(scenario())
+    assert executor.processed == 26
+    assert client.calls["send_message"] == 25
+    assert len(replies_before_delete) == 1 and replies_before_delete[0] < 25
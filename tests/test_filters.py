@@ -0,0 +1,41 @@
+"""ChatFilters word index and merged regex alternation."""
+import re
+
+import pytest
+
+from Pikachu02 import ChatFilters
+
+def test_word_and_phrase_triggers():
+    chat_filters = ChatFilters()
+    chat_filters.add("hello", "hi")
+    chat_filters.add("good night", "sleep well")
+    assert chat_filters.match("well HELLO there") == ("hello", "hi")
+    assert chat_filters.match("good night all") == ("good night", "sleep well")
+    assert chat_filters.match("goodnight") is None
+
+def test_merged_regexes_report_their_own_trigger():
+    chat_filters = ChatFilters()
+    chat_filters.add("re:c[ao]t", "meow")
+    chat_filters.add("re:d(?:o|u)g", "woof")
+    chat_filters.add("v1.2!", "release")
+    assert chat_filters.match("a DOG") == ("re:d(?:o|u)g", "woof")
+    assert chat_filters.match("the cot") == ("re:c[ao]t", "meow")
+    assert chat_filters.match("got v1.2! today") == ("v1.2!", "release")
+    assert chat_filters.hits["re:c[ao]t"] == 1
+
+def test_backreferences_and_flags_compile_separately():
+    chat_filters = ChatFilters()
+    chat_filters.add(r"re:(\w)\1", "double")
+    chat_filters.add("re:(?s)start.end", "dotall")
+    chat_filters.add("re:cat", "cat")
+    assert chat_filters.match("a cat") == ("re:cat", "cat")
+    assert chat_filters.match("look at the cat") == (r"re:(\w)\1", "double")
+    assert chat_filters.match("start\nend") == ("re:(?s)start.end", "dotall")
+    assert chat_filters.match("abc") is None
+
+@pytest.mark.parametrize("trigger", ["re:(a", r"re:x(?i)y", r"re:\2(a)"])
+def test_invalid_regex_is_rejected(trigger):
+    chat_filters = ChatFilters()
+    with pytest.raises(re.error):
+        chat_filters.add(trigger, "x")
+    assert len(chat_filters) == 0
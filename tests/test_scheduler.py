@@ -0,0 +1,36 @@
+"""Timed moderation jobs: permanent actions must not be undone by an earlier timed one."""
+from pyrogram import types
+
+from Pikachu02 import apply_warn_tier, dispatch_update, parse_warn_tiers, scheduler
+from fake_client import FakeClient
+
+ADMIN_ID = 1
+CHAT_ID = -7
+
+def command(client, text):
+    return types.Message(client=client, id=1, chat=client.chat(CHAT_ID), from_user=client.user(ADMIN_ID), text=text)
+
+def pending(kind, user_id):
+    return (kind, CHAT_ID, user_id) in scheduler._keys
+
+def test_ban_cancels_pending_unban(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    run(dispatch_update(client, command(client, "/tban 555 1h")))
+    assert pending("unban", 555)
+    run(dispatch_update(client, command(client, "/ban 555")))
+    assert client.calls["ban_chat_member"] == 2
+    assert not pending("unban", 555)
+
+def test_indefinite_tier_mute_cancels_pending_unmute(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    run(dispatch_update(client, command(client, "/mute 556 60")))
+    assert pending("unmute", 556)
+    tier, = parse_warn_tiers("3 mute")
+    run(apply_warn_tier(client, CHAT_ID, client.user(556), tier, ADMIN_ID))
+    assert not pending("unmute", 556)
+
+def test_permanent_massban_cancels_pending_unban(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    run(dispatch_update(client, command(client, "/tban 557 1d")))
+    run(dispatch_update(client, command(client, "/massban 557 558")))
+    assert not pending("unban", 557)
@@ -0,0 +1,57 @@
+"""Store write-behind batching and schema migrations, on a temporary SQLite file."""
+import sqlite3
+
+from Pikachu02 import MIGRATIONS, SCHEMA_VERSION, Store
+
+def database_at(path, version):
+    """A database file migrated by hand up to `version`, the way an older release left it."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.create_function("py_lower", 1, str.lower)
+    for script in MIGRATIONS[:version]:
+        conn.executescript(script)
+    conn.execute(f"PRAGMA user_version = {version}")
+    return conn
+
+def test_writes_are_coalesced_until_flush(tmp_path, run):
+    store = Store(str(tmp_path / "bot.db"))
+    store._conn, version = store._connect()
+    assert version == 0
+    store.put("settings", -1, "rules", "old")
+    store.put("settings", -1, "rules", "new")
+    store.put("blacklist", -1, "spam")
+    store.delete("blacklist", -1, "spam")
+    assert run(store.fetch_settings(-1)) == {"rules": "new"}
+    assert store._conn.execute("SELECT COUNT(*) FROM settings").fetchone()[0] == 0
+    run(store.flush())
+    assert store._conn.execute("SELECT chat_id, key, value FROM settings").fetchall() == [(-1, "rules", "new")]
+    assert store._conn.execute("SELECT COUNT(*) FROM blacklist").fetchone()[0] == 0
+    store._conn.close()
+
+def test_migration_5_expands_warning_counts(tmp_path):
+    path = str(tmp_path / "bot.db")
+    old = database_at(path, 4)
+    old.execute("INSERT INTO warnings VALUES (-1, 5, 3), (-1, 6, 1)")
+    old.execute("INSERT INTO jobs VALUES (1, 0, 'expire_warnings', -1, 5), (2, 0, 'unban', -1, 6)")
+    old.close()
+    conn, version = Store(path)._connect()
+    assert version == 4
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    rows = conn.execute("SELECT user_id, expires_at FROM warns ORDER BY user_id").fetchall()
+    assert rows == [(5, None)] * 3 + [(6, None)]
+    assert conn.execute("SELECT kind FROM jobs").fetchall() == [("unban",)]
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'warnings'").fetchall()
+    conn.close()
+
+def test_migration_4_keeps_notes_that_differ_only_by_case(tmp_path):
+    path = str(tmp_path / "bot.db")
+    old = database_at(path, 3)
+    old.executemany("INSERT INTO notes VALUES (?, ?, ?)", [
+        (-1, "Rules", "first"), (-1, "rules", "second"), (-1, "RULES", "third"), (-1, "Faq", "faq"), (-2, "Rules", "other chat"),
+    ])
+    old.close()
+    conn, _ = Store(path)._connect()
+    notes = dict(conn.execute("SELECT text, name FROM notes"))
+    assert notes["second"] == "rules"
+    assert notes["first"] == "rules_1" and notes["third"] == "rules_3"
+    assert notes["faq"] == "faq" and notes["other chat"] == "rules"
+    conn.close()
@@ -0,0 +1,63 @@
+"""Warning expiry and escalation tiers, run against benchmarks/fake_client.FakeClient.
+
+    python -m pytest tests
+"""
+from pyrogram import types
+
+from Pikachu02 import WarnBook, add_warning, apply_warn_tier, dispatch_update, parse_warn_tiers, warn_book
+from fake_client import FakeClient
+
+DAY = 86400
+ADMIN_ID = 1
+CHAT_ID = -11
+
+def command(client, text):
+    return types.Message(client=client, id=1, chat=client.chat(CHAT_ID), from_user=client.user(ADMIN_ID), text=text)
+
+def test_shortened_expiry_keeps_older_warnings():
+    book = WarnBook()
+    book.add(-1, 5, 0, "", 30 * DAY, now=0)
+    book.add(-1, 5, 0, "", DAY, now=10)
+    book.sweep(now=2 * DAY)
+    assert len(book.active(-1, 5, now=2 * DAY)) == 1
+
+def test_lengthened_expiry_drops_lapsed_warnings():
+    book = WarnBook()
+    book.add(-1, 5, 0, "", DAY, now=0)
+    book.add(-1, 5, 0, "", 30 * DAY, now=10)
+    assert len(book.active(-1, 5, now=2 * DAY)) == 1
+
+def test_mute_tier_without_duration(run):
+    client = FakeClient()
+    tier, = parse_warn_tiers("3 mute")
+    text = run(apply_warn_tier(client, -1, client.user(500), tier, actor=1))
+    assert client.calls["restrict_chat_member"] == 1
+    assert text.startswith("🔇 Muted") and " for " not in text
+
+def test_lowered_policy_applies_last_tier(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    target = client.user(501)
+    run(dispatch_update(client, command(client, "/warnpolicy 5 ban")))
+    for _ in range(3):
+        run(add_warning(client, CHAT_ID, target, ADMIN_ID))
+    run(dispatch_update(client, command(client, "/warnpolicy 2 ban")))
+    text = run(add_warning(client, CHAT_ID, target, ADMIN_ID))
+    assert client.calls["ban_chat_member"] == 1 and "Warnings: 4/2" not in text
+    assert warn_book.count(CHAT_ID, 501) == 0
+
+def test_failed_last_tier_is_retried(run):
+    client = FakeClient(admins=(ADMIN_ID,))
+    target = client.user(502)
+    run(dispatch_update(client, command(client, "/warnpolicy 1 mute, 2 ban")))
+    ban_chat_member = client.ban_chat_member
+
+    async def failing_ban(*args, **kwargs):
+        raise RuntimeError("not enough rights")
+
+    client.ban_chat_member = failing_ban
+    run(add_warning(client, CHAT_ID, target, ADMIN_ID))
+    assert "Ban failed" in run(add_warning(client, CHAT_ID, target, ADMIN_ID))
+    client.ban_chat_member = ban_chat_member
+    run(add_warning(client, CHAT_ID, target, ADMIN_ID))
+    assert client.calls["ban_chat_member"] == 1
+    assert warn_book.count(CHAT_ID, 502) == 0